@@ -30,23 +30,50 @@
    Alias for all address spaces
 
 """
+import bisect
+import struct
+import weakref
+
 from rekall import registry
 from rekall import utils
 
 
-class TranslationLookasideBuffer(utils.FastStore):
+class TranslationLookasideBuffer(object):
     """An implementation of a TLB.
 
-    This can be used by an address space to cache translations.
+    This can be used by an address space to cache translations. Like a hardware
+    TLB it is direct mapped: each virtual page can only live in one slot of a
+    fixed size array, so lookups and updates need no LRU bookkeeping.
     """
 
     PAGE_SHIFT = 12
     PAGE_MASK = ~ 0xFFF
 
+    def __init__(self, max_size=1000):
+        # Round the size up to a power of 2 so the slot is just a mask.
+        size = 1
+        while size < max_size:
+            size <<= 1
+
+        self._slot_mask = size - 1
+        self._pages = [None] * size
+        self._paddrs = [None] * size
+        self.hits = self.misses = 0
+
     def Get(self, vaddr):
-        result = super(TranslationLookasideBuffer, self).Get(
-            vaddr >> self.PAGE_SHIFT)
+        """Returns the cached physical address (which may be None).
 
+        Raises:
+          KeyError: If the translation is not cached.
+        """
+        page = vaddr >> self.PAGE_SHIFT
+        slot = page & self._slot_mask
+        if self._pages[slot] != page:
+            self.misses += 1
+            raise KeyError(vaddr)
+
+        self.hits += 1
+        result = self._paddrs[slot]
         if result is not None:
             return result + (vaddr & 0xFFF)
 
@@ -54,8 +81,103 @@ class TranslationLookasideBuffer(utils.FastStore):
         if paddr is not None:
             paddr = paddr & self.PAGE_MASK
 
-        super(TranslationLookasideBuffer, self).Put(
-            vaddr >> self.PAGE_SHIFT, paddr)
+        page = vaddr >> self.PAGE_SHIFT
+        slot = page & self._slot_mask
+        self._pages[slot] = page
+        self._paddrs[slot] = paddr
+
+    def Flush(self):
+        self._pages = [None] * len(self._pages)
+        self._paddrs = [None] * len(self._paddrs)
+
+
+class TranslationStatistics(object):
+    """Collects the hit/miss counters of a session's translation caches.
+
+    Paged address spaces register their caches (e.g. the TLB and the paging
+    structure cache) here so the efficiency of address translation can be
+    inspected across all the address spaces in the session.
+    """
+
+    def __init__(self):
+        self._caches = {}
+
+    def Register(self, kind, cache):
+        """Register a cache with hits and misses counters."""
+        self._caches.setdefault(kind, weakref.WeakSet()).add(cache)
+
+    def Summary(self):
+        """Returns a dict of {kind: dict(hits=.., misses=.., caches=..)}."""
+        result = {}
+        for kind, caches in self._caches.iteritems():
+            caches = list(caches)
+            result[kind] = dict(
+                hits=sum(x.hits for x in caches),
+                misses=sum(x.misses for x in caches),
+                caches=len(caches))
+
+        return result
+
+
+class AddressRangeMap(object):
+    """A compact sorted list of merged (voffset, poffset, length) runs.
+
+    The runs are held in parallel arrays so that large maps take little memory
+    and can be searched by bisection.
+    """
+
+    def __init__(self, ranges=()):
+        self.voffsets = utils.Uint64Array()
+        self.poffsets = utils.Uint64Array()
+        self.lengths = utils.Uint64Array()
+
+        for voffset, poffset, length in ranges:
+            self.voffsets.append(voffset)
+            self.poffsets.append(poffset)
+            self.lengths.append(length)
+
+    def __len__(self):
+        return len(self.voffsets)
+
+    def __iter__(self):
+        return iter(zip(self.voffsets, self.poffsets, self.lengths))
+
+    def find_ranges(self, start=0, end=None):
+        """Yields the runs which overlap the range between start and end."""
+        # The run which might contain start.
+        i = max(bisect.bisect_right(self.voffsets, start) - 1, 0)
+        for i in xrange(i, len(self.voffsets)):
+            voffset = self.voffsets[i]
+            if end is not None and voffset > end:
+                break
+
+            yield voffset, self.poffsets[i], self.lengths[i]
+
+    def Serialize(self):
+        """Encode the map into a string."""
+        fmt = "<%dQ" % len(self)
+        return (struct.pack("<Q", len(self)) +
+                struct.pack(fmt, *self.voffsets) +
+                struct.pack(fmt, *self.poffsets) +
+                struct.pack(fmt, *self.lengths))
+
+    @classmethod
+    def Unserialize(cls, data):
+        """Decode a map previously encoded by Serialize()."""
+        if len(data) < 8:
+            raise ValueError("Address range map is truncated.")
+
+        count = struct.unpack_from("<Q", data)[0]
+        if len(data) != 8 + count * 24:
+            raise ValueError("Address range map has an invalid length.")
+
+        fields = struct.unpack_from("<%dQ" % (count * 3), data, 8)
+
+        return cls(zip(fields[:count], fields[count:2 * count],
+                       fields[2 * count:]))
+
+    def __repr__(self):
+        return "<%s (%d runs)>" % (self.__class__.__name__, len(self))
 
 
 class BaseAddressSpace(object):
@@ -134,6 +256,16 @@ class BaseAddressSpace(object):
         """Return a string describing an address."""
         return "%#x" % addr
 
+    def reopen(self):
+        """Reopen any file handles this address space reads from.
+
+        This is called in worker processes forked from the main process. The
+        file position of inherited file handles is shared with the parent, so
+        they can not be used concurrently by several processes.
+        """
+        if self.base is not None and self.base is not self:
+            self.base.reopen()
+
     def read(self, unused_addr, length):
         """Should be overridden by derived classes."""
         if length > self.session.GetParameter("buffer_size"):
@@ -168,11 +300,19 @@ class BaseAddressSpace(object):
         space are contiguous does not mean they are also contiguous in the
         physical address space.
         """
+        # Only unbounded queries build the full map. A bounded query (e.g.
+        # dumping a single VAD) on a fresh address space just walks the range
+        # it needs.
+        range_map = self.get_address_range_map(build=end is None)
         if end is None:
             end = 0xfffffffffffff
 
-        for voffset, poffset, length in self._get_address_ranges(
-                start=start, end=end):
+        if range_map is not None:
+            ranges = range_map.find_ranges(start=start, end=end)
+        else:
+            ranges = self._get_address_ranges(start=start, end=end)
+
+        for voffset, poffset, length in ranges:
             # The entire range is below what is required - ignore it.
             if voffset + length < start:
                 continue
@@ -190,6 +330,52 @@ class BaseAddressSpace(object):
             if range_end > range_start:
                 yield range_start, phys_range_start, range_end - range_start
 
+    def address_range_cache_key(self):
+        """A name which identifies the address ranges of this address space.
+
+        Address spaces which return a key have their merged address ranges
+        cached (see get_address_range_map()). The physical address space is
+        identified by the image itself so it returns an empty key. Address
+        spaces stacked on top of it should derive their key from their base's
+        key and whatever determines their mapping (e.g. the DTB).
+
+        Returns:
+          A string or None if the address ranges should not be cached.
+        """
+        if self is self.session.physical_address_space:
+            return ""
+
+    def get_address_range_map(self, build=True):
+        """Returns the cached AddressRangeMap for this address space.
+
+        For non volatile images the address ranges can not change, so we
+        calculate the merged runs once and keep them in the session's image
+        cache (which may also persist them on disk).
+
+        Args:
+          build: If False, only return a map which is already cached.
+
+        Returns:
+          An AddressRangeMap or None if the ranges can not be cached.
+        """
+        if self.volatile or self.session.volatile:
+            return None
+
+        key = self.address_range_cache_key()
+        if not key:
+            return None
+
+        name = "address_ranges/%s" % key
+        result = self.session.image_cache.Get(
+            name, decoder=AddressRangeMap.Unserialize)
+
+        if result is None and build:
+            result = AddressRangeMap(self._get_address_ranges())
+            self.session.image_cache.Put(
+                name, result, encoder=AddressRangeMap.Serialize)
+
+        return result
+
     def _get_address_ranges(self, start=0, end=None):
         """Generates merged address ranges from get_available_addresses()."""
         contiguous_voffset = 0
@@ -241,6 +427,26 @@ class BaseAddressSpace(object):
         # For physical address spaces, this is a noop.
         return addr
 
+    def vtop_many(self, addresses):
+        """Translate many virtual addresses at once.
+
+        Address spaces which can translate a batch of addresses more
+        efficiently than one at a time should override this.
+
+        Returns:
+          A list of physical addresses (or None for unmapped addresses) in the
+          same order as addresses.
+        """
+        return [self.vtop(x) for x in addresses]
+
+    def read_many(self, addresses, length):
+        """Read length bytes from each of the addresses.
+
+        Returns:
+          A list of strings in the same order as addresses.
+        """
+        return [self.read(x, length) for x in addresses]
+
     @classmethod
     def metadata(cls, name, default=None):
         """Obtain metadata about this address space."""
@@ -284,8 +490,15 @@ class BufferAddressSpace(BaseAddressSpace):
 
     def read(self, addr, length):
         offset = addr - self.base_offset
+        if offset == 0 and length == len(self.data):
+            # Whole buffer reads do not need to copy the data.
+            return self.data
+
         data = self.data[offset: offset + length]
-        return data + "\x00" * (length - len(data))
+        if len(data) < length:
+            data += "\x00" * (length - len(data))
+
+        return data
 
     def write(self, addr, data):
         self.data = self.data[:addr] + data + self.data[addr + len(data):]
@@ -53,5 +53,37 @@ class RunBasedTest(testlib.RekallBaseUnitTestCase):
         self.assertEqual(self.contiguous_as.read(2000, 10),
                          "\x00" * 10)
 
+
+class AddressRangeMapTest(testlib.RekallBaseUnitTestCase):
+    """Test the AddressRangeMap implementation."""
+
+    def setUp(self):
+        self.range_map = addrspace.AddressRangeMap(
+            [(0x1000, 0x5000, 0x1000), (0x4000, 0x2000, 0x2000),
+             (0x10000, 0x0, 0x1000)])
+
+    def testFindRanges(self):
+        self.assertEqual(list(self.range_map.find_ranges(0x4800, 0x8000)),
+                         [(0x4000, 0x2000, 0x2000)])
+
+        self.assertEqual(list(self.range_map.find_ranges(0, 0x4000)),
+                         [(0x1000, 0x5000, 0x1000), (0x4000, 0x2000, 0x2000)])
+
+        self.assertEqual(list(self.range_map.find_ranges(0x20000)),
+                         [(0x10000, 0x0, 0x1000)])
+
+    def testSerialization(self):
+        data = self.range_map.Serialize()
+        self.assertEqual(
+            list(addrspace.AddressRangeMap.Unserialize(data)),
+            list(self.range_map))
+
+        # Truncated data must be rejected with a ValueError.
+        for length in (4, len(data) - 8):
+            self.assertRaises(ValueError,
+                              addrspace.AddressRangeMap.Unserialize,
+                              data[:length])
+
+
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,295 @@
+# Rekall Memory Forensics
+# Copyright 2015 Google Inc. All Rights Reserved.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or (at
+# your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA 02111-1307 USA
+#
+
+"""Caching of data derived from an image.
+
+Many expensive computations (e.g. walking the page tables of a process) produce
+results which depend only on the content of the image. For non-volatile images
+these results can not change, so we keep them in memory for the lifetime of the
+session, and optionally store them on disk so later sessions on the same image
+can reuse them.
+
+Images are identified by a fingerprint derived from the layout and a sample of
+the content of the physical address space. Persisted data is stored in the
+cache_dir under images/<fingerprint>/.
+
+Similarly, profiles loaded from repositories are kept in a binary format in the
+cache_dir under profiles/ since parsing the JSON profiles dominates the start up
+time of short sessions.
+"""
+
+import hashlib
+import json
+import marshal
+import os
+import struct
+import tempfile
+
+from rekall import config
+from rekall import constants
+from rekall import io_manager
+
+
+config.DeclareOption(
+    "--persistent_cache", default=False, type="Boolean",
+    help="Store data derived from non-volatile images (e.g. address range "
+    "maps) in the cache_dir so later sessions on the same image can reuse it.")
+
+
+config.DeclareOption(
+    "--profile_cache", default=True, type="Boolean",
+    help="Keep a binary copy of profiles loaded from repositories in the "
+    "cache_dir. This is much faster to load than the JSON profile.")
+
+
+def GetCacheDirectory(session, *components):
+    """Returns the path of a directory in the cache_dir (or None)."""
+    cache_dir = session.GetParameter("cache_dir")
+    if not cache_dir:
+        return None
+
+    # Cache dir may be specified relative to the home directory.
+    if config.GetHomeDir():
+        cache_dir = os.path.join(config.GetHomeDir(), cache_dir)
+
+    return os.path.join(cache_dir, *components)
+
+
+def GetImageFingerprint(address_space, samples=32, sample_size=0x1000):
+    """Calculate a fingerprint for the image in the address space.
+
+    Hashing the whole image is too expensive, so we hash the address space
+    layout, and a sample of pages spread evenly over the available ranges.
+    """
+    hasher = hashlib.sha1(address_space.__class__.__name__)
+    ranges = []
+    total_length = 0
+    for run in address_space.get_available_addresses():
+        start, length = run[0], run[-1]
+        hasher.update("%#x:%#x," % (start, length))
+        ranges.append((start, length))
+        total_length += length
+
+    if total_length:
+        step = max(total_length / samples, sample_size)
+        position = 0
+        for start, length in ranges:
+            offset = position % step
+            while offset < length:
+                hasher.update(address_space.read(
+                    start + offset, min(sample_size, length - offset)))
+                offset += step
+
+            position += length
+
+    return hasher.hexdigest()
+
+
+class ImageCache(object):
+    """Storage for data derived from the session's image.
+
+    Values are always kept in memory. If the persistent_cache parameter is set
+    and the image is not volatile, values stored with an encoder are also
+    written to the cache directory, and are read back (using a decoder) by
+    later sessions on the same image.
+    """
+
+    def __init__(self, session=None):
+        self.session = session
+        self.Reset()
+
+    def Reset(self):
+        self._data = {}
+        self._address_space = None
+        self._fingerprint = None
+        self._io_manager = None
+
+    def _CheckAddressSpace(self):
+        """Flush the cache if the physical address space has changed."""
+        # Normalize a NoneObject to None (a new NoneObject is returned each
+        # time). Address spaces may define __len__ so we can not test truth.
+        address_space = self.session.physical_address_space
+        if address_space == None:
+            address_space = None
+
+        if address_space is not self._address_space:
+            self.Reset()
+            self._address_space = address_space
+
+    @property
+    def fingerprint(self):
+        self._CheckAddressSpace()
+        if self._fingerprint is None and self._address_space is not None:
+            self._fingerprint = GetImageFingerprint(self._address_space)
+
+        return self._fingerprint
+
+    def _GetIOManager(self):
+        """Returns an IOManager for the image's cache directory (or None)."""
+        if self._io_manager is not None:
+            return self._io_manager
+
+        if (not self.session.GetParameter("persistent_cache") or
+                self.session.volatile):
+            return None
+
+        fingerprint = self.fingerprint
+        cache_dir = GetCacheDirectory(self.session, "images")
+        if not cache_dir or not fingerprint:
+            return None
+
+        try:
+            self._io_manager = io_manager.DirectoryIOManager(
+                urn=os.path.join(cache_dir, fingerprint),
+                mode="w", version=None, session=self.session)
+        except IOError as e:
+            self.session.logging.debug("Image cache not available: %s", e)
+            return None
+
+        return self._io_manager
+
+    def Get(self, name, decoder=None):
+        """Retrieve a value.
+
+        Args:
+          name: The name the value was stored under.
+          decoder: If specified and the value is not in memory, a callable
+            which is used to decode the raw data stored on disk.
+
+        Returns:
+          The value or None if it is not known.
+        """
+        self._CheckAddressSpace()
+        result = self._data.get(name)
+        if result is not None or decoder is None:
+            return result
+
+        manager = self._GetIOManager()
+        if manager is None or not manager.Metadata(name):
+            return None
+
+        try:
+            result = decoder(manager.GetData(name, raw=True))
+        except (IOError, ValueError, TypeError, EOFError, struct.error) as e:
+            self.session.logging.debug(
+                "Unable to decode %s from image cache: %s", name, e)
+            return None
+
+        self._data[name] = result
+        return result
+
+    def Put(self, name, value, encoder=None):
+        """Store a value.
+
+        Args:
+          name: The name to store the value under.
+          value: The value.
+          encoder: If specified, a callable which encodes the value into a
+            string to be persisted on disk.
+        """
+        self._CheckAddressSpace()
+        self._data[name] = value
+
+        if encoder is not None:
+            manager = self._GetIOManager()
+            if manager is not None:
+                # We do not need an inventory for the image cache.
+                with manager.Create(name) as fd:
+                    fd.write(encoder(value))
+
+
+class ProfileCache(object):
+    """A binary cache of the data of profiles loaded from repositories.
+
+    Entries are keyed by the profile name, the repository and the profile's
+    metadata in the repository (i.e. its modification time), so updated
+    profiles are loaded again. The data is stored with marshal which is many
+    times faster to load than a compressed JSON file.
+    """
+
+    # Bump this when the format of the cached data changes.
+    VERSION = 1
+
+    def __init__(self, session=None):
+        self.session = session
+
+    def _GetPath(self, repository, manager, name):
+        if not self.session.GetParameter("profile_cache", True):
+            return None
+
+        metadata = manager.Metadata(name)
+        # Without a modification time we can not tell if the profile changed.
+        if not metadata.get("LastModified"):
+            return None
+
+        cache_dir = GetCacheDirectory(
+            self.session, "profiles", "v%d" % self.VERSION)
+        if not cache_dir:
+            return None
+
+        key = hashlib.sha1(json.dumps(
+            [constants.VERSION, repository, name, metadata],
+            sort_keys=True)).hexdigest()
+
+        return os.path.join(cache_dir, key)
+
+    def Get(self, repository, manager, name):
+        """Returns the cached data for the profile (or None)."""
+        path = self._GetPath(repository, manager, name)
+        if path is None or not os.access(path, os.R_OK):
+            return None
+
+        try:
+            with open(path, "rb") as fd:
+                return marshal.load(fd)
+        except (IOError, EOFError, ValueError, TypeError) as e:
+            self.session.logging.debug(
+                "Unable to load %s from the profile cache: %s", name, e)
+            return None
+
+    def Put(self, repository, manager, name, data):
+        """Stores the data for the profile."""
+        path = self._GetPath(repository, manager, name)
+        if path is None:
+            return
+
+        try:
+            dirname = os.path.dirname(path)
+            if not os.path.isdir(dirname):
+                os.makedirs(dirname)
+
+            # Write to a temporary file first so concurrent sessions never see
+            # a partial file.
+            fd, temp_path = tempfile.mkstemp(dir=dirname)
+            with os.fdopen(fd, "wb") as out_fd:
+                marshal.dump(data, out_fd)
+
+            os.rename(temp_path, path)
+        except (IOError, OSError, ValueError) as e:
+            self.session.logging.debug(
+                "Unable to store %s in the profile cache: %s", name, e)
+
+    def GetData(self, repository, manager, name):
+        """Get the profile data from the cache or the repository's manager."""
+        data = self.Get(repository, manager, name)
+        if data is None:
+            data = manager.GetData(name)
+            if data:
+                self.Put(repository, manager, name, data)
+
+        return data
@@ -0,0 +1,50 @@
+import os
+import shutil
+import tempfile
+
+from rekall import cache
+from rekall import io_manager
+from rekall import session
+from rekall import testlib
+
+
+class ProfileCacheTest(testlib.RekallBaseUnitTestCase):
+    """Test the binary profile cache."""
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.session = session.Session(
+            cache_dir=os.path.join(self.temp_dir, "cache"))
+
+        self.manager = io_manager.DirectoryIOManager(
+            urn=os.path.join(self.temp_dir, "repository"), mode="w",
+            version=None, session=self.session)
+        self.data = {"$METADATA": {"ProfileClass": "Profile"},
+                     "$CONSTANTS": {u"foo": 1}}
+        self.manager.StoreData("test/profile", self.data)
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def testProfileCache(self):
+        profile_cache = cache.ProfileCache(session=self.session)
+        self.assertEqual(
+            profile_cache.GetData("repo", self.manager, "test/profile"),
+            self.data)
+
+        # The second time the data comes from the cache.
+        get_data = self.manager.GetData
+        self.manager.GetData = None
+        self.assertEqual(
+            profile_cache.GetData("repo", self.manager, "test/profile"),
+            self.data)
+
+        # Modifying the profile invalidates the cache.
+        self.manager.GetData = get_data
+        new_data = {"$METADATA": {"ProfileClass": "Other"}}
+        self.manager.StoreData("test/profile", new_data)
+        os.utime(os.path.join(self.manager.dump_dir, "test/profile.gz"),
+                 (1, 1))
+        self.assertEqual(
+            profile_cache.GetData("repo", self.manager, "test/profile"),
+            new_data)
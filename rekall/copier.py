@@ -0,0 +1,291 @@
+# Rekall Memory Forensics
+# Copyright 2016 Google Inc. All Rights Reserved.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or (at
+# your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA 02111-1307 USA
+#
+
+"""Copying of address spaces into files.
+
+Many plugins (e.g. imagecopy, memdump, vaddump) copy ranges of an address space
+into a file. This module implements a single copy engine for all of them:
+
+- Reading from the address space and writing to the file are overlapped. Blocks
+  are read by a reader thread (or a pool of worker processes) and queued for
+  the calling thread which writes them. The number of queued blocks is bounded.
+
+- Pages which contain only zeros are not written to the end of the file.
+  Instead we seek past them, so they become holes on file systems which
+  support sparse files.
+"""
+
+import collections
+import multiprocessing
+import os
+import threading
+import Queue
+
+from rekall import config
+
+
+config.DeclareOption(
+    "--copy_processes", default=0, type="IntParser",
+    help="Number of worker processes used to read address spaces when "
+    "copying them into files. 0 or 1 reads in a thread of this process.")
+
+
+# The address space read by the worker processes. Workers are forked from the
+# parent and therefore inherit it without having to pickle it.
+_COPY_ADDRESS_SPACE = None
+
+
+def _InitCopyWorker():
+    """Prepares a freshly forked worker process for reading."""
+    # The worker must not report progress to the parent's renderer.
+    _COPY_ADDRESS_SPACE.session.progress.callbacks.clear()
+
+    # File handles inherited from the parent share their file position with
+    # it, so they must not be used concurrently.
+    _COPY_ADDRESS_SPACE.reopen()
+
+
+def _ReadBlock(block):
+    address, length = block
+    return _COPY_ADDRESS_SPACE.read(address, length)
+
+
+class AddressSpaceCopier(object):
+    """Copies ranges of an address space into a file.
+
+    The file must be seekable. Data already in the file is overwritten, but
+    zero pages past the current end of the file are left as holes.
+    """
+
+    # The size of each read from the address space.
+    block_size = 1024 * 1024
+
+    # Zero pages are detected with this granularity.
+    page_size = 0x1000
+
+    # The maximum number of blocks which are read but not yet written.
+    max_pending = 8
+
+    def __init__(self, session=None, address_space=None, fd=None,
+                 processes=None):
+        self.session = session or address_space.session
+        self.address_space = address_space
+        self.fd = fd
+
+        if processes is None:
+            processes = self.session.GetParameter("copy_processes", 0)
+
+        self.processes = processes
+        self.zero_page = "\x00" * self.page_size
+
+        # Our idea of the position of the fd. This avoids seeking for each
+        # block when the data is written sequentially.
+        self.fd.seek(0, 2)
+        self.position = self.file_size = self.fd.tell()
+
+        # The end of the copied data, including holes.
+        self.end = 0
+
+        # The number of bytes which were left as holes.
+        self.skipped = 0
+
+    def get_blocks(self, ranges):
+        """Coalesces adjacent ranges and splits them into blocks.
+
+        Args:
+          ranges: An iterable of (address, file offset, length) tuples.
+
+        Yields:
+          (address, file offset, length) tuples of at most block_size.
+        """
+        run = None
+        for address, file_offset, length in ranges:
+            # Ranges are often single pages, so we merge ranges which are
+            # contiguous in both the address space and the file.
+            if (run is not None and run[0] + run[2] == address and
+                    run[1] + run[2] == file_offset):
+                run[2] += length
+                continue
+
+            if run is not None:
+                for block in self._split_run(*run):
+                    yield block
+
+            run = [address, file_offset, length]
+
+        if run is not None:
+            for block in self._split_run(*run):
+                yield block
+
+    def _split_run(self, address, file_offset, length):
+        while length > 0:
+            to_read = min(self.block_size, length)
+            yield address, file_offset, to_read
+
+            address += to_read
+            file_offset += to_read
+            length -= to_read
+
+    def read_blocks(self, blocks):
+        """Reads the blocks in a reader thread.
+
+        Yields:
+          (file offset, data) tuples in the order of blocks.
+        """
+        queue = Queue.Queue(self.max_pending)
+        stop = threading.Event()
+
+        def Reader():
+            try:
+                for address, file_offset, length in blocks:
+                    if stop.is_set():
+                        return
+
+                    queue.put(
+                        (file_offset, self.address_space.read(address, length)))
+
+                queue.put(None)
+            except Exception as e:  # pylint: disable=broad-except
+                queue.put(e)
+
+        reader = threading.Thread(target=Reader, name="AddressSpaceCopier")
+        reader.daemon = True
+        reader.start()
+
+        try:
+            while True:
+                item = queue.get()
+                if item is None:
+                    break
+
+                if isinstance(item, Exception):
+                    raise item
+
+                yield item
+
+        finally:
+            # Unblock the reader if we stopped early.
+            stop.set()
+            while reader.is_alive():
+                try:
+                    queue.get(timeout=0.1)
+                except Queue.Empty:
+                    pass
+
+    def read_blocks_parallel(self, blocks):
+        """Reads the blocks in a pool of worker processes.
+
+        Yields the same tuples as read_blocks().
+        """
+        global _COPY_ADDRESS_SPACE  # pylint: disable=global-statement
+
+        _COPY_ADDRESS_SPACE = self.address_space
+        pool = multiprocessing.Pool(self.processes, initializer=_InitCopyWorker)
+        try:
+            pending = collections.deque()
+            for address, file_offset, length in blocks:
+                pending.append((file_offset, pool.apply_async(
+                    _ReadBlock, ((address, length), ))))
+
+                # Keep every worker busy, but do not read too far ahead of the
+                # writer.
+                if len(pending) > self.max_pending * self.processes:
+                    file_offset, result = pending.popleft()
+                    yield file_offset, result.get()
+
+            while pending:
+                file_offset, result = pending.popleft()
+                yield file_offset, result.get()
+
+            pool.close()
+        finally:
+            pool.terminate()
+            _COPY_ADDRESS_SPACE = None
+
+    def write(self, file_offset, data):
+        """Writes data at file_offset, skipping zero pages past the end."""
+        end = file_offset + len(data)
+        self.end = max(self.end, end)
+
+        # Data inside the file must always be written.
+        if file_offset < self.file_size or self.zero_page not in data:
+            self._write(file_offset, data)
+            return
+
+        run_start = None
+        for i in xrange(0, len(data), self.page_size):
+            page_end = min(i + self.page_size, len(data))
+            if data.count("\x00", i, page_end) == page_end - i:
+                if run_start is not None:
+                    self._write(file_offset + run_start, data[run_start:i])
+                    run_start = None
+
+                self.skipped += page_end - i
+
+            elif run_start is None:
+                run_start = i
+
+        if run_start is not None:
+            self._write(file_offset + run_start, data[run_start:])
+
+    def _write(self, file_offset, data):
+        if self.position != file_offset:
+            self.fd.seek(file_offset)
+
+        self.fd.write(data)
+        self.position = file_offset + len(data)
+        self.file_size = max(self.file_size, self.position)
+
+    def copy(self, ranges, progress=None):
+        """Copies the ranges into the file.
+
+        Args:
+          ranges: An iterable of (address, file offset, length) tuples.
+          progress: An optional callable which is called with the file offset
+            of each block written.
+        """
+        blocks = self.get_blocks(ranges)
+
+        # Workers inherit the address space by forking, so this is not
+        # available on Windows.
+        if self.processes > 1 and hasattr(os, "fork"):
+            data_blocks = self.read_blocks_parallel(blocks)
+        else:
+            data_blocks = self.read_blocks(blocks)
+
+        for file_offset, data in data_blocks:
+            self.write(file_offset, data)
+            if progress is not None:
+                progress(file_offset)
+
+        # Extend the file over trailing holes.
+        if self.end > self.file_size:
+            self._write(self.end - 1, "\x00")
+
+
+def CopyRanges(address_space, fd, ranges, session=None, progress=None):
+    """Copies (address, file offset, length) ranges of address_space into fd.
+
+    Returns:
+      The AddressSpaceCopier used.
+    """
+    copier = AddressSpaceCopier(
+        session=session, address_space=address_space, fd=fd)
+    copier.copy(ranges, progress=progress)
+
+    return copier
@@ -0,0 +1,61 @@
+import tempfile
+
+from rekall import addrspace_test
+from rekall import copier
+from rekall import session
+from rekall import testlib
+
+
+class AddressSpaceCopierTest(testlib.RekallBaseUnitTestCase):
+    """Test copying address spaces into files."""
+
+    def setUp(self):
+        self.session = session.Session()
+
+        # Two pages of data, with an empty page in between and at the end.
+        self.data = ("A" * 0x1000 + "\x00" * 0x1000 + "B" * 0x800 +
+                     "\x00" * 0x1800)
+        self.address_space = addrspace_test.CustomRunsAddressSpace(
+            session=self.session, data=self.data,
+            runs=[(0x10000, 0, 0x2000), (0x12000, 0x2000, 0x2000)])
+
+    def _GetCopier(self, fd=None, processes=0):
+        copier_obj = copier.AddressSpaceCopier(
+            session=self.session, address_space=self.address_space,
+            fd=fd or tempfile.TemporaryFile(), processes=processes)
+        copier_obj.block_size = 0x2000
+
+        return copier_obj
+
+    def _Copy(self, ranges, processes=0, fd=None):
+        copier_obj = self._GetCopier(fd=fd, processes=processes)
+        copier_obj.copy(ranges)
+
+        copier_obj.fd.seek(0)
+        return copier_obj, copier_obj.fd.read()
+
+    def testCopy(self):
+        # Adjacent ranges are merged and split into blocks.
+        ranges = [(0x10000, 0, 0x1000), (0x11000, 0x1000, 0x1000),
+                  (0x12000, 0x2000, 0x2000)]
+        self.assertEqual(list(self._GetCopier().get_blocks(ranges)),
+                         [(0x10000, 0, 0x2000), (0x12000, 0x2000, 0x2000)])
+
+        for processes in (0, 2):
+            copier_obj, data = self._Copy(ranges, processes=processes)
+            self.assertEqual(data, self.data)
+
+            # The empty pages are left as holes.
+            self.assertEqual(copier_obj.skipped, 0x2000)
+
+        # Ranges need not be aligned.
+        _, data = self._Copy([(0x10800, 0x10, 0x3000)])
+        self.assertEqual(data, "\x00" * 0x10 + self.data[0x800:0x3800])
+
+    def testOverwrite(self):
+        fd = tempfile.TemporaryFile()
+        fd.write("X" * 0x5000)
+
+        # Zero pages inside the file must be written.
+        _, data = self._Copy([(0x11000, 0x0, 0x1000)], fd=fd)
+        self.assertEqual(data, "\x00" * 0x1000 + "X" * 0x4000)
@@ -33,6 +33,7 @@ from rekall.entities import entity as entity_module
 from rekall.entities import definitions
 from rekall.entities import identity as entity_id
 from rekall.entities import lookup_table as entity_lookup
+from rekall.entities import serialization
 
 from efilter import expression
 from efilter import query as entity_query
@@ -140,6 +141,9 @@ class EntityManager(object):
     # Dict of entities keyed by their identity.
     entities = None
 
+    # The name under which the state is persisted in the image cache.
+    STATE_CACHE_NAME = "entities/state"
+
     def __init__(self, session):
         self.session = session
         self.reset()
@@ -150,6 +154,7 @@ class EntityManager(object):
         self.finished_collectors = set()
         self._cached_query_analyses = {}
         self._cached_matchers = {}
+        self._state_loaded = False
 
         # Lookup table on component name is such a common use case that we
         # always have it on. This actually speeds up searches by attribute that
@@ -178,6 +183,67 @@ class EntityManager(object):
         self.update_collectors()
         return self._collectors
 
+    def _can_persist(self):
+        """The state is only persisted for images (see cache.ImageCache)."""
+        return (not self.session.volatile and
+                self.session.GetParameter("persistent_cache"))
+
+    def load_state(self):
+        """Resumes from the state persisted by an earlier session.
+
+        The entities and finished collectors are restored, so collectors which
+        already ran on this image do not run again. This is done once, before
+        anything is collected.
+        """
+        if self._state_loaded:
+            return
+
+        self._state_loaded = True
+        if self.entities or not self._can_persist():
+            return
+
+        data = self.session.image_cache.Get(self.STATE_CACHE_NAME, decoder=str)
+        if data is None:
+            return
+
+        try:
+            state = serialization.DecodeState(self, data)
+        except (ValueError, TypeError, KeyError) as e:
+            logging.debug("Unable to load the persisted entities: %s", e)
+            return
+
+        if state is None:
+            return
+
+        entities = state["entities"]
+        for entity in entities:
+            for index in entity.indices:
+                self.entities[index] = entity
+
+        for lookup_table in self.lookup_tables.itervalues():
+            lookup_table.update_index(entities)
+
+        self.finished_collectors.update(state["finished_collectors"])
+        for key in state["lookups"]:
+            self.add_attribute_lookup(key)
+
+        logging.debug("Loaded %d persisted entities from %d collectors.",
+                      len(entities), len(self.finished_collectors))
+
+    def save_state(self):
+        """Persists the entities and finished collectors (see load_state)."""
+        if not self._can_persist():
+            return
+
+        try:
+            data = serialization.EncodeState(self)
+        except (ValueError, TypeError) as e:
+            # Nothing is persisted unless all the entities can be restored.
+            logging.debug("Unable to persist the entities: %s", e)
+            return
+
+        self.session.image_cache.Put(self.STATE_CACHE_NAME, data, encoder=str)
+
     def update_collectors(self):
         """Refresh the list of active collectors. Do a diff if possible."""
         for key, cls in entity_collector.EntityCollector.classes.iteritems():
@@ -540,6 +606,8 @@ class EntityManager(object):
 
             self.reset()
 
+        self.load_state()
+
         if isinstance(query, dict):
             results = {}
             for query_name, expr in query.iteritems():
@@ -614,6 +682,17 @@ class EntityManager(object):
         the collectors. This may result in faster collection, but may result
         in collectors having to run repeatedly.
         """
+        self.load_state()
+        finished_collectors = len(self.finished_collectors)
+
+        self._run_collectors(wanted, use_hint=use_hint,
+                             result_stream_handler=result_stream_handler)
+
+        # Persist the new entities so later sessions can resume from here.
+        if len(self.finished_collectors) != finished_collectors:
+            self.save_state()
+
+    def _run_collectors(self, wanted, use_hint, result_stream_handler):
         # Planning stage.
 
         if callable(result_stream_handler):
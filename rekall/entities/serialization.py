@@ -0,0 +1,328 @@
+# Rekall Memory Forensics
+#
+# Copyright 2016 Google Inc. All Rights Reserved.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or (at
+# your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA 02111-1307 USA
+#
+
+"""
+Serialization of the EntityManager's state.
+
+Collecting entities from a non-volatile image always gives the same result, so
+the EntityManager can persist its entities and finished collectors and resume
+from them in a later session on the same image.
+
+Entities are stored as their components. Values of the components are encoded
+into structures which can be marshalled: scalars are stored as they are and
+everything else is a tuple of a tag followed by the encoded state. Base objects
+are stored by their profile, address space, offset and type, and are
+instantiated again when the state is decoded.
+"""
+
+import datetime
+import marshal
+
+import pytz
+
+from rekall import addrspace
+from rekall import constants
+from rekall import obj
+
+from rekall.entities import component as entity_component
+from rekall.entities import entity as entity_module
+from rekall.entities import identity as entity_id
+
+from efilter.protocols import superposition
+
+
+# Increment this when the encoding changes.
+STATE_VERSION = 1
+
+# Types which marshal can store as they are. Subclasses are not supported by
+# marshal, so we check for the exact type.
+SCALAR_TYPES = frozenset([type(None), bool, int, long, float, str, unicode])
+
+
+class EntityEncoder(object):
+    """Encodes entities into structures which can be marshalled.
+
+    Raises TypeError for values which can not be encoded.
+    """
+
+    def __init__(self, session):
+        self.session = session
+
+    def encode_entity(self, entity):
+        result = []
+        for component in entity.components:
+            if component is None:
+                continue
+
+            values = [self.encode(component[idx])
+                      for idx in range(len(component.component_fields))]
+            result.append((component.component_name, tuple(values)))
+
+        return tuple(result)
+
+    def encode(self, value):
+        if type(value) in SCALAR_TYPES:
+            return value
+
+        if isinstance(value, datetime.datetime):
+            aware = value.tzinfo is not None
+            if aware:
+                value = value.astimezone(pytz.UTC)
+
+            return ("datetime", value.year, value.month, value.day, value.hour,
+                    value.minute, value.second, value.microsecond, aware)
+
+        if isinstance(value, entity_id.Identity):
+            return ("identity", value.global_prefix,
+                    self._encode_all(value.indices))
+
+        if isinstance(value, obj.Pointer):
+            if not isinstance(value.target, basestring):
+                raise TypeError("Pointer %r has no named target." % value)
+
+            return ("pointer", self.encode_profile(value.obj_profile),
+                    self.encode_address_space(value.obj_vm), value.v(),
+                    value.target, self.encode(value.target_args))
+
+        if isinstance(value, obj.Struct):
+            return ("struct", self.encode_profile(value.obj_profile),
+                    self.encode_address_space(value.obj_vm),
+                    value.obj_offset, value.obj_type)
+
+        if isinstance(value, tuple):
+            return ("tuple", self._encode_all(value))
+
+        if isinstance(value, (frozenset, set)):
+            return ("frozenset", self._encode_all(value))
+
+        if isinstance(value, list):
+            return ("list", self._encode_all(value))
+
+        if isinstance(value, dict):
+            return ("dict", tuple((self.encode(k), self.encode(v))
+                                  for k, v in value.iteritems()))
+
+        if superposition.insuperposition(value):
+            return ("superposition",
+                    self._encode_all(superposition.getstates(value)))
+
+        raise TypeError("Unable to encode %s of type %s." % (
+            repr(value), type(value).__name__))
+
+    def _encode_all(self, values):
+        return tuple(self.encode(x) for x in values)
+
+    def encode_profile(self, profile):
+        return profile.name
+
+    def encode_address_space(self, address_space):
+        """Encode how to get the address space again.
+
+        We can only recreate the kernel and physical address spaces and the
+        process address spaces derived from them.
+        """
+        if address_space is self.session.kernel_address_space:
+            return "kernel"
+
+        if address_space is self.session.physical_address_space:
+            return "physical"
+
+        dtb = getattr(address_space, "dtb", None)
+        if (dtb is not None and
+                address_space.base is self.session.physical_address_space):
+            return ("dtb", type(address_space).__name__, dtb)
+
+        raise TypeError("Unable to encode address space %r." % address_space)
+
+
+class EntityDecoder(object):
+    """Decodes entities encoded by the EntityEncoder.
+
+    Raises ValueError if the encoded data is not valid for this session.
+    """
+
+    def __init__(self, manager):
+        self.manager = manager
+        self.session = manager.session
+        self._profiles = {}
+        self._address_spaces = {}
+
+        # Many entities refer to the same objects, so we only create them once.
+        self._objects = {}
+
+    def decode_entity(self, encoded):
+        components = {}
+        for component_name, values in encoded:
+            component_cls = entity_component.Component.classes.get(
+                component_name)
+            if component_cls is None:
+                raise ValueError("Unknown component %s." % component_name)
+
+            # The values were coerced when they were collected, so coercing
+            # them again in the constructor does not change them.
+            components[component_name] = component_cls(
+                *[self.decode(x) for x in values])
+
+        return entity_module.Entity(
+            components=entity_component.CONTAINER_PROTOTYPE._replace(
+                **components),
+            entity_manager=self.manager)
+
+    def decode(self, value):
+        if type(value) is not tuple:
+            return value
+
+        tag = value[0]
+        if tag in ("struct", "pointer"):
+            result = self._objects.get(value)
+            if result is None:
+                result = self._objects[value] = self._decode_object(value)
+
+            return result
+
+        if tag == "datetime":
+            result = datetime.datetime(*value[1:8])
+            if value[8]:
+                result = result.replace(tzinfo=pytz.UTC)
+
+            return result
+
+        if tag == "identity":
+            return entity_id.Identity(indices=self._decode_all(value[2]),
+                                      global_prefix=value[1])
+
+        if tag == "tuple":
+            return tuple(self._decode_all(value[1]))
+
+        if tag == "frozenset":
+            return frozenset(self._decode_all(value[1]))
+
+        if tag == "list":
+            return self._decode_all(value[1])
+
+        if tag == "dict":
+            return dict((self.decode(k), self.decode(v)) for k, v in value[1])
+
+        if tag == "superposition":
+            return superposition.meld(*self._decode_all(value[1]))
+
+        raise ValueError("Unknown tag %r." % tag)
+
+    def _decode_all(self, values):
+        return [self.decode(x) for x in values]
+
+    def _decode_object(self, value):
+        profile = self.decode_profile(value[1])
+        address_space = self.decode_address_space(value[2])
+
+        if value[0] == "pointer":
+            return profile.Pointer(value=value[3], vm=address_space,
+                                   target=value[4],
+                                   target_args=self.decode(value[5]))
+
+        return profile.Object(type_name=value[4], offset=value[3],
+                              vm=address_space)
+
+    def decode_profile(self, name):
+        profile = self._profiles.get(name)
+        if profile is None:
+            if name == self.session.profile.name:
+                profile = self.session.profile
+            else:
+                profile = self.session.LoadProfile(name)
+
+            if not profile:
+                raise ValueError("Unable to load profile %s." % name)
+
+            self._profiles[name] = profile
+
+        return profile
+
+    def decode_address_space(self, value):
+        if value == "kernel":
+            return self.session.kernel_address_space
+
+        if value == "physical":
+            return self.session.physical_address_space
+
+        address_space = self._address_spaces.get(value)
+        if address_space is None:
+            _, as_name, dtb = value
+            as_cls = addrspace.BaseAddressSpace.classes.get(as_name)
+            if as_cls is None:
+                raise ValueError("Unknown address space %s." % as_name)
+
+            address_space = self._address_spaces[value] = as_cls(
+                base=self.session.physical_address_space,
+                session=self.session, dtb=dtb)
+
+        return address_space
+
+
+def EncodeState(manager):
+    """Serialize the entities and finished collectors of the manager.
+
+    Returns:
+      A string.
+
+    Raises:
+      TypeError or ValueError if some entity can not be encoded.
+    """
+    encoder = EntityEncoder(manager.session)
+
+    # An entity is stored under each of its indices, but we only need it once.
+    entities = dict((id(x), x) for x in manager.entities.itervalues())
+
+    return marshal.dumps(dict(
+        state_version=STATE_VERSION,
+        version=constants.VERSION,
+        profile=manager.session.profile.name,
+        finished_collectors=tuple(manager.finished_collectors),
+        # Only the attribute lookup tables have to be recreated on load.
+        lookups=tuple(key for key in manager.lookup_tables if "/" in key),
+        entities=tuple(encoder.encode_entity(x)
+                       for x in entities.itervalues())))
+
+
+def DecodeState(manager, data):
+    """Unserialize the data from EncodeState().
+
+    Returns:
+      A dict with the entities, finished_collectors and lookups of the state,
+      or None if the state was saved by another version or for another profile.
+
+    Raises:
+      ValueError if the data is not valid.
+    """
+    try:
+        state = marshal.loads(data)
+    except (EOFError, TypeError) as e:
+        raise ValueError(e)
+
+    if (not isinstance(state, dict) or
+            state.get("state_version") != STATE_VERSION or
+            state.get("version") != constants.VERSION or
+            state.get("profile") != manager.session.profile.name):
+        return None
+
+    decoder = EntityDecoder(manager)
+    return dict(
+        entities=[decoder.decode_entity(x) for x in state["entities"]],
+        finished_collectors=state["finished_collectors"],
+        lookups=state["lookups"])
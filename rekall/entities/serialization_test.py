@@ -0,0 +1,127 @@
+import datetime
+import shutil
+import tempfile
+
+import pytz
+
+from rekall import addrspace
+from rekall import session
+from rekall import testlib
+from rekall.entities import definitions
+from rekall.entities import serialization
+from rekall.plugins.overlays import basic
+
+from efilter.protocols import superposition
+
+
+class SerializationTestProfile(basic.ProfileLP64, basic.BasicClasses):
+    """A profile with a single struct."""
+
+    @classmethod
+    def Initialize(cls, profile):
+        super(SerializationTestProfile, cls).Initialize(profile)
+        profile.add_types({
+            'task': [0x10, {
+                'pid': [0x0, ['unsigned int']],
+            }],
+        })
+
+
+class EntityManagerStateTest(testlib.RekallBaseUnitTestCase):
+    """Test persisting the entities of an image."""
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.data = "\x00" * 0x1000
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+
+    def _GetSession(self):
+        new_session = session.Session(
+            cache_dir=self.cache_dir, persistent_cache=True)
+        new_session.physical_address_space = addrspace.BufferAddressSpace(
+            data=self.data, session=new_session)
+        new_session.kernel_address_space = new_session.physical_address_space
+        new_session.profile = SerializationTestProfile(session=new_session)
+
+        return new_session
+
+    def _Register(self, manager, pid, offset, **kwargs):
+        task = manager.session.profile.task(
+            offset=offset, vm=manager.session.kernel_address_space)
+
+        return manager.register_components(
+            identity=manager.identify({"Struct/base": task}),
+            components=[
+                definitions.Struct(base=task, type="task"),
+                definitions.Process(pid=pid, cr3=task, **kwargs)],
+            source_collector="TestCollector")[0]
+
+    def testLoadState(self):
+        manager = self._GetSession().entities
+        created_at = datetime.datetime(2016, 1, 2, 3, 4, 5, 6, tzinfo=pytz.UTC)
+
+        parent = self._Register(manager, 1, 0x100, command=u"init",
+                                arguments=["init", "-s"])
+        self._Register(manager, 2, 0x200, command=u"sh",
+                       parent=parent.identity)
+        command = self._Register(manager, 2, 0x200, command=u"bash").get_raw(
+            "Process/command")
+        manager.register_components(
+            identity=parent.identity,
+            components=[definitions.Timestamps(created_at=created_at)],
+            source_collector="OtherCollector")
+
+        manager.finished_collectors.add("TestCollector")
+        manager.save_state()
+
+        # A new session on the same image resumes from the saved state.
+        manager = self._GetSession().entities
+        manager.load_state()
+        self.assertEqual(manager.finished_collectors, set(["TestCollector"]))
+
+        entities = set(manager.entities.itervalues())
+        self.assertEqual(len(entities), 2)
+
+        parent, child = sorted(entities, key=lambda x: x["Process/pid"])
+        self.assertEqual(parent["Struct/base"].obj_offset, 0x100)
+        self.assertEqual(parent["Struct/base"].obj_vm,
+                         manager.session.kernel_address_space)
+        self.assertEqual(parent["Process/cr3"].v(), 0x100)
+        self.assertEqual(parent["Timestamps/created_at"], created_at)
+        self.assertEqual(parent["Process/arguments"],
+                         frozenset(["init", "-s"]))
+        self.assertEqual(parent.collectors,
+                         frozenset(["TestCollector", "OtherCollector"]))
+
+        self.assertEqual(child.get_raw("Process/parent"), parent.identity)
+        self.assertEqual(child.get_raw("Process/command"), command)
+
+        # The lookup tables are rebuilt.
+        self.assertEqual(manager.find_by_collector("OtherCollector"),
+                         [parent])
+
+    def testEncode(self):
+        manager = self._GetSession().entities
+        encoder = serialization.EntityEncoder(manager.session)
+        decoder = serialization.EntityDecoder(manager)
+
+        for value in [None, 1, u"foo", ("a", (1, 2L)), frozenset([1, 2]),
+                      datetime.datetime(2016, 1, 2), {"target": "task"}]:
+            self.assertEqual(decoder.decode(encoder.encode(value)), value)
+
+        value = decoder.decode(encoder.encode(superposition.meld(1, 2)))
+        self.assertEqual(superposition.getstates(value), set([1, 2]))
+
+        self.assertRaises(TypeError, encoder.encode, object())
+
+    def testVolatile(self):
+        manager = self._GetSession().entities
+        self._Register(manager, 1, 0x100)
+        manager.session.physical_address_space.volatile = True
+        manager.save_state()
+
+        manager = self._GetSession().entities
+        manager.load_state()
+        self.assertEqual(manager.entities, {})
@@ -30,6 +30,9 @@ __author__ = ("Michael Cohen <scudette@gmail.com> based on original code "
               "by Mike Auty")
 
 import atexit
+import array
+import bisect
+import collections
 import inspect
 import json
 import logging
@@ -46,6 +49,11 @@ from rekall.ui import renderer
 
 import traceback
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 
 class ProfileLog(object):
     # Point this environment variable into a filename we will use to store
@@ -301,6 +309,146 @@ class ProfileError(Error):
     """Errors in setting the profile."""
 
 
+class StructSnapshot(object):
+    """A copy of the data of a struct, taken when the struct was created.
+
+    Members of a snapshotted struct are decoded from this copy, rather than
+    each issuing its own read through the address space.
+    """
+
+    def __init__(self, vm=None, offset=0, data=""):
+        self.vm = vm
+        self.offset = offset
+        self.data = data
+
+    def read(self, vm, offset, length):
+        """Returns the data if it is entirely in the snapshot, else None."""
+        if vm is not self.vm:
+            return None
+
+        start = offset - self.offset
+        if start < 0 or start + length > len(self.data):
+            return None
+
+        return self.data[start:start + length]
+
+
+class StructDecoder(object):
+    """Decodes all the fixed offset native members of a struct in one call.
+
+    The profile compiles one of these for each struct type. Members are laid
+    out into as few struct.Struct unpackers as possible (overlapping members,
+    e.g. in unions, need more than one).
+    """
+
+    def __init__(self, fields=None, nested=None):
+        """Constructor.
+
+        Args:
+          fields: A list of (name, offset, format_string, start_bit, mask)
+            tuples. If mask is not None, the value is calculated as
+            (value & mask) >> start_bit.
+
+          nested: A list of (name, offset, type_name) tuples for members which
+            are themselves structs.
+        """
+        self.names = []
+        self.fields = list(fields or [])
+        self.nested = list(nested or [])
+
+        # Each distinct storage unit (offset, format_string) is decoded once.
+        units = {}
+        for _, offset, format_string, _, _ in sorted(
+                fields or [], key=lambda x: x[1]):
+            units.setdefault((offset, format_string), None)
+
+        # Each layer is (byte order, end offset, format parts, units).
+        layers = []
+        for offset, format_string in sorted(units):
+            byte_order, code = format_string[0], format_string[1:]
+            for layer in layers:
+                if layer[0] == byte_order and layer[1] <= offset:
+                    break
+            else:
+                layer = [byte_order, 0, [], []]
+                layers.append(layer)
+
+            if offset > layer[1]:
+                layer[2].append("%dx" % (offset - layer[1]))
+
+            layer[1] = offset + struct.calcsize(format_string)
+            layer[2].append(code)
+            layer[3].append((offset, format_string))
+
+        self._unpackers = []
+        index = 0
+        for byte_order, _, parts, layer_units in layers:
+            self._unpackers.append(struct.Struct(byte_order + "".join(parts)))
+            for unit in layer_units:
+                units[unit] = index
+                index += 1
+
+        self.size = max([x[1] for x in layers] or [0])
+
+        self._fields = []
+        simple = True
+        for name, offset, format_string, start_bit, mask in fields or []:
+            self.names.append(name)
+            self._fields.append(
+                (units[(offset, format_string)], start_bit, mask))
+            if mask is not None:
+                simple = False
+
+        # If every unit is a single field in the same order, no further
+        # processing is needed.
+        self._simple = simple and (
+            [x[0] for x in self._fields] == range(len(units)))
+
+    def unpack(self, data, offset=0):
+        """Returns a tuple of the values of all fields, in names order."""
+        if len(self._unpackers) == 1:
+            raw = self._unpackers[0].unpack_from(data, offset)
+        else:
+            raw = ()
+            for unpacker in self._unpackers:
+                raw += unpacker.unpack_from(data, offset)
+
+        if self._simple:
+            return raw
+
+        result = []
+        for index, start_bit, mask in self._fields:
+            value = raw[index]
+            if mask is not None:
+                value = (value & mask) >> start_bit
+
+            result.append(value)
+
+        return tuple(result)
+
+
+# Maps struct module format codes to NumPy types.
+NUMPY_TYPES = {"b": "i1", "B": "u1", "h": "i2", "H": "u2", "i": "i4",
+               "I": "u4", "l": "i4", "L": "u4", "q": "i8", "Q": "u8",
+               "c": "S1", "f": "f4", "d": "f8", "?": "b1"}
+
+
+def _GetNumpyType(format_string):
+    """Converts a single value struct format string to a NumPy dtype."""
+    byte_order = {"<": "<", ">": ">", "!": ">"}.get(format_string[0], "=")
+    return numpy.dtype(byte_order + NUMPY_TYPES[format_string[1:]])
+
+
+def _MaskColumn(column, start_bit, mask):
+    """Applies the (value & mask) >> start_bit transformation to a column."""
+    if mask is None:
+        return column
+
+    value_type = column.dtype.type
+    mask &= (1 << (8 * column.dtype.itemsize)) - 1
+    return (column & value_type(mask)) >> value_type(start_bit)
+
+
 class BaseObject(object):
     __metaclass__ = registry.UniqueObjectIdMetaclass
 
@@ -433,6 +581,21 @@ class BaseObject(object):
     def m(self, memname):
         return NoneObject("No member {0}", memname)
 
+    def obj_read(self, offset, length, vm=None):
+        """Read data from the object's address space (or vm if specified).
+
+        If this object was created from a snapshotted struct, and the data is
+        contained in the snapshot, we return it from the snapshot instead.
+        """
+        vm = vm or self.obj_vm
+        snapshot = self.obj_context.get("snapshot")
+        if snapshot is not None:
+            data = snapshot.read(vm, offset, length)
+            if data is not None:
+                return data
+
+        return vm.read(offset, length)
+
     def is_valid(self):
         return True
 
@@ -603,7 +766,7 @@ class NativeType(NumericProxyMixIn, BaseObject):
         if self.value is not None:
             return self.value
 
-        data = self.obj_vm.read(self.obj_offset, self.obj_size)
+        data = self.obj_read(self.obj_offset, self.obj_size)
         if not data:
             return NoneObject("Unable to read {0} bytes from {1}",
                               self.obj_size, self.obj_offset)
@@ -976,6 +1139,109 @@ class Array(BaseObject):
         """The size of the entire array."""
         return self.target_size * self.count
 
+    def unpack_all(self):
+        """Decode all the elements of the array in one go.
+
+        This avoids creating an object for each element. Arrays of native types
+        return a list of values, while arrays of structs return a list of
+        tuples (See Struct.as_tuple()).
+        """
+        count = min(self.count, self.max_count)
+        if count <= 0:
+            return []
+
+        length = self.target_size * count
+        data = self.obj_read(self.obj_offset, length)
+
+        native_field = self.obj_profile.get_native_field(
+            self.target, self.target_args)
+        if native_field is not None:
+            format_string, start_bit, mask = native_field
+            values = struct.unpack(
+                "%s%d%s" % (format_string[0], count, format_string[1:]),
+                data[:length].ljust(length, "\x00"))
+
+            if mask is not None:
+                return [(x & mask) >> start_bit for x in values]
+
+            return list(values)
+
+        decoder = self.obj_profile.get_struct_decoder(self.target)
+        if decoder is None:
+            return [x.v() for x in self]
+
+        data = data.ljust(length + decoder.size, "\x00")
+        return [decoder.unpack(data, i * self.target_size)
+                for i in xrange(count)]
+
+    def to_numpy(self, fields=None):
+        """Reads the array into a NumPy array in bulk.
+
+        For arrays of structs, the result is a structured array with a column
+        for each of the struct's fixed offset native members. Members of nested
+        structs are flattened into columns with dotted names (e.g.
+        "u3.e1.PageLocation"), and bit fields are extracted into their own
+        columns. Callers can then filter the rows in vectorized form and only
+        instantiate objects for the interesting ones.
+
+        Args:
+          fields: If specified, a list of the column names to include.
+
+        Returns:
+          A NumPy array, or a NoneObject if NumPy is not available.
+        """
+        if numpy is None:
+            return NoneObject("NumPy is not available.")
+
+        count = max(0, min(self.count, self.max_count))
+        length = self.target_size * count
+        data = self.obj_read(self.obj_offset, length) or ""
+        data = data[:length].ljust(length, "\x00")
+
+        native_field = self.obj_profile.get_native_field(
+            self.target, self.target_args)
+        if native_field is not None:
+            format_string, start_bit, mask = native_field
+            return _MaskColumn(
+                numpy.frombuffer(data, dtype=_GetNumpyType(format_string),
+                                 count=count),
+                start_bit, mask)
+
+        struct_fields = dict(
+            (x[0], x) for x in self.obj_profile.get_struct_fields(self.target))
+        if fields is None:
+            fields = sorted(struct_fields,
+                            key=lambda x: (struct_fields[x][1], x))
+
+        fields = [str(x) for x in fields]
+
+        # Each distinct storage unit is a column in the raw view of the data.
+        units = {}
+        for name in fields:
+            if name not in struct_fields:
+                raise ValueError("%s has no native member %s" % (
+                    self.target, name))
+
+            _, offset, format_string, _, _ = struct_fields[name]
+            units.setdefault((offset, format_string), "f%d" % len(units))
+
+        raw = numpy.frombuffer(data, count=count, dtype=dict(
+            names=units.values(),
+            formats=[_GetNumpyType(x[1]) for x in units],
+            offsets=[x[0] for x in units],
+            itemsize=self.target_size))
+
+        result = numpy.zeros(count, dtype=[
+            (name, _GetNumpyType(struct_fields[name][2]).newbyteorder("="))
+            for name in fields])
+
+        for name in fields:
+            _, offset, format_string, start_bit, mask = struct_fields[name]
+            result[name] = _MaskColumn(
+                raw[units[offset, format_string]], start_bit, mask)
+
+        return result
+
     def __iter__(self):
         # If the array is invalid we do not iterate.
         if not self.obj_vm.is_valid_address(self.obj_offset):
@@ -1070,7 +1336,7 @@ class PointerArray(Array):
             self.format_string = "<" + "I" * self.count
 
         # Read all the data
-        data = self.obj_vm.read(self.obj_offset, self.target_size * self.count)
+        data = self.obj_read(self.obj_offset, self.target_size * self.count)
         self._data = struct.unpack(self.format_string, data)
 
     def __iter__(self):
@@ -1200,6 +1466,10 @@ class Struct(BaseAddressComparisonMixIn, BaseObject):
     Structs have members at various fixed relative offsets from our own base
     offset.
     """
+
+    # A StructDecoder for the fixed offset native members (set by the profile).
+    struct_decoder = None
+
     def __init__(self, members=None, struct_size=0, **kwargs):
         """ This must be instantiated with a dict of members. The keys
         are the offsets, the values are Curried Object classes that
@@ -1409,7 +1679,322 @@ class Struct(BaseAddressComparisonMixIn, BaseObject):
 
     def GetData(self):
         """Returns the raw data of this struct."""
-        return self.obj_vm.read(self.obj_offset, self.obj_size)
+        return self.obj_read(self.obj_offset, self.obj_size)
+
+    def as_tuple(self):
+        """Decode all fixed offset native members in one go.
+
+        This is much faster than accessing each member since no member objects
+        are created. Pointers are returned as addresses and bit fields as
+        integers.
+
+        Returns:
+          A tuple of values in the order of self.struct_decoder.names.
+        """
+        decoder = self.struct_decoder
+        if decoder is None:
+            return ()
+
+        data = self.obj_read(self.obj_offset, decoder.size)
+        if not data or len(data) < decoder.size:
+            return NoneObject("Unable to read {0} bytes from {1}",
+                              decoder.size, self.obj_offset)
+
+        return decoder.unpack(data)
+
+    def as_dict(self):
+        """Like as_tuple() but returns a dict keyed by member name."""
+        values = self.as_tuple()
+        if not values:
+            return {}
+
+        return dict(zip(self.struct_decoder.names, values))
+
+    def take_snapshot(self):
+        """Read the struct's data once, and decode all members from this copy.
+
+        Objects which touch most of their members (e.g. an _EPROCESS listed by
+        pslist) otherwise issue a separate read through the address space for
+        each member. Members (including nested structs and arrays) which are
+        entirely within the struct are decoded from the snapshot, while
+        everything else (e.g. pointer targets) is still read from the address
+        space. Note that the snapshot will not reflect later changes to the
+        memory.
+
+        Returns:
+          self, to allow chaining.
+        """
+        size = self.obj_size
+        if size > 0:
+            self.obj_context = dict(self.obj_context, snapshot=StructSnapshot(
+                vm=self.obj_vm, offset=self.obj_offset,
+                data=self.obj_read(self.obj_offset, size)))
+
+            # Members may have been created before the snapshot.
+            self._cache = {}
+
+        return self
+
+
+class ConstantTable(collections.MutableMapping):
+    """The constants of a profile.
+
+    Profiles derived from PDB files may have more than 100k constants, so
+    building a dict (and a sorted collection of their addresses) is expensive
+    in time and memory. Constants added in bulk are stored in parallel arrays
+    sorted by name: a single blob of the names, the offsets of the names in the
+    blob and the values. These are only decoded on demand.
+
+    Individually added constants are kept in a dict which takes precedence over
+    the arrays. The index of constants which are addresses (for reverse
+    lookups) is built on first use.
+    """
+
+    # Additions smaller than this are just stored in the dict.
+    BULK_SIZE = 1000
+
+    def __init__(self):
+        self._blob = ""
+        self._offsets = array.array("L", [0])
+        self._values = []
+        self._is_address = array.array("B")
+
+        # Constants added individually, and which ones are addresses.
+        self._overrides = {}
+        self._override_addresses = set()
+
+        # Names in the arrays which have been deleted.
+        self._deleted = set()
+
+        # Parallel arrays of sorted addresses and their names (or None).
+        self._address_index = None
+
+    def copy(self):
+        result = self.__class__()
+        # The arrays are never modified in place, so may be shared.
+        # pylint: disable=protected-access
+        result._blob = self._blob
+        result._offsets = self._offsets
+        result._values = self._values
+        result._is_address = self._is_address
+        result._overrides = self._overrides.copy()
+        result._override_addresses = self._override_addresses.copy()
+        result._deleted = self._deleted.copy()
+        result._address_index = self._address_index
+
+        return result
+
+    def _name(self, index):
+        return self._blob[self._offsets[index]:self._offsets[index + 1]]
+
+    def _find(self, name):
+        """Returns the index of name in the arrays or -1."""
+        lo, hi = 0, len(self._values)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._name(mid) < name:
+                lo = mid + 1
+            else:
+                hi = mid
+
+        if lo < len(self._values) and self._name(lo) == name:
+            return lo
+
+        return -1
+
+    def add(self, constants, is_address=False):
+        """Adds a dict of constants.
+
+        Args:
+          constants: A dict of name and value.
+          is_address: If True the constants are addresses which can be found
+            by get_nearest_constant_by_address().
+        """
+        is_address = int(bool(is_address))
+        self._add_entries(dict(
+            (utils.SmartStr(name), (value, is_address))
+            for name, value in constants.iteritems()))
+
+    def merge(self, other):
+        """Adds all the constants of another ConstantTable.
+
+        The other table's constants replace ours and keep their address flags.
+        """
+        # pylint: disable=protected-access
+        entries = {}
+        for i in other._iter_array():
+            entries[other._name(i)] = (other._values[i], other._is_address[i])
+
+        for name, value in other._overrides.iteritems():
+            entries[name] = (value, int(name in other._override_addresses))
+
+        self._add_entries(entries)
+
+    def _add_entries(self, entries):
+        """Adds a dict of name and (value, is_address) tuples."""
+        self._address_index = None
+        if len(entries) < self.BULK_SIZE:
+            for name, (value, is_address) in entries.iteritems():
+                self[name] = value
+                if is_address:
+                    self._override_addresses.add(name)
+
+            return
+
+        for i in xrange(len(self._values)):
+            name = self._name(i)
+            if name not in self._deleted and name not in entries:
+                entries[name] = (self._values[i], self._is_address[i])
+
+        # The new values replace any individually set values.
+        for name in set(self._overrides).intersection(entries):
+            del self._overrides[name]
+            self._override_addresses.discard(name)
+
+        self._deleted = set()
+
+        names = sorted(entries)
+        offsets = [0]
+        position = 0
+        for name in names:
+            position += len(name)
+            offsets.append(position)
+
+        values, flags = zip(*[entries[name] for name in names])
+        try:
+            values = utils.Uint64Array(values)
+        except (TypeError, OverflowError):
+            values = list(values)
+
+        self._blob = "".join(names)
+        self._offsets = array.array("L", offsets)
+        self._values = values
+        self._is_address = array.array("B", flags)
+
+    def __getitem__(self, name):
+        name = utils.SmartStr(name)
+        try:
+            return self._overrides[name]
+        except KeyError:
+            pass
+
+        if name not in self._deleted:
+            index = self._find(name)
+            if index >= 0:
+                return self._values[index]
+
+        raise KeyError(name)
+
+    def __setitem__(self, name, value):
+        name = utils.SmartStr(name)
+        self._address_index = None
+        self._overrides[name] = value
+        self._override_addresses.discard(name)
+        self._deleted.discard(name)
+
+    def __delitem__(self, name):
+        name = utils.SmartStr(name)
+        self._address_index = None
+        found = self._overrides.pop(name, None) is not None
+        self._override_addresses.discard(name)
+        if name not in self._deleted and self._find(name) >= 0:
+            self._deleted.add(name)
+            found = True
+
+        if not found:
+            raise KeyError(name)
+
+    def __contains__(self, name):
+        try:
+            self[name]
+            return True
+        except KeyError:
+            return False
+
+    def _iter_array(self):
+        """Yields the index of the visible entries in the arrays."""
+        for i in xrange(len(self._values)):
+            name = self._name(i)
+            if name not in self._overrides and name not in self._deleted:
+                yield i
+
+    def __iter__(self):
+        for i in self._iter_array():
+            yield self._name(i)
+
+        for name in self._overrides:
+            yield name
+
+    def iteritems(self):
+        for i in self._iter_array():
+            yield self._name(i), self._values[i]
+
+        for item in self._overrides.iteritems():
+            yield item
+
+    def __len__(self):
+        return len(list(self._iter_array())) + len(self._overrides)
+
+    def _get_address_index(self):
+        if self._address_index is None:
+            entries = []
+            for i in self._iter_array():
+                if self._is_address[i]:
+                    entries.append((self._values[i], i))
+
+            for name in self._override_addresses:
+                entries.append((self._overrides[name], name))
+
+            addresses = utils.Uint64Array()
+            names = []
+            for value, name in entries:
+                try:
+                    addresses.append(Pointer.integer_to_address(value))
+                    names.append(name)
+                except (TypeError, ValueError):
+                    pass
+
+            order = sorted(xrange(len(addresses)), key=addresses.__getitem__)
+            self._address_index = (
+                utils.Uint64Array([addresses[i] for i in order]),
+                [names[i] for i in order])
+
+        return self._address_index
+
+    def _get_address_entry(self, position):
+        addresses, names = self._get_address_index()
+        name = names[position]
+        if isinstance(name, (int, long)):
+            name = self._name(name)
+
+        return addresses[position], name
+
+    def find_le(self, address):
+        """Returns the (address, name) of the last constant <= address."""
+        addresses = self._get_address_index()[0]
+        position = bisect.bisect_right(addresses, address)
+        if position:
+            return self._get_address_entry(position - 1)
+
+        raise ValueError("No constant found at or below %#x" % address)
+
+    def find_ge(self, address):
+        """Returns the (address, name) of the first constant >= address."""
+        addresses = self._get_address_index()[0]
+        position = bisect.bisect_left(addresses, address)
+        if position < len(addresses):
+            return self._get_address_entry(position)
+
+        raise ValueError("No constant found at or above %#x" % address)
+
+    def find_gt(self, address):
+        """Returns the (address, name) of the first constant > address."""
+        addresses = self._get_address_index()[0]
+        position = bisect.bisect_right(addresses, address)
+        if position < len(addresses):
+            return self._get_address_entry(position)
+
+        raise ValueError("No constant found above %#x" % address)
 
 
 ## Profiles are the interface for creating/interpreting
@@ -1524,9 +2109,10 @@ class Profile(object):
         if reverse_enums:
             self.add_reverse_enums(**reverse_enums)
 
+        # The data is freshly loaded and owned by us, so no need to copy it.
         types = data.get("$STRUCTS")
         if types:
-            self.add_types(types)
+            self.add_types(types, copy_types=False)
 
     @classmethod
     def Initialize(cls, profile):
@@ -1569,8 +2155,7 @@ class Profile(object):
 
         self.overlays = []
         self.vtypes = {}
-        self.constants = {}
-        self.constant_addresses = utils.SortedCollection(key=lambda x: x[0])
+        self.constants = ConstantTable()
         self.enums = {}
         self.reverse_enums = {}
         self.applied_modifications = set()
@@ -1615,7 +2200,6 @@ class Profile(object):
         result.enums = self.enums.copy()
         result.reverse_enums = self.reverse_enums.copy()
         result.constants = self.constants.copy()
-        result.constant_addresses = self.constant_addresses.copy()
 
         # Object classes are shallow dicts.
         result.object_classes = self.object_classes.copy()
@@ -1636,7 +2220,7 @@ class Profile(object):
 
         self.vtypes.update(other.vtypes)
         self.overlays += other.overlays
-        self.constants.update(other.constants)
+        self.constants.merge(other.constants)
         self.object_classes.update(other.object_classes)
         self.flush_cache()
         self.name = u"%s + %s" % (self.name, other.name)
@@ -1679,21 +2263,15 @@ class Profile(object):
         self.object_classes.update(kwargs)
         self.known_types.update(kwargs)
 
+    @property
+    def constant_addresses(self):
+        """The constants which are addresses, sorted by address."""
+        return self.constants
+
     def add_constants(self, constants_are_addresses=False, **kwargs):
         """Add the kwargs as constants for this profile."""
         self.flush_cache()
-
-        for k, v in kwargs.iteritems():
-            self.constants[k] = v
-            if constants_are_addresses:
-                try:
-                    # We need to interpret the value as a pointer.
-                    address = Pointer.integer_to_address(v)
-                    if (address, 0) not in self.constant_addresses:
-                        self.constant_addresses.insert((address, k))
-
-                except ValueError:
-                    pass
+        self.constants.add(kwargs, is_address=constants_are_addresses)
 
     def add_reverse_enums(self, **kwargs):
         """Add the kwargs as a reverse enum for this profile."""
@@ -1708,10 +2286,20 @@ class Profile(object):
             for enum, name in v.items():
                 enum_definition[str(enum)] = name
 
-    def add_types(self, abstract_types):
+    def add_types(self, abstract_types, copy_types=True):
+        """Add vtype definitions to the profile.
+
+        Args:
+          abstract_types: A dict of vtype descriptors.
+          copy_types: If False, the descriptors are used without copying them
+            first. This is much faster for large profiles, but the caller must
+            not modify the descriptors afterwards.
+        """
         self.flush_cache()
 
-        abstract_types = copy.deepcopy(abstract_types)
+        if copy_types:
+            abstract_types = copy.deepcopy(abstract_types)
+
         self.known_types.update(abstract_types)
 
         ## we merge the abstract_types with self.vtypes and then recompile
@@ -1725,9 +2313,10 @@ class Profile(object):
 
             else:
                 original = self.vtypes.get(k, self.EMPTY_DESCRIPTOR)
+
+                # The original descriptor may be shared so we do not modify it.
+                original = [v[0] or original[0], dict(original[1])]
                 original[1].update(v[1])
-                if v[0]:
-                    original[0] = v[0]
 
                 self.vtypes[k] = original
 
@@ -1796,10 +2385,117 @@ class Profile(object):
             cls = self.object_classes.get(type_name, Struct)
 
             self.types[type_name] = self._make_struct_callable(
-                cls, type_name, members, size, callable_members)
+                cls, type_name, members, size, callable_members,
+                self._make_struct_decoder(field_description, callable_members))
+
+    def get_native_field(self, type_name, type_args=None):
+        """Describes how to decode a native type.
+
+        Args:
+          type_name: The name of the type (e.g. "unsigned int" or "Pointer").
+          type_args: The args the type is instantiated with.
+
+        Returns:
+          A (format_string, start_bit, mask) tuple, or None if the type is not
+          a simple native type. If mask is not None the value is calculated as
+          (value & mask) >> start_bit.
+        """
+        type_args = type_args or {}
+        if type_name == "Pointer":
+            field = self.get_native_field("address")
+            if field is not None:
+                field = (field[0], 0, 0xffffffffffff)
+
+            return field
+
+        if type_name == "BitField":
+            target = type_args.get("native_type") or type_args.get(
+                "target", "address")
+            field = self.get_native_field(target)
+            if field is None or field[2] is not None:
+                return None
+
+            start_bit = type_args.get("start_bit", 0)
+            end_bit = type_args.get("end_bit", 32)
+            return (field[0], start_bit, (1 << end_bit) - 1)
+
+        if type_name in self.vtypes:
+            return None
+
+        # Only plain native types, since subclasses (e.g. Enumeration)
+        # interpret their values.
+        cls = self.object_classes.get(type_name)
+        if (not isinstance(cls, Curry) or cls._target is not NativeType or
+                "value" in type_args):
+            return None
+
+        format_string = cls._kwargs.get("format_string")
+        if (not format_string or len(format_string) != 2 or
+                format_string[0] not in "<>=!"):
+            return None
+
+        return format_string, 0, None
+
+    def _make_struct_decoder(self, field_description, callable_members):
+        """Make a StructDecoder for the fixed offset native members."""
+        fields = []
+        nested = []
+        for name, definition in field_description.items():
+            if (name in callable_members or callable(definition) or
+                    not isinstance(definition[0], (int, long)) or
+                    not definition[1]):
+                continue
+
+            target_spec = self.legacy_field_descriptor(definition[1])
+            target_args = target_spec["target_args"]
+            if not isinstance(target_args, dict):
+                continue
+
+            target = target_spec["target"]
+            native_field = self.get_native_field(target, target_args)
+            if native_field is not None:
+                fields.append((name, definition[0]) + native_field)
+
+            elif target in self.vtypes and not target_args:
+                nested.append((name, definition[0], target))
+
+        # Order the fields by offset.
+        fields.sort(key=lambda x: (x[1], x[0]))
+
+        return StructDecoder(fields, nested)
+
+    def get_struct_decoder(self, type_name):
+        """Returns the StructDecoder for the struct type (or None)."""
+        self.compile_type(type_name)
+        cls = self.types.get(type_name)
+        if cls is None:
+            return None
+
+        return cls.struct_decoder
+
+    def get_struct_fields(self, type_name, prefix="", offset=0, depth=0):
+        """Lists the native members of a struct, including nested structs.
+
+        Returns:
+          A list of (name, offset, format_string, start_bit, mask) tuples (See
+          StructDecoder). Members of nested structs have dotted names.
+        """
+        decoder = self.get_struct_decoder(type_name)
+        if decoder is None or depth > 10:
+            return []
+
+        result = [(prefix + field[0], offset + field[1]) + field[2:]
+                  for field in decoder.fields]
+
+        for name, member_offset, target in decoder.nested:
+            result.extend(self.get_struct_fields(
+                target, prefix=prefix + name + ".",
+                offset=offset + member_offset, depth=depth + 1))
+
+        return result
 
     def _make_struct_callable(self, cls, type_name, members, size,
-                              callable_members):
+                              callable_members, struct_decoder=None):
         """Compile the structs class into a callable.
 
         For write support we would like to add a __setattr__ on the struct
@@ -1864,6 +2560,7 @@ class Profile(object):
         # override the methods in cls depending on the members dict, without
         # altering the cls class permanently (This is a kind of metaclass
         # programming).
+        properties["struct_decoder"] = struct_decoder
         derived_cls = type(str(type_name), (cls,), properties)
 
         return Curry(derived_cls,
@@ -2195,7 +2892,7 @@ class Profile(object):
         return Curry(self.Object, attr)
 
     def Object(self, type_name=None, offset=None, vm=None, name=None,
-               parent=None, context=None, **kwargs):
+               parent=None, context=None, snapshot=False, **kwargs):
         """ A function which instantiates the object named in type_name (as
         a string) from the type in profile passing optional args of
         kwargs.
@@ -2215,6 +2912,10 @@ class Profile(object):
             this object.
 
           parent: The object can maintain a reference to its parent object.
+
+          snapshot: If set and the object is a Struct, its data is read in one
+            go and all its members are decoded from this copy (See
+            Struct.take_snapshot()).
         """
         name = name or type_name
 
@@ -2246,6 +2947,9 @@ class Profile(object):
                          parent=parent, context=context,
                          session=self.session, **kwargs)
 
+            if snapshot and isinstance(result, Struct):
+                result.take_snapshot()
+
             return result
 
         elif type_name in self.object_classes:
@@ -2265,6 +2969,9 @@ class Profile(object):
                     "Instantiating a Struct class without an overlay. "
                     "Please ensure an overlay is defined.")
 
+                if snapshot:
+                    result.take_snapshot()
+
             return result
 
         else:
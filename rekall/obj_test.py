@@ -212,6 +212,166 @@ class ProfileTest(testlib.RekallBaseUnitTestCase):
         # Can read past the end of the array but this returns all zeros.
         self.assertEqual(test[100], 0)
 
+    def testStructSnapshot(self):
+        address_space = addrspace.BufferAddressSpace(
+            data="\x08\x00\x00\x00\x01\x00\x00\x00\x66\x55\x44\x33",
+            session=self.session)
+
+        profile = obj.Profile.classes['Profile32Bits'](session=self.session)
+        profile.add_types({
+            'Test': [0x08, {
+                'ptr': [0x00, ['Pointer', dict(target='unsigned long')]],
+                'array': [0x04, ['Array', dict(target='unsigned char',
+                                               count=4)]],
+                }]})
+
+        # Count the reads from the address space.
+        reads = []
+        original_read = address_space.read
+        address_space.read = lambda addr, length: (
+            reads.append(addr) or original_read(addr, length))
+
+        test = profile.Object("Test", offset=0, vm=address_space,
+                              snapshot=True)
+        self.assertEqual(reads, [0])
+
+        self.assertEqual(test.ptr.v(), 8)
+        self.assertEqual(list(test.array), [1, 0, 0, 0])
+        self.assertEqual(reads, [0])
+
+        # The pointer target is outside the snapshot so it is read from the
+        # address space.
+        self.assertEqual(test.ptr.dereference(), 0x33445566)
+        self.assertEqual(reads, [0, 8])
+        self.assertEqual(test.ptr.obj_vm, address_space)
+
+    def testStructDecoder(self):
+        address_space = addrspace.BufferAddressSpace(
+            data="\x08\x00\x00\x00\x01\x02\x03\x04\x66\x55\x44\x33",
+            session=self.session)
+
+        profile = obj.Profile.classes['Profile32Bits'](session=self.session)
+        profile.add_types({
+            'Test': [0x08, {
+                'ptr': [0x00, ['Pointer', dict(target='unsigned long')]],
+                'short': [0x04, ['unsigned short']],
+                'long': [0x04, ['unsigned long']],
+                'bits': [0x06, ['BitField', dict(
+                    start_bit=4, end_bit=12, native_type='unsigned short')]],
+                }]})
+
+        test = profile.Object("Test", offset=0, vm=address_space)
+        self.assertEqual(test.struct_decoder.names,
+                         ["ptr", "long", "short", "bits"])
+        self.assertEqual(test.as_tuple(), (8, 0x04030201, 0x0201, 0x40))
+        self.assertEqual(test.as_dict(), dict(
+            (name, test.m(name).v()) for name in test.struct_decoder.names))
+
+        array = profile.Object("Array", offset=0, vm=address_space,
+                               target="Test", count=2)
+        self.assertEqual(array.unpack_all(),
+                         [(8, 0x04030201, 0x0201, 0x40),
+                          (0x33445566, 0, 0, 0)])
+
+        array = profile.Object("Array", offset=4, vm=address_space,
+                               target="unsigned short", count=3)
+        self.assertEqual(array.unpack_all(), [x.v() for x in array])
+
+    def testArrayToNumpy(self):
+        # NumPy is optional.
+        if obj.numpy is None:
+            return
+
+        address_space = addrspace.BufferAddressSpace(
+            data="\x08\x00\x00\x00\x01\x02\x03\x04\x66\x55\x44\x33",
+            session=self.session)
+
+        profile = obj.Profile.classes['Profile32Bits'](session=self.session)
+        profile.add_types({
+            'Inner': [0x02, {
+                'bits': [0x00, ['BitField', dict(
+                    start_bit=4, end_bit=12, native_type='unsigned short')]],
+                }],
+            'Test': [0x08, {
+                'ptr': [0x00, ['Pointer', dict(target='unsigned long')]],
+                'short': [0x04, ['unsigned short']],
+                'inner': [0x06, ['Inner']],
+                }]})
+
+        array = profile.Object("Array", offset=0, vm=address_space,
+                               target="Test", count=2)
+        result = array.to_numpy()
+        self.assertEqual(result.dtype.names, ("ptr", "short", "inner.bits"))
+        self.assertEqual(list(result["ptr"]), [8, 0x33445566])
+        self.assertEqual(list(result["inner.bits"]), [0x40, 0])
+
+        result = array.to_numpy(fields=["short"])
+        self.assertEqual(result.dtype.names, ("short",))
+        self.assertEqual(list(result["short"]), [0x0201, 0])
+        self.assertRaises(ValueError, array.to_numpy, fields=["missing"])
+
+    def testConstants(self):
+        profile = obj.Profile.classes['ProfileLP64'](session=self.session)
+
+        # Large additions are stored in the arrays.
+        obj.ConstantTable.BULK_SIZE = 2
+        try:
+            profile.add_constants(constants_are_addresses=True,
+                                  a=0x1000, b=0xfffff80000002000, c=0x3000)
+            profile.add_constants(d=0x1800, e="string")
+        finally:
+            obj.ConstantTable.BULK_SIZE = 1000
+
+        profile.add_constants(constants_are_addresses=True, f=0x2800)
+
+        self.assertEqual(profile.get_constant("b"), 0xfffff80000002000)
+        self.assertEqual(profile.get_constant("e"), "string")
+        self.assertEqual(sorted(profile.constants),
+                         ["a", "b", "c", "d", "e", "f"])
+
+        self.assertEqual(profile.get_constant_by_address(0x3000), "c")
+        self.assertEqual(profile.get_nearest_constant_by_address(0x1800),
+                         (0x1000, "a"))
+        self.assertEqual(profile.get_nearest_constant_by_address(
+            0x2001, below=False), (0x2800, "f"))
+        self.assertEqual(profile.get_nearest_constant_by_address(0x800)[0],
+                         -1)
+
+        # Copies do not affect the original.
+        copy = profile.copy()
+        copy.add_constants(constants_are_addresses=True, a=0x3800)
+        del copy.constants["c"]
+        self.assertEqual(copy.get_nearest_constant_by_address(0x3000),
+                         (0x2800, "f"))
+        self.assertEqual(profile.get_nearest_constant_by_address(0x3000),
+                         (0x3000, "c"))
+
+    def testMergeConstants(self):
+        profile = obj.Profile.classes['ProfileLP64'](session=self.session)
+        profile.add_constants(a=0x1000, d=0x1)
+
+        other = obj.Profile.classes['ProfileLP64'](session=self.session)
+        obj.ConstantTable.BULK_SIZE = 2
+        try:
+            other.add_constants(constants_are_addresses=True,
+                                b=0x2000, c=0x3000)
+            other.add_constants(d=0x4000)
+            other.add_constants(constants_are_addresses=True, e=0x5000)
+
+            profile.merge(other)
+        finally:
+            obj.ConstantTable.BULK_SIZE = 1000
+
+        self.assertEqual(sorted(profile.constants.iteritems()),
+                         [("a", 0x1000), ("b", 0x2000), ("c", 0x3000),
+                          ("d", 0x4000), ("e", 0x5000)])
+
+        # The merged constants are in the arrays and keep their address flags.
+        self.assertEqual(list(profile.constants._overrides), ["a"])
+        self.assertEqual(profile.get_constant_by_address(0x3000), "c")
+        self.assertEqual(profile.get_constant_by_address(0x5000), "e")
+        self.assertEqual(profile.get_constant_by_address(0x4000), None)
+
 
 if __name__ == "__main__":
     logging.basicConfig(level=logging.DEBUG)
@@ -34,6 +34,12 @@ from rekall.plugins.addrspaces import intel
 from rekall.plugins.addrspaces import standard
 
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
 config.DeclareOption("ept", group="Virtualization support",
                      type="ArrayIntParser",
                      help="The EPT physical address.")
@@ -142,32 +148,53 @@ class AMD64PagedMemory(intel.IA32PagedMemoryPae):
         or the offset in physical memory where the address maps.
         '''
         vaddr = long(vaddr)
+        try:
+            return self._tlb.Get(vaddr)
+        except KeyError:
+            pml4e = self.get_pml4e(vaddr)
+            if not pml4e & self.valid_mask:
+                # Add support for paged out PML4E
+                return None
+
+            pdpte = self.get_pdpte(vaddr, pml4e)
+            if not pdpte & self.valid_mask:
+                # Add support for paged out PDPTE
+                # Insert buffalo here!
+                return None
+
+            if self.page_size_flag(pdpte):
+                res = self.get_one_gig_paddr(vaddr, pdpte)
+
+            else:
+                pde = self.get_pde(vaddr, pdpte)
+                if not pde & self.valid_mask:
+                    # Add support for paged out PDE
+                    return None
+
+                # Is this a 2 meg page?
+                if pde & 1 and self.page_size_flag(pde):
+                    res = self.get_two_meg_paddr(vaddr, pde)
+                else:
+                    pte = self.get_pte(vaddr, pde)
+                    res = self.get_phys_addr(vaddr, pte)
+
+            self._tlb.Put(vaddr, res)
+            return res
+
+    def get_page_table_for(self, vaddr):
         pml4e = self.get_pml4e(vaddr)
         if not pml4e & self.valid_mask:
-            # Add support for paged out PML4E
             return None
 
         pdpte = self.get_pdpte(vaddr, pml4e)
-        if not pdpte & self.valid_mask:
-            # Add support for paged out PDPTE
-            # Insert buffalo here!
+        if not pdpte & self.valid_mask or self.page_size_flag(pdpte):
             return None
 
-        if self.page_size_flag(pdpte):
-            return self.get_one_gig_paddr(vaddr, pdpte)
-
         pde = self.get_pde(vaddr, pdpte)
-        if not pde & self.valid_mask:
-            # Add support for paged out PDE
+        if not pde & self.valid_mask or self.page_size_flag(pde):
             return None
 
-        # Is this a 2 meg page?
-        if pde & 1 and self.page_size_flag(pde):
-            return self.get_two_meg_paddr(vaddr, pde)
-
-        pte = self.get_pte(vaddr, pde)
-
-        return self.get_phys_addr(vaddr, pte)
+        return self.table_values(self.get_pte_table(pde))
 
     def describe_vtop(self, vaddr):
         pml4e_addr = ((self.dtb & 0xffffffffff000) |
@@ -217,38 +244,91 @@ class AMD64PagedMemory(intel.IA32PagedMemoryPae):
             physical_address = (pte_value & 0xffffffffff000) | (vaddr & 0xfff)
             yield "Physical Address", physical_address, None
 
+    def read_page_table(self, table_addr):
+        """Reads an entire paging structure (512 entries) at once.
+
+        On windows where IO is extremely expensive, reading the whole table is
+        about 10 times more efficient than reading it one value at the time.
+
+        Returns:
+          A numpy array of uint64 entries if numpy is available, otherwise a
+          tuple of ints.
+        """
+        data = self.base.read(table_addr & 0xffffffffff000, 8 * 0x200)
+        if numpy is not None:
+            return numpy.frombuffer(data, dtype="<u8")
+
+        return struct.unpack("<" + "Q" * 0x200, data)
+
+    def get_pml4e_table(self):
+        """Returns all 512 PML4 entries (the table pointed to by CR3)."""
+        return self.read_page_table(self.dtb)
+
+    def get_pdpte_table(self, pml4e):
+        """Returns all the PDPT entries in the table referenced by the PML4E."""
+        return self.read_page_table(pml4e)
+
+    def get_pde_table(self, pdpte):
+        """Returns all the PD entries in the table referenced by the PDPTE."""
+        return self.read_page_table(pdpte)
+
+    def get_pte_table(self, pde):
+        """Returns all the PT entries in the table referenced by the PDE."""
+        return self.read_page_table(pde)
+
+    def table_values(self, table):
+        """Converts a table returned from get_*_table() to a list of ints."""
+        if numpy is not None and isinstance(table, numpy.ndarray):
+            return table.tolist()
+
+        return list(table)
+
+    def _valid_entries(self, table, first=0):
+        """Returns a list of (index, entry) for the valid entries in a table.
+
+        Args:
+          table: A table as returned from get_*_table().
+          first: Entries with an index lower than this are skipped.
+        """
+        if numpy is None:
+            return [(i, entry) for i, entry in enumerate(table)
+                    if i >= first and entry & self.valid_mask]
+
+        table = numpy.asarray(table, dtype=numpy.uint64)
+        mask = (table & numpy.uint64(self.valid_mask)) != 0
+        mask[:first] = False
+        indexes = numpy.flatnonzero(mask)
+
+        return zip(indexes.tolist(), table[indexes].tolist())
+
+    def _first_index(self, vaddr, start, shift):
+        """The index of the first entry of a table which is not below start."""
+        if start <= vaddr:
+            return 0
+
+        return min((start - vaddr) >> shift, 0x200)
+
     def get_available_addresses(self, start=0):
         """Enumerate all available ranges.
 
         Yields tuples of (vaddr, physical address, length) for all available
         ranges in the virtual address space.
         """
-        # Pages that hold PDEs and PTEs are 0x1000 bytes each.
-        # Each PDE and PTE is eight bytes. Thus there are 0x1000 / 8 = 0x200
-        # PDEs and PTEs we must test.
-        for pml4e in range(0, 0x200):
-            vaddr = pml4e << 39
-
-            next_vaddr = (pml4e + 1) << 39
-            if start >= next_vaddr:
-                continue
-
-            pml4e_value = self.get_pml4e(vaddr)
-            if not pml4e_value & self.valid_mask:
-                continue
-
-            tmp1 = vaddr
-            for pdpte in range(0, 0x200):
+        # Pages that hold the paging structures are 0x1000 bytes each. Each
+        # entry is eight bytes. Thus there are 0x1000 / 8 = 0x200 entries we
+        # must test at each level. Rather than read each entry separately, we
+        # read each table as a whole and filter for the valid entries in one
+        # step.
+        pml4e_table = self.get_pml4e_table()
+        for pml4e, pml4e_value in self._valid_entries(
+                pml4e_table, self._first_index(0, start, 39)):
+            tmp1 = pml4e << 39
+
+            pdpte_table = self.get_pdpte_table(pml4e_value)
+            for pdpte, pdpte_value in self._valid_entries(
+                    pdpte_table, self._first_index(tmp1, start, 30)):
                 vaddr = tmp1 | (pdpte << 30)
 
-                next_vaddr = tmp1 | ((pdpte + 1) << 30)
-                if start >= next_vaddr:
-                    continue
-
-                pdpte_value = self.get_pdpte(vaddr, pml4e_value)
-                if not pdpte_value & self.valid_mask:
-                    continue
-
                 if self.page_size_flag(pdpte_value):
                     yield (vaddr,
                            self.get_one_gig_paddr(vaddr, pdpte_value),
@@ -260,51 +340,60 @@ class AMD64PagedMemory(intel.IA32PagedMemoryPae):
 
     def _get_available_PDEs(self, vaddr, pdpte_value, start):
         tmp2 = vaddr
-        for pde in range(0, 0x200):
+        pde_table = self.get_pde_table(pdpte_value)
+        for pde, pde_value in self._valid_entries(
+                pde_table, self._first_index(tmp2, start, 21)):
             vaddr = tmp2 | (pde << 21)
 
-            next_vaddr = tmp2 | ((pde + 1) << 21)
-            if start >= next_vaddr:
-                continue
-
-            pde_value = self.get_pde(vaddr, pdpte_value)
-            if not pde_value & self.valid_mask:
-                continue
-
             if self.page_size_flag(pde_value):
                 yield (vaddr,
                        self.get_two_meg_paddr(vaddr, pde_value),
                        0x200000)
                 continue
 
-            # This reads the entire PTE table at once - On
-            # windows where IO is extremely expensive, its
-            # about 10 times more efficient than reading it
-            # one value at the time - and this loop is HOT!
-            pte_table_addr = ((pde_value & 0xffffffffff000) |
-                              ((vaddr & 0x1ff000) >> 9))
-
-            data = self.base.read(pte_table_addr, 8 * 0x200)
-            pte_table = struct.unpack("<" + "Q" * 0x200, data)
-
+            pte_table = self.get_pte_table(pde_value)
             for x in self._get_available_PTEs(
                     pte_table, vaddr, start=start):
                 yield x
 
     def _get_available_PTEs(self, pte_table, vaddr, start=0):
+        """Yields merged runs of valid pages from the PTE table."""
         tmp3 = vaddr
-        for i, pte_value in enumerate(pte_table):
-            if not pte_value & self.valid_mask:
-                continue
+        first = self._first_index(tmp3, start, 12)
 
-            vaddr = tmp3 | i << 12
-            next_vaddr = tmp3 | ((i + 1) << 12)
-            if start >= next_vaddr:
-                continue
+        if numpy is None:
+            for i, pte_value in self._valid_entries(pte_table, first):
+                vaddr = tmp3 | i << 12
+                yield (vaddr,
+                       self.get_phys_addr(vaddr, pte_value),
+                       0x1000)
+
+            return
+
+        pte_table = numpy.asarray(pte_table, dtype=numpy.uint64)
+        mask = (pte_table & numpy.uint64(self.valid_mask)) != 0
+        mask[:first] = False
+        indexes = numpy.flatnonzero(mask)
+        if not len(indexes):
+            return
 
-            yield (vaddr,
-                   self.get_phys_addr(vaddr, pte_value),
-                   0x1000)
+        paddrs = pte_table[indexes] & numpy.uint64(0xffffffffff000)
+
+        # A new run starts wherever either the virtual or physical pages stop
+        # being contiguous.
+        breaks = numpy.flatnonzero(
+            (numpy.diff(indexes) != 1) |
+            (numpy.diff(paddrs) != numpy.uint64(0x1000))) + 1
+
+        run_starts = [0] + breaks.tolist()
+        run_ends = breaks.tolist() + [len(indexes)]
+        indexes = indexes.tolist()
+        paddrs = paddrs.tolist()
+
+        for run_start, run_end in zip(run_starts, run_ends):
+            yield (tmp3 | indexes[run_start] << 12,
+                   paddrs[run_start],
+                   (run_end - run_start) * 0x1000)
 
     def end(self):
         return (2 ** 64) - 1
@@ -375,6 +464,16 @@ class VTxPagedMemory(AMD64PagedMemory):
                            ((vaddr & 0xff8000000000) >> 36))
         return self.read_long_long_phys(ept_pml4e_paddr)
 
+    def get_pml4e_table(self):
+        return self.read_page_table(self._ept)
+
+    def address_range_cache_key(self):
+        base_key = self.base.address_range_cache_key()
+        if base_key is None:
+            return None
+
+        return "%s%s@%#x/" % (base_key, self.__class__.__name__, self._ept)
+
     def __str__(self):
         return "%s@0x%08X" % (self.__class__.__name__, self._ept)
 
@@ -468,6 +567,9 @@ class XenParaVirtAMD64PagedMemory(AMD64PagedMemory):
         finally:
             self.rebuilding_map = False
 
+            # Translations made while building the mapping are not valid.
+            self._tlb.Flush()
+
     def m2p(self, machine_address):
         """Translates from a machine address to a physical address.
 
@@ -497,6 +599,33 @@ class XenParaVirtAMD64PagedMemory(AMD64PagedMemory):
         return self.m2p(
             super(XenParaVirtAMD64PagedMemory, self).get_pte(vaddr, pml4e))
 
+    def address_range_cache_key(self):
+        # Until the m2p mapping is built our page tables can not be resolved.
+        if not self.m2p_mapping:
+            return None
+
+        return super(XenParaVirtAMD64PagedMemory,
+                     self).address_range_cache_key()
+
+    def _m2p_table(self, table):
+        return [self.m2p(x) for x in self.table_values(table)]
+
+    def get_pml4e_table(self):
+        return self._m2p_table(
+            super(XenParaVirtAMD64PagedMemory, self).get_pml4e_table())
+
+    def get_pdpte_table(self, pml4e):
+        return self._m2p_table(
+            super(XenParaVirtAMD64PagedMemory, self).get_pdpte_table(pml4e))
+
+    def get_pde_table(self, pdpte):
+        return self._m2p_table(
+            super(XenParaVirtAMD64PagedMemory, self).get_pde_table(pdpte))
+
+    def get_pte_table(self, pde):
+        return self._m2p_table(
+            super(XenParaVirtAMD64PagedMemory, self).get_pte_table(pde))
+
     def vtop(self, vaddr):
         vaddr = obj.Pointer.integer_to_address(vaddr)
 
@@ -0,0 +1,178 @@
+import shutil
+import struct
+import tempfile
+
+from rekall import addrspace
+from rekall import session
+from rekall import testlib
+from rekall.plugins.addrspaces import amd64
+
+
+class AMD64PagedMemoryTest(testlib.RekallBaseUnitTestCase):
+    """Test the AMD64 page table walker."""
+
+    def setUp(self):
+        self.session = session.Session()
+
+        # Paging structures at 0x1000 (PML4), 0x2000 (PDPT), 0x3000 (PD) and
+        # 0x4000 (PT).
+        tables = {
+            0x1000: {0: 0x2000 | 1},
+            0x2000: {0: 0x3000 | 1,
+                     # A 1GB page.
+                     1: 0x80000000 | 0x81},
+            0x3000: {0: 0x4000 | 1,
+                     # A 2MB page.
+                     1: 0x600000 | 0x81},
+            # Four contiguous pages, a gap, then two discontiguous pages.
+            0x4000: {0: 0x10000 | 1, 1: 0x11000 | 1, 2: 0x12000 | 1,
+                     3: 0x13000 | 1, 5: 0x20000 | 1, 6: 0x30000 | 1,
+                     # Not valid.
+                     7: 0x40000},
+        }
+
+        data = ["\x00" * 0x1000]
+        for table_addr in sorted(tables):
+            table = [0] * 0x200
+            for index, value in tables[table_addr].items():
+                table[index] = value
+
+            data.append(struct.pack("<" + "Q" * 0x200, *table))
+
+        # Fill each physical page up to 0x31000 with its page number.
+        for page in range(0x5, 0x31):
+            data.append(chr(page) * 0x1000)
+
+        self.phys_as = addrspace.BufferAddressSpace(
+            data="".join(data), session=self.session)
+
+    def _GetRanges(self, start=0):
+        address_space = amd64.AMD64PagedMemory(
+            base=self.phys_as, dtb=0x1000, session=self.session)
+
+        return self._MergeRanges(
+            address_space.get_available_addresses(start=start))
+
+    def _MergeRanges(self, ranges):
+        result = []
+        for vaddr, paddr, length in ranges:
+            if (result and result[-1][0] + result[-1][2] == vaddr and
+                    result[-1][1] + result[-1][2] == paddr):
+                result[-1] = (result[-1][0], result[-1][1],
+                              result[-1][2] + length)
+            else:
+                result.append((vaddr, paddr, length))
+
+        return result
+
+    def testAvailableAddresses(self):
+        expected = [(0, 0x10000, 0x4000),
+                    (0x5000, 0x20000, 0x1000),
+                    (0x6000, 0x30000, 0x1000),
+                    (0x200000, 0x600000, 0x200000),
+                    (0x40000000, 0x80000000, 0x40000000)]
+
+        self.assertEqual(self._GetRanges(), expected)
+        self.assertEqual(self._GetRanges(start=0x5800), expected[1:])
+
+    def testPurePythonWalker(self):
+        """The walker must produce the same ranges without numpy."""
+        vectorized = self._GetRanges()
+        vectorized_from_start = self._GetRanges(start=0x5800)
+
+        numpy = amd64.numpy
+        try:
+            amd64.numpy = None
+            self.assertEqual(self._GetRanges(), vectorized)
+            self.assertEqual(self._GetRanges(start=0x5800),
+                             vectorized_from_start)
+        finally:
+            amd64.numpy = numpy
+
+    def testAddressRangeCache(self):
+        cache_dir = tempfile.mkdtemp()
+        try:
+            with self.session:
+                self.session.SetParameter("cache_dir", cache_dir)
+                self.session.SetParameter("persistent_cache", True)
+
+            self.session.physical_address_space = self.phys_as
+            address_space = amd64.AMD64PagedMemory(
+                base=self.phys_as, dtb=0x1000, session=self.session)
+
+            expected = list(address_space.get_address_ranges())
+            self.assertEqual(len(address_space.get_address_range_map()), 5)
+
+            # A new session on the same image loads the map from the cache.
+            new_session = session.Session(
+                cache_dir=cache_dir, persistent_cache=True)
+            new_session.physical_address_space = self.phys_as
+            address_space = amd64.AMD64PagedMemory(
+                base=self.phys_as, dtb=0x1000, session=new_session)
+            address_space._get_address_ranges = None
+
+            self.assertEqual(list(address_space.get_address_ranges()),
+                             expected)
+            self.assertEqual(
+                list(address_space.get_address_ranges(0x5800, 0x300000)),
+                [(0x5800, 0x20800, 0x800), (0x6000, 0x30000, 0x1000),
+                 (0x200000, 0x600000, 0x100000)])
+        finally:
+            shutil.rmtree(cache_dir)
+
+    def testBoundedAddressRanges(self):
+        """A bounded query must not build the map for the whole space."""
+        self.session.physical_address_space = self.phys_as
+        address_space = amd64.AMD64PagedMemory(
+            base=self.phys_as, dtb=0x1000, session=self.session)
+
+        self.assertEqual(
+            list(address_space.get_address_ranges(0x5800, 0x6800)),
+            [(0x5800, 0x20800, 0x800), (0x6000, 0x30000, 0x800)])
+        self.assertEqual(address_space.get_address_range_map(build=False),
+                         None)
+
+        # Once the map is built, bounded queries are answered from it.
+        list(address_space.get_address_ranges())
+        address_space._get_address_ranges = None
+        self.assertEqual(
+            list(address_space.get_address_ranges(0x5800, 0x6800)),
+            [(0x5800, 0x20800, 0x800), (0x6000, 0x30000, 0x800)])
+
+    def testVtop(self):
+        address_space = amd64.AMD64PagedMemory(
+            base=self.phys_as, dtb=0x1000, session=self.session)
+
+        for _ in range(2):
+            self.assertEqual(address_space.vtop(0x1234), 0x11234)
+            self.assertEqual(address_space.vtop(0x7000), None)
+            self.assertEqual(address_space.vtop(0x201234), 0x601234)
+            self.assertEqual(address_space.vtop(0x40005234), 0x80005234)
+
+        stats = self.session.translation_stats.Summary()
+        self.assertEqual(stats["tlb"]["hits"], 4)
+        self.assertEqual(stats["tlb"]["misses"], 4)
+
+        # All four paging structure pages were read only once.
+        self.assertEqual(stats["page_tables"]["misses"], 4)
+
+    def testVtopMany(self):
+        address_space = amd64.AMD64PagedMemory(
+            base=self.phys_as, dtb=0x1000, session=self.session)
+
+        addresses = [0x6010, 0x1234, 0x7000, 0x1000, 0x201234, 0x40005234,
+                     0x1234]
+        self.assertEqual(address_space.vtop_many(addresses),
+                         [address_space.vtop(x) for x in addresses])
+
+    def testReadMany(self):
+        address_space = amd64.AMD64PagedMemory(
+            base=self.phys_as, dtb=0x1000, session=self.session)
+
+        addresses = [0xff8, 0x5000, 0x7000, 0x3ff8, 0x1000]
+        result = address_space.read_many(addresses, 0x10)
+        self.assertEqual(result, [address_space.read(x, 0x10)
+                                  for x in addresses])
+
+        self.assertEqual(result[0], "\x10" * 8 + "\x11" * 8)
+        self.assertEqual(result[2], "\x00" * 0x10)
@@ -62,5 +62,9 @@ class EWFAddressSpace(addrspace.BaseAddressSpace):
 
         return res
 
+    def reopen(self):
+        super(EWFAddressSpace, self).reopen()
+        self.ewf_file.reopen()
+
     def get_available_addresses(self, start=0):
         yield (0, 0, self.ewf_file.size)
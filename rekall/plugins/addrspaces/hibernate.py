@@ -29,6 +29,7 @@ from rekall import addrspace
 from rekall import obj
 from rekall import utils
 from rekall.plugins.addrspaces import xpress
+import bisect
 import struct
 
 
@@ -222,20 +223,38 @@ class WindowsHiberFileSpace(addrspace.BaseAddressSpace):
 
     order = 100
 
+    # The number of decompressed xpress blocks (each 16 pages) we keep.
+    XPRESS_CACHE_SIZE = 500
+
     def __init__(self, **kwargs):
-        self.as_assert(self.base == None, "No base Address Space")
+        super(WindowsHiberFileSpace, self).__init__(**kwargs)
+        self.as_assert(self.base != None, "No base Address Space")
         self.as_assert(self.base.read(0, 4).lower() in ["hibr", "wake"])
         self.runs = []
-        self.PageDict = {}
-        self.HighestPage = 0
-        self.PageIndex = 0
-        self.AddressList = []
-        self.LookupCache = {}
-        self.PageCache = utils.FastStore(500)
+        self.PageCache = utils.FastStore(self.XPRESS_CACHE_SIZE)
         self.MemRangeCnt = 0
         self.offset = 0
         self.entry_count = 0xFF
 
+        # The page index is built lazily by _build_page_index().
+        self._index_built = False
+        self._HighestPage = 0
+        self._PageIndex = 0
+        self._AddressList = []
+
+        # Sorted memory ranges: start page, page count, the xpress block
+        # holding the range's first page and the position of that page within
+        # its memory table (all pages in a table are consecutive in the xpress
+        # blocks).
+        self._range_starts = utils.Uint64Array()
+        self._range_counts = utils.Uint64Array()
+        self._range_blocks = utils.Uint64Array()
+        self._range_indexes = utils.Uint64Array()
+
+        # The offset and size of each xpress block.
+        self._block_offsets = utils.Uint64Array()
+        self._block_sizes = utils.Uint64Array()
+
         # Modify the profile by adding version specific definitions.
         self.profile = HibernationSupport(self.profile)
 
@@ -254,17 +273,12 @@ class WindowsHiberFileSpace(addrspace.BaseAddressSpace):
 
         # Extract processor state
         self.ProcState = self.profile.Object(
-            "_KPROCESSOR_STATE", offset=proc_page * 4096, vm=base)
+            "_KPROCESSOR_STATE", offset=proc_page * 4096, vm=self.base)
 
         ## This is a pointer to the page table - any ASs above us dont
         ## need to search for it.
         self.dtb = self.ProcState.SpecialRegisters.Cr3.v()
 
-        # This is a lengthy process, it was cached, but it may be best to delay this
-        # until it's absolutely necessary and/or convert it into a generator...
-        self.build_page_cache()
-        super(WindowsHiberFileSpace, self).__init__(**kwargs)
-
     def _get_first_table_page(self):
         if self.header:
             return self.header.FirstTablePage
@@ -273,14 +287,51 @@ class WindowsHiberFileSpace(addrspace.BaseAddressSpace):
             if self.base.read(i * PAGE_SIZE, 8) == "\x81\x81xpress":
                 return i - 1
 
+    @property
+    def HighestPage(self):
+        self._build_page_index()
+        return self._HighestPage
+
+    @property
+    def PageIndex(self):
+        self._build_page_index()
+        return self._PageIndex
+
+    @property
+    def AddressList(self):
+        self._build_page_index()
+        return self._AddressList
+
     def build_page_cache(self):
+        self._build_page_index()
+
+    def _add_block(self, XpressHeader, XpressBlockSize):
+        self._block_offsets.append(XpressHeader.obj_offset)
+        self._block_sizes.append(XpressBlockSize)
+
+    def _build_page_index(self):
+        """Index the memory range tables and the xpress blocks.
+
+        Rather than recording each page, we only record the ranges and the
+        location of each xpress block. Since every block holds 16 consecutive
+        pages of a memory table, a page's block can be calculated from its
+        range.
+        """
+        if self._index_built:
+            return
+
+        self._index_built = True
+
+        ranges = []
         XpressIndex = 0
+        TableBlock = 0
 
         XpressHeader = self.profile.Object("_IMAGE_XPRESS_HEADER",
             offset=(self._get_first_table_page() + 1) * 4096,
             vm=self.base)
 
         XpressBlockSize = self.get_xpress_block_size(XpressHeader)
+        self._add_block(XpressHeader, XpressBlockSize)
 
         MemoryArrayOffset = self._get_first_table_page() * 4096
 
@@ -294,38 +345,35 @@ class WindowsHiberFileSpace(addrspace.BaseAddressSpace):
                 end = i.EndPage.v()
                 LocalPageCnt = end - start
 
-                if end > self.HighestPage:
-                    self.HighestPage = end
+                if end > self._HighestPage:
+                    self._HighestPage = end
 
-                self.AddressList.append((start * 0x1000,  # virtual address
-                                         start * 0x1000,  # physical address
-                                         LocalPageCnt * 0x1000))
+                if LocalPageCnt <= 0:
+                    continue
 
-                for j in range(0, LocalPageCnt):
-                    if (XpressIndex and ((XpressIndex % 0x10) == 0)):
-                        XpressHeader, XpressBlockSize = \
-                                      self.next_xpress(XpressHeader, XpressBlockSize)
+                self._AddressList.append((start * 0x1000,  # virtual address
+                                          start * 0x1000,  # physical address
+                                          LocalPageCnt * 0x1000))
 
-                    PageNumber = start + j
-                    XpressPage = XpressIndex % 0x10
-                    if XpressHeader.obj_offset not in self.PageDict:
-                        self.PageDict[XpressHeader.obj_offset] = [
-                            (PageNumber, XpressBlockSize, XpressPage)]
-                    else:
-                        self.PageDict[XpressHeader.obj_offset].append(
-                            (PageNumber, XpressBlockSize, XpressPage))
+                ranges.append((start, LocalPageCnt, TableBlock, XpressIndex))
 
-                    ## Update the lookup cache
-                    self.LookupCache[PageNumber] = (
-                        XpressHeader.obj_offset, XpressBlockSize, XpressPage)
+                # Locate the xpress blocks which hold the rest of the range.
+                XpressIndex += LocalPageCnt
+                while (XpressHeader is not None and
+                       len(self._block_offsets) - TableBlock <
+                       (XpressIndex + 0xf) / 0x10):
+                    XpressHeader, XpressBlockSize = self.next_xpress(
+                        XpressHeader, XpressBlockSize)
+                    if XpressHeader is not None:
+                        self._add_block(XpressHeader, XpressBlockSize)
 
-                    self.PageIndex += 1
-                    XpressIndex += 1
+                self._PageIndex += LocalPageCnt
 
             NextTable = MemoryArray.MemArrayLink.NextTable.v()
 
             # This entry count (EntryCount) should probably be calculated
-            if (NextTable and (EntryCount == self.entry_count)):
+            if (XpressHeader is not None and NextTable and
+                    (EntryCount == self.entry_count)):
                 MemoryArrayOffset = NextTable * 0x1000
                 self.MemRangeCnt += 1
 
@@ -333,33 +381,75 @@ class WindowsHiberFileSpace(addrspace.BaseAddressSpace):
                     XpressHeader, XpressBlockSize)
 
                 # Make sure the xpress block is after the Memory Table
-                while (XpressHeader.obj_offset < MemoryArrayOffset):
+                while (XpressHeader is not None and
+                       XpressHeader.obj_offset < MemoryArrayOffset):
                     XpressHeader, XpressBlockSize = self.next_xpress(
                         XpressHeader, 0)
 
+                if XpressHeader is None:
+                    break
+
+                # The first block of the next table replaces any block we
+                # located past the end of the previous table.
+                TableBlock = (XpressIndex + 0xf) / 0x10 + TableBlock
+                del self._block_offsets[TableBlock:]
+                del self._block_sizes[TableBlock:]
+                self._add_block(XpressHeader, XpressBlockSize)
                 XpressIndex = 0
             else:
                 MemoryArrayOffset = 0
 
+        for start, count, block, index in sorted(ranges):
+            self._range_starts.append(start)
+            self._range_counts.append(count)
+            self._range_blocks.append(block)
+            self._range_indexes.append(index)
+
+    def _lookup_page(self, page):
+        """Returns the xpress block number and page within it (or None)."""
+        self._build_page_index()
+        i = bisect.bisect_right(self._range_starts, page) - 1
+        if i < 0 or page - self._range_starts[i] >= self._range_counts[i]:
+            return None
+
+        index = self._range_indexes[i] + page - self._range_starts[i]
+        block = self._range_blocks[i] + index / 0x10
+        if block >= len(self._block_offsets):
+            return None
+
+        return block, index % 0x10
+
+    def _iterate_pages(self):
+        """Yields page number, block number and page within the block."""
+        self._build_page_index()
+        for i in range(len(self._range_starts)):
+            start = self._range_starts[i]
+            for j in xrange(self._range_counts[i]):
+                index = self._range_indexes[i] + j
+                block = self._range_blocks[i] + index / 0x10
+                if block >= len(self._block_offsets):
+                    break
+
+                yield start + j, block, index % 0x10
+
     def convert_to_raw(self, ofile):
         page_count = 0
-        for _i, xb in enumerate(self.PageDict.keys()):
-            size = self.PageDict[xb][0][1]
-            data_z = self.base.read(xb + 0x20, size)
-            if size == 0x10000:
-                data_uz = data_z
-            else:
-                data_uz = xpress.xpress_decode(data_z)
-            for page, size, offset in self.PageDict[xb]:
-                ofile.seek(page * 0x1000)
-                ofile.write(data_uz[offset * 0x1000:offset * 0x1000 + 0x1000])
-                page_count += 1
-            del data_z, data_uz
-            yield page_count
+        for page, block, XpressPage in self._iterate_pages():
+            data_uz = self.read_xpress(self._block_offsets[block] + 0x20,
+                                       self._block_sizes[block])
+            ofile.seek(page * 0x1000)
+            ofile.write(data_uz[XpressPage * 0x1000:XpressPage * 0x1000 + 0x1000])
+            page_count += 1
+
+            # Report progress once per xpress block.
+            if XpressPage == 0xf:
+                yield page_count
+
+        yield page_count
 
     def next_xpress(self, XpressHeader, XpressBlockSize):
         XpressHeaderOffset = int(XpressBlockSize) + XpressHeader.obj_offset + \
-            XpressHeader.size()
+            XpressHeader.obj_size
 
         ## We only search this far
         BLOCKSIZE = 1024
@@ -425,33 +515,36 @@ class WindowsHiberFileSpace(addrspace.BaseAddressSpace):
         return self.PageIndex
 
     def get_addr(self, addr):
-        page = addr >> page_shift
-        if page in self.LookupCache:
-            (hoffset, size, pageoffset) = self.LookupCache[page]
-            return hoffset, size, pageoffset
-        return None, None, None
+        location = self._lookup_page(addr >> page_shift)
+        if location is None:
+            return None, None, None
+
+        block, pageoffset = location
+        return (self._block_offsets[block], self._block_sizes[block],
+                pageoffset)
 
     def get_block_offset(self, _xb, addr):
-        page = addr >> page_shift
-        if page in self.LookupCache:
-            (_hoffset, _size, pageoffset) = self.LookupCache[page]
-            return pageoffset
-        return None
+        location = self._lookup_page(addr >> page_shift)
+        if location is None:
+            return None
+
+        return location[1]
 
     def is_valid_address(self, addr):
         XpressHeaderOffset, _XpressBlockSize, _XpressPage = self.get_addr(addr)
         return XpressHeaderOffset != None
 
     def read_xpress(self, baddr, BlockSize):
-        data_uz = self.PageCache.Get(baddr)
-        if data_uz is None:
+        try:
+            return self.PageCache.Get(baddr)
+        except KeyError:
             data_read = self.base.read(baddr, BlockSize)
             if BlockSize == 0x10000:
                 data_uz = data_read
             else:
                 data_uz = xpress.xpress_decode(data_read)
 
-                self.PageCache.Put(baddr, data_uz)
+            self.PageCache.Put(baddr, data_uz)
 
         return data_uz
 
@@ -486,7 +579,7 @@ class WindowsHiberFileSpace(addrspace.BaseAddressSpace):
         return data[offset:offset + available]
 
     def read(self, addr, length):
-        result = ''
+        chunks = []
         while length > 0:
             data = self._partial_read(addr, length)
             if not data:
@@ -494,7 +587,9 @@ class WindowsHiberFileSpace(addrspace.BaseAddressSpace):
 
             addr += len(data)
             length -= len(data)
-            result += data
+            chunks.append(data)
+
+        result = "".join(chunks)
 
         if result == '':
             result = obj.NoneObject("Unable to read data at %s for length %s." % (
@@ -512,9 +607,8 @@ class WindowsHiberFileSpace(addrspace.BaseAddressSpace):
 
     def get_available_pages(self):
         page_list = []
-        for _i, xb in enumerate(self.PageDict.keys()):
-            for page, _size, _offset in self.PageDict[xb]:
-                page_list.append([page * 0x1000, page * 0x1000, 0x1000])
+        for page, _block, _offset in self._iterate_pages():
+            page_list.append([page * 0x1000, page * 0x1000, 0x1000])
         return page_list
 
     def get_address_range(self):
@@ -529,7 +623,7 @@ class WindowsHiberFileSpace(addrspace.BaseAddressSpace):
 
     def get_available_addresses(self):
         """ This returns the ranges  of valid addresses """
-        for i in self.AddressList:
+        for i in sorted(self.AddressList):
             yield i
 
     def close(self):
@@ -0,0 +1,130 @@
+import struct
+
+from rekall import addrspace
+from rekall import session
+from rekall import testlib
+from rekall.plugins.addrspaces import hibernate
+from rekall.plugins.overlays import basic
+
+
+class HiberTestProfile(basic.Profile32Bits, basic.BasicClasses):
+    """A profile with just enough of the hibernation structures."""
+
+    @classmethod
+    def Initialize(cls, profile):
+        super(HiberTestProfile, cls).Initialize(profile)
+        profile.add_types({
+            'PO_MEMORY_IMAGE': [0x10, {
+                'Signature': [0x0, ['String', dict(length=4)]],
+                'FirstTablePage': [0x8, ['unsigned long']],
+            }],
+            '_KPROCESSOR_STATE': [0x10, {
+                'SpecialRegisters': [0x0, ['_KSPECIAL_REGISTERS']],
+            }],
+            '_KSPECIAL_REGISTERS': [0x10, {
+                'Cr3': [0x8, ['unsigned long']],
+            }],
+            '_IMAGE_XPRESS_HEADER': [0x20, {}],
+        })
+
+
+def _Page(page):
+    return ("%08x" % page) * (0x1000 / 8)
+
+
+def _XpressHeader(size):
+    """An xpress block header for a block of size bytes."""
+    return ("\x81\x81xpress" + struct.pack("<L", (size - 1) << 10)).ljust(
+        0x20, "\x00")
+
+
+def _XpressLiterals(data):
+    """Encodes data as xpress literals (i.e. without compression)."""
+    result = []
+    for i in range(0, len(data), 32):
+        result.append(struct.pack("<L", 0) + data[i:i + 32])
+
+    return "".join(result)
+
+
+class WindowsHiberFileSpaceTest(testlib.RekallBaseUnitTestCase):
+    """Test the hibernation file address space on a synthetic hiberfil."""
+
+    def setUp(self):
+        self.session = session.Session()
+
+        # Page 0 is the header, page 2 the processor state and page 3 the
+        # memory range table.
+        pages = ["hibr".ljust(8, "\x00") + struct.pack("<L", 3), "",
+                 struct.pack("<LL", 0, 0x1000).rjust(0x10, "\x00")]
+
+        # Two ranges: pages 0x10-0x1f and 0x40-0x47.
+        table = struct.pack("<LLLL", 0, 0, 0, 2)
+        for start, end in [(0x10, 0x20), (0x40, 0x48)]:
+            table += struct.pack("<LLLL", 0, start, end, 0)
+        pages.append(table)
+
+        data = "".join(x.ljust(0x1000, "\x00") for x in pages)
+
+        # The first 16 pages are held in an uncompressed block.
+        data += _XpressHeader(0x10000)
+        data += "".join(_Page(x) for x in range(0x10, 0x20))
+
+        # The following 8 pages are in a compressed block.
+        block = _XpressLiterals("".join(_Page(x) for x in range(0x40, 0x48)))
+        self.block_offset = len(data)
+        data += _XpressHeader(len(block)) + block
+
+        self.base = addrspace.BufferAddressSpace(
+            data=data, session=self.session)
+
+        self.reads = []
+        read = self.base.read
+        self.base.read = lambda addr, length: (
+            self.reads.append(addr) or read(addr, length))
+
+        self.address_space = hibernate.WindowsHiberFileSpace(
+            base=self.base, session=self.session,
+            profile=HiberTestProfile(session=self.session))
+
+    def testPageIndex(self):
+        # The index is only built when it is needed.
+        self.assertFalse(self.address_space._index_built)
+
+        self.assertEqual(self.address_space.HighestPage, 0x48)
+        self.assertTrue(self.address_space._index_built)
+        self.assertEqual(self.address_space.PageIndex, 24)
+        self.assertEqual(self.address_space.AddressList,
+                         [(0x10000, 0x10000, 0x10000),
+                          (0x40000, 0x40000, 0x8000)])
+
+        self.assertEqual(self.address_space.get_addr(0x1f123),
+                         (0x4000, 0x10000, 0xf))
+        self.assertEqual(self.address_space.get_addr(0x43123),
+                         (self.block_offset, 0x9000, 3))
+
+        for addr in [0xf000, 0x20000, 0x48000]:
+            self.assertEqual(self.address_space.get_addr(addr),
+                             (None, None, None))
+            self.assertFalse(self.address_space.is_valid_address(addr))
+
+        self.assertEqual(
+            [x[0] for x in self.address_space.get_available_pages()],
+            [x << 12 for x in range(0x10, 0x20) + range(0x40, 0x48)])
+
+    def testRead(self):
+        self.assertEqual(self.address_space.read(0x10000, 8), "00000010")
+        self.assertEqual(self.address_space.read(0x17ff8, 0x10),
+                         "0000001700000018")
+        self.assertEqual(self.address_space.read(0x43ffc, 12), "004300000044")
+
+        # Reads stop at the end of a range.
+        self.assertEqual(self.address_space.read(0x1fffc, 8), "001f")
+        self.assertEqual(self.address_space.read(0x47ff8, 0x10), "00000047")
+        self.assertFalse(self.address_space.read(0x30000, 8))
+
+        # Both uncompressed and decompressed blocks are cached.
+        del self.reads[:]
+        self.assertEqual(self.address_space.read(0x15000, 8), "00000015")
+        self.assertEqual(self.address_space.read(0x45000, 8), "00000045")
+        self.assertEqual(self.reads, [])
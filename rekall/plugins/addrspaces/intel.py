@@ -23,6 +23,7 @@
 
 """ This is Jesse Kornblum's patch to clean up the standard AS's.
 """
+import itertools
 import struct
 
 from rekall import addrspace
@@ -33,6 +34,16 @@ config.DeclareOption(
     "dtb", group="Autodetection Overrides",
     type="IntParser", help="The DTB physical address.")
 
+config.DeclareOption(
+    "--tlb_size", default=8192, type="IntParser",
+    help="The number of page translations cached by each paged address "
+    "space.")
+
+config.DeclareOption(
+    "--page_table_cache_size", default=256, type="IntParser",
+    help="The number of page table pages cached by each paged address "
+    "space.")
+
 PAGE_SHIFT = 12
 PAGE_MASK = ~ 0xFFF
 
@@ -63,6 +74,9 @@ class IA32PagedMemory(addrspace.PagedReader):
 
     valid_mask = 1
 
+    # The number of pages mapped by a single page table.
+    PTES_PER_TABLE = 0x400
+
     def __init__(self, name=None, dtb=None, **kwargs):
         """Instantiate an Intel 32 bit Address space over the layered AS.
 
@@ -85,13 +99,21 @@ class IA32PagedMemory(addrspace.PagedReader):
         self.name = (name or 'Kernel AS') + "@%#x" % self.dtb
 
         # Use a TLB to make this faster.
-        self._tlb = addrspace.TranslationLookasideBuffer(1000)
+        self._tlb = addrspace.TranslationLookasideBuffer(
+            self.session.GetParameter("tlb_size", 8192))
 
         # Our get_available_addresses() refers to the base address space we
         # overlay on.
         self.phys_base = self.base
 
-        self._cache = utils.FastStore(100)
+        # A paging structure cache: Page table pages (at all levels) are cached
+        # as a whole so a TLB miss can usually reuse the upper levels, and
+        # often the page table itself.
+        self._cache = utils.FastStore(
+            self.session.GetParameter("page_table_cache_size", 256))
+
+        self.session.translation_stats.Register("tlb", self._tlb)
+        self.session.translation_stats.Register("page_tables", self._cache)
 
     def page_access_flag(self, entry):
         '''
@@ -189,7 +211,9 @@ class IA32PagedMemory(addrspace.PagedReader):
                 return None
 
             if self.page_size_flag(pde_value):
-                return self.get_four_meg_paddr(vaddr, pde_value)
+                res = self.get_four_meg_paddr(vaddr, pde_value)
+                self._tlb.Put(vaddr, res)
+                return res
 
             pte_value = self.get_pte(vaddr, pde_value)
             if not pte_value & self.valid_mask:
@@ -199,6 +223,116 @@ class IA32PagedMemory(addrspace.PagedReader):
             self._tlb.Put(vaddr, res)
             return res
 
+    def get_page_table_for(self, vaddr):
+        """Returns all the PTEs in the page table which maps vaddr.
+
+        Returns:
+          A sequence of PTE values, or None if vaddr is not mapped through a
+          page table (e.g. the PDE is invalid or maps a large page).
+        """
+        pde_value = self.get_pde(vaddr)
+        if not pde_value & self.valid_mask or self.page_size_flag(pde_value):
+            return None
+
+        return struct.unpack(
+            "<" + "I" * 0x400, self.read_table_page(pde_value & 0xfffff000))
+
+    def vtop_many(self, addresses):
+        """Translate many virtual addresses at once.
+
+        The addresses are deduplicated by page, sorted, and grouped by the page
+        table which maps them. The upper levels of the paging structures are
+        then walked, and the page table read, only once per group.
+
+        Returns:
+          A list of physical addresses (or None for unmapped addresses) in the
+          same order as addresses.
+        """
+        addresses = [int(x) for x in addresses]
+        pages = sorted(set(x >> PAGE_SHIFT for x in addresses))
+
+        translations = {}
+        for _, group in itertools.groupby(
+                pages, lambda page: page // self.PTES_PER_TABLE):
+            group = list(group)
+            pte_table = self.get_page_table_for(group[0] << PAGE_SHIFT)
+
+            for page in group:
+                vaddr = page << PAGE_SHIFT
+                if pte_table is None:
+                    translations[page] = self.vtop(vaddr)
+                else:
+                    translations[page] = self.get_phys_addr(
+                        vaddr, pte_table[page % self.PTES_PER_TABLE])
+
+        result = []
+        for address in addresses:
+            paddr = translations[address >> PAGE_SHIFT]
+            if paddr is not None:
+                paddr += address & 0xfff
+
+            result.append(paddr)
+
+        return result
+
+    def read_many(self, addresses, length):
+        """Read length bytes from each of the addresses.
+
+        All the pages are translated at once using vtop_many(). The page reads
+        are then sorted by physical address and coalesced into runs (allowing
+        gaps of up to a page), so each run is read from the base address space
+        with a single read. Unmapped pages are padded with zeros.
+
+        Returns:
+          A list of strings in the same order as addresses.
+        """
+        length = int(length)
+        if length > self.session.GetParameter("buffer_size"):
+            raise IOError("Too much data to read.")
+
+        # Split each read into chunks which do not cross a page boundary.
+        chunks = []
+        for i, address in enumerate(addresses):
+            address = int(address)
+            offset = 0
+            while offset < length:
+                vaddr = address + offset
+                chunk_length = min(length - offset,
+                                   self.PAGE_SIZE - vaddr % self.PAGE_SIZE)
+                chunks.append((vaddr, chunk_length, i, offset))
+                offset += chunk_length
+
+        paddrs = self.vtop_many([chunk[0] for chunk in chunks])
+        mapped = sorted((paddr, chunk) for paddr, chunk in zip(paddrs, chunks)
+                        if paddr is not None)
+
+        buffers = [bytearray(length) for _ in addresses]
+        max_run_length = self.session.GetParameter("buffer_size")
+        run = []
+        run_start = run_end = 0
+
+        for paddr, chunk in mapped + [(None, None)]:
+            if (run and paddr is not None and
+                    paddr <= run_end + self.PAGE_SIZE and
+                    paddr + chunk[1] - run_start <= max_run_length):
+                run.append((paddr, chunk))
+                run_end = max(run_end, paddr + chunk[1])
+                continue
+
+            # Read the previous run and distribute it to the buffers.
+            if run:
+                data = self.base.read(run_start, run_end - run_start)
+                for run_paddr, (_, chunk_length, i, offset) in run:
+                    data_offset = run_paddr - run_start
+                    buffers[i][offset:offset + chunk_length] = data[
+                        data_offset:data_offset + chunk_length]
+
+            if paddr is not None:
+                run = [(paddr, chunk)]
+                run_start, run_end = paddr, paddr + chunk[1]
+
+        return [str(x) for x in buffers]
+
     def describe_vtop(self, vaddr):
         """A generator of descriptive statements about stages in translation.
 
@@ -234,15 +368,28 @@ class IA32PagedMemory(addrspace.PagedReader):
 
         yield ("PTE mapped", phys_addr, pte_addr)
 
-    def read_long_phys(self, addr):
+    def read_table_page(self, addr):
+        """Returns the page containing addr from the paging structure cache."""
+        page_addr = addr & PAGE_MASK
+        try:
+            return self._cache.Get(page_addr)
+        except KeyError:
+            data = self.base.read(page_addr, 0x1000)
+            self._cache.Put(page_addr, data)
 
+            return data
+
+    def read_long_phys(self, addr):
         """Read an unsigned 32-bit integer from physical memory.
 
         Note this always succeeds - reads outside mapped addresses in the image
         will simply return 0.
         """
-        string = self.base.read(addr, 4)
-        return struct.unpack('<I', string)[0]
+        offset = addr & 0xfff
+        if offset > 0x1000 - 4:
+            return struct.unpack('<I', self.base.read(addr, 4))[0]
+
+        return struct.unpack_from('<I', self.read_table_page(addr), offset)[0]
 
     def get_available_addresses(self, start=0):
         """Enumerate all valid memory ranges.
@@ -293,6 +440,13 @@ class IA32PagedMemory(addrspace.PagedReader):
                            self.get_phys_addr(vaddr, pte_value),
                            0x1000)
 
+    def address_range_cache_key(self):
+        base_key = self.base.address_range_cache_key()
+        if base_key is None:
+            return None
+
+        return "%s%s@%#x/" % (base_key, self.__class__.__name__, self.dtb)
+
     def __str__(self):
         return "%s@0x%08X (%s)" % (self.__class__.__name__, self.dtb, self.name)
 
@@ -320,6 +474,8 @@ class IA32PagedMemoryPae(IA32PagedMemory):
     """
     order = 80
 
+    PTES_PER_TABLE = 0x200
+
     def pdpte_index(self, vaddr):
         '''
         Compute the Page Directory Pointer Table index using the
@@ -407,7 +563,9 @@ class IA32PagedMemoryPae(IA32PagedMemory):
                 return None
 
             if self.page_size_flag(pde):
-                return self.get_two_meg_paddr(vaddr, pde)
+                res = self.get_two_meg_paddr(vaddr, pde)
+                self._tlb.Put(vaddr, res)
+                return res
 
             pte = self.get_pte(vaddr, pde)
 
@@ -416,6 +574,18 @@ class IA32PagedMemoryPae(IA32PagedMemory):
             self._tlb.Put(vaddr, res)
             return res
 
+    def get_page_table_for(self, vaddr):
+        pdpte = self.get_pdpte(vaddr)
+        if not pdpte & self.valid_mask:
+            return None
+
+        pde = self.get_pde(vaddr, pdpte)
+        if not pde & self.valid_mask or self.page_size_flag(pde):
+            return None
+
+        return struct.unpack(
+            "<" + "Q" * 0x200, self.read_table_page(pde & 0xffffffffff000))
+
     def describe_vtop(self, vaddr):
         pdpte_addr = ((self.dtb & 0xfffffff0) |
                       ((vaddr & 0x7FC0000000) >> 27))
@@ -457,14 +627,11 @@ class IA32PagedMemoryPae(IA32PagedMemory):
         Returns an unsigned 64-bit integer from the address addr in
         physical memory. If unable to read from that location, returns None.
         '''
-        try:
-            return self._cache.Get(addr)
-        except KeyError:
-            string = self.base.read(addr, 8)
-            result = struct.unpack('<Q', string)[0]
-            self._cache.Put(addr, result)
+        offset = addr & 0xfff
+        if offset > 0x1000 - 8:
+            return struct.unpack('<Q', self.base.read(addr, 8))[0]
 
-            return result
+        return struct.unpack_from('<Q', self.read_table_page(addr), offset)[0]
 
     def get_available_addresses(self, start=0):
         """A generator of address, length tuple for all valid memory regions."""
@@ -84,6 +84,11 @@ class MIPS32PagedMemory(intel.IA32PagedMemory):
 
         return super(MIPS32PagedMemory, self).vtop(vaddr)
 
+    def get_page_table_for(self, vaddr):
+        # Translate each page with vtop() since MIPS maps some segments
+        # directly and its page tables are big endian.
+        return None
+
     def pte_paddr(self, pte):
         '''
         Return the physical address for the given PTE.
@@ -76,9 +76,13 @@ class MmapFileAddressSpace(addrspace.BaseAddressSpace):
     def read(self, addr, length):
         result = ""
         if addr != None:
+            # Slicing the map copies the data out of the mapping exactly once.
             result = self.map[addr:addr+length]
 
-        return result + "\x00" * (length - len(result))
+        if len(result) < length:
+            result += "\x00" * (length - len(result))
+
+        return result
 
     def get_available_addresses(self):
         # TODO: Explain why this is always fsize - 1?
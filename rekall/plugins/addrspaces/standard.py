@@ -133,6 +133,9 @@ class FileAddressSpace(FDAddressSpace):
         super(FileAddressSpace, self).__init__(
             fhandle=fhandle, session=session, **kwargs)
 
+    def reopen(self):
+        self.fhandle = open(self.fname, self.mode)
+
 
 class GlobalOffsetAddressSpace(addrspace.BaseAddressSpace):
     """An address space to add a constant offset."""
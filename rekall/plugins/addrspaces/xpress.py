@@ -32,31 +32,33 @@
 
 #pylint: disable-msg=C0111
 
-from struct import unpack
-from struct import error as StructError
+import struct
 
-def recombine(outbuf):
-    return "".join(outbuf[k] for k in sorted(outbuf.keys()))
 
 def xpress_decode(inputBuffer):
-    outputBuffer = {}
-    outputIndex = 0
+    """Decodes an xpress compressed buffer.
+
+    The output is built in a bytearray, so literals and back references do not
+    need to be stored one byte at a time. If the input is truncated, the data
+    decoded so far is returned.
+    """
+    outputBuffer = bytearray()
     inputIndex = 0
     indicatorBit = 0
     nibbleIndex = 0
+    inputLength = len(inputBuffer)
 
     # we are decoding the entire input here, so I have changed
     # the check to see if we're at the end of the output buffer
     # with a check to see if we still have any input left.
-    while inputIndex < len(inputBuffer):
+    while inputIndex < inputLength:
         if (indicatorBit == 0):
             # in pseudocode this was indicatorBit = ..., but that makes no
             # sense, so I think this was intended...
-            try:
-                indicator = unpack("<L", inputBuffer[inputIndex:inputIndex + 4])[0]
-            except StructError:
-                return recombine(outputBuffer)
+            if inputIndex + 4 > inputLength:
+                break
 
+            indicator = struct.unpack_from("<L", inputBuffer, inputIndex)[0]
             inputIndex += 4
             indicatorBit = 32
 
@@ -65,13 +67,11 @@ def xpress_decode(inputBuffer):
         # set in indicator. For example, if indicatorBit has value 4
         # check whether the 4th bit of the value in indicator is set
         if not (indicator & (1 << indicatorBit)):
-            try:
-                outputBuffer[outputIndex] = inputBuffer[inputIndex]
-            except IndexError:
-                return recombine(outputBuffer)
+            if inputIndex >= inputLength:
+                break
 
+            outputBuffer.append(inputBuffer[inputIndex])
             inputIndex += 1
-            outputIndex += 1
         else:
             # Get the length. This appears to use a scheme whereby if
             # the value at the current width is all ones, then we assume
@@ -82,17 +82,18 @@ def xpress_decode(inputBuffer):
             # byte used as a length nibble.
             # Thus if a nibble byte is F2, we would first use the low part (2),
             # and then at some later point get the nibble from the high part (F).
+            if inputIndex + 2 > inputLength:
+                break
 
-            try:
-                length = unpack("<H", inputBuffer[inputIndex:inputIndex + 2])[0]
-            except StructError:
-                return recombine(outputBuffer)
-
+            length = struct.unpack_from("<H", inputBuffer, inputIndex)[0]
             inputIndex += 2
             offset = length / 8
             length = length % 8
             if length == 7:
                 if nibbleIndex == 0:
+                    if inputIndex >= inputLength:
+                        break
+
                     nibbleIndex = inputIndex
                     length = ord(inputBuffer[inputIndex]) % 16
                     inputIndex += 1
@@ -104,28 +105,39 @@ def xpress_decode(inputBuffer):
                     nibbleIndex = 0
 
                 if length == 15:
+                    if inputIndex >= inputLength:
+                        break
+
                     length = ord(inputBuffer[inputIndex])
                     inputIndex += 1
                     if length == 255:
-                        try:
-                            length = unpack("<H", inputBuffer[inputIndex:inputIndex + 2])[0]
-                        except StructError:
-                            return recombine(outputBuffer)
+                        if inputIndex + 2 > inputLength:
+                            break
+
+                        length = struct.unpack_from(
+                            "<H", inputBuffer, inputIndex)[0]
                         inputIndex = inputIndex + 2
                         length = length - (15 + 7)
                     length = length + 15
                 length = length + 7
             length = length + 3
 
-            while length != 0:
-                try:
-                    outputBuffer[outputIndex] = outputBuffer[outputIndex - offset - 1]
-                except KeyError:
-                    return recombine(outputBuffer)
-                outputIndex += 1
-                length -= 1
-
-    return recombine(outputBuffer)
+            # The back reference must point into the output we have so far.
+            source = len(outputBuffer) - offset - 1
+            if source < 0:
+                break
+
+            period = offset + 1
+            if length <= period:
+                outputBuffer.extend(outputBuffer[source:source + length])
+            else:
+                # The reference overlaps the data it produces, so it repeats
+                # the last period bytes.
+                pattern = outputBuffer[source:]
+                outputBuffer.extend(
+                    (pattern * (length / period + 1))[:length])
+
+    return str(outputBuffer)
 
 try:
     import pyxpress #pylint: disable-msg=F0401
@@ -0,0 +1,23 @@
+import struct
+
+from rekall import testlib
+from rekall.plugins.addrspaces import xpress
+
+
+class XpressTest(testlib.RekallBaseUnitTestCase):
+    """Test the xpress decompressor."""
+
+    def testDecode(self):
+        # Three literals followed by a back reference 3 bytes back which
+        # overlaps its own output.
+        data = (struct.pack("<L", 1 << 28) + "abc" +
+                struct.pack("<H", 2 * 8 + 9 - 3))
+
+        self.assertEqual(xpress.xpress_decode(data), "abc" * 4)
+
+        # A truncated buffer returns the data decoded so far.
+        self.assertEqual(xpress.xpress_decode(data[:-1]), "abc")
+
+        # A back reference before the start of the output is invalid.
+        data = struct.pack("<L", 1 << 31) + struct.pack("<H", 8)
+        self.assertEqual(xpress.xpress_decode(data), "")
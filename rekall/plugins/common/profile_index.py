@@ -69,7 +69,12 @@ class Index(obj.Profile):
         count_matched = 0
         count_unmatched = 0
 
-        for offset, possible_values in symbols:
+        # Translate all the comparison points at once.
+        physical_addresses = address_space.vtop_many(
+            [image_base + offset for offset, _ in symbols])
+
+        for (offset, possible_values), physical_address in zip(
+                symbols, physical_addresses):
             # The possible_values can be a single string which means there is
             # only one option. If it is a list, then any of the symbols may
             # match at this offset to be considered a match.
@@ -78,7 +83,7 @@ class Index(obj.Profile):
 
             # If the offset is not mapped in we can not compare it. Skip it.
             offset_to_check = image_base + offset
-            if address_space.vtop(offset_to_check) == None:
+            if physical_address == None:
                 continue
 
             match = self._TestSymbols(
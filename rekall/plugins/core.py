@@ -31,6 +31,7 @@ from rekall import addrspace
 from rekall import args
 from rekall import config
 from rekall import constants
+from rekall import copier
 from rekall import registry
 from rekall import plugin
 from rekall import obj
@@ -594,30 +595,14 @@ class DirectoryDumperMixin(object):
         If a region has no mapped pages, the resulting file will be of 0 bytes
         long.
         """
-        BUFFSIZE = 1024 * 1024
-
-        for offset, _, length in address_space.get_available_addresses(
-                start=start):
-
-            if start > offset:
-                continue
-
-            if offset >= end:
-                break
-
-            out_offset = offset - start
-            self.session.report_progress("Dumping %s Mb", out_offset/BUFFSIZE)
-            outfd.seek(out_offset)
-            i = offset
-
-            # Now copy the region in fixed size buffers.
-            while i < offset + length:
-                to_read = min(BUFFSIZE, length)
-
-                data = address_space.read(i, to_read)
-                outfd.write(data)
-
-                i += to_read
+        ranges = ((offset, offset - start, length)
+                  for offset, _, length in address_space.get_address_ranges(
+                      start=start, end=end))
+
+        copier.CopyRanges(
+            address_space, outfd, ranges, session=self.session,
+            progress=lambda out_offset: self.session.report_progress(
+                "Dumping %s Mb", out_offset / 1024 / 1024))
 
 
 class Null(plugin.Command):
@@ -22,7 +22,11 @@
 __author__ = "Michael Cohen <scudette@gmail.com>"
 
 # pylint: disable=protected-access
+import collections
+import multiprocessing
+import os
 import re
+import time
 
 from rekall import config
 from rekall import kb
@@ -38,6 +42,43 @@ from rekall.plugins.windows import common as win_common
 from rekall.plugins.overlays.windows import pe_vtypes
 
 
+# The detection methods and address space used by the worker processes. Workers
+# are forked from the parent and inherit these without having to pickle them.
+_WORKER_METHODS = None
+_WORKER_ADDRESS_SPACE = None
+
+
+def _InitDetectionWorker():
+    """Prepares a freshly forked worker process for autodetection."""
+    session = _WORKER_METHODS[0].session
+
+    # The worker must not report progress to the parent's renderer.
+    session.progress.callbacks.clear()
+
+    # File handles inherited from the parent share their file position with
+    # it, so they must not be used concurrently.
+    _WORKER_ADDRESS_SPACE.reopen()
+
+
+def _DetectInWorker(args):
+    """Tries a single hit in a worker process.
+
+    Args:
+      args: A tuple of (method index, hit, offset).
+
+    Returns:
+      A tuple of (detected, elapsed time). The profile itself can not be
+      returned to the parent, which repeats the detection for the successful
+      hit.
+    """
+    method_index, hit, offset = args
+    start = time.time()
+    profile = _WORKER_METHODS[method_index].DetectFromHit(
+        hit, offset, _WORKER_ADDRESS_SPACE)
+
+    return bool(profile), time.time() - start
+
+
 class DetectionMethod(object):
     """A baseclass to implement autodetection methods."""
 
@@ -125,6 +166,13 @@ config.DeclareOption("autodetect_scan_length", default=1000000000,
                      group="Autodetection Overrides",
                      help="How much of physical memory to scan before failing")
 
+config.DeclareOption("autodetect_processes", default=0,
+                     group="Autodetection Overrides",
+                     help="Number of worker processes used to verify "
+                     "candidate profiles while the scan continues. 0 or 1 "
+                     "verifies candidates in this process.",
+                     type="IntParser")
+
 
 class WindowsIndexDetector(DetectionMethod):
     """Apply the windows index to detect the profile."""
@@ -414,7 +462,112 @@ class ProfileHook(kb.ParameterHook):
     """If the profile is not specified, we guess it."""
     name = "profile_obj"
 
+    def __init__(self, **kwargs):
+        super(ProfileHook, self).__init__(**kwargs)
+        # Calls and total time spent in each detection method.
+        self.timings = {}
+
+    def _Detect(self, method, hit, offset, address_space):
+        """Calls the method's DetectFromHit() and records the time taken."""
+        start = time.time()
+        try:
+            return method.DetectFromHit(hit, offset, address_space)
+        finally:
+            self._RecordTime(method, time.time() - start)
+
+    def _RecordTime(self, method, elapsed):
+        timing = self.timings.setdefault(method.name, dict(calls=0, time=0))
+        timing["calls"] += 1
+        timing["time"] += elapsed
+
+    def _ReportTimings(self):
+        self.session.SetCache("autodetect_timings", self.timings)
+        for name, timing in sorted(self.timings.iteritems()):
+            self.session.logging.debug(
+                "Detection method %s: %d calls in %.2f seconds.",
+                name, timing["calls"], timing["time"])
+
     def ScanProfiles(self):
+        try:
+            return self._ScanProfiles()
+        finally:
+            self._ReportTimings()
+
+    def _CollectResults(self, pending, address_space, block=False):
+        """Checks the candidates verified by the worker processes.
+
+        Candidates are accepted in submission order: a success is only used
+        once all earlier candidates have failed, so the result is the same as
+        that of the serial scan regardless of worker timing.
+
+        Args:
+          pending: A deque of (method, hit, offset, async result) for
+            candidates submitted to the pool, in submission order.
+          block: If True, wait for all candidates to complete.
+
+        Returns:
+          The profile of the first successful candidate, or None.
+        """
+        while pending:
+            method, hit, offset, result = pending[0]
+            if not result.ready():
+                if not block:
+                    return
+
+                result.wait()
+
+            pending.popleft()
+            detected, elapsed = result.get()
+            self._RecordTime(method, elapsed)
+            if not detected:
+                continue
+
+            # The worker's session state is lost, so repeat the detection of
+            # the successful hit here.
+            profile = self._Detect(method, hit, offset, address_space)
+            if profile:
+                self.session.logging.debug(
+                    "Detection method %s worked at offset %#x",
+                    method.name, offset)
+                return profile
+
+    def _ScanProfilesParallel(self, scanner, methods, needle_lookup,
+                              address_space, processes):
+        """Verifies the candidates in a pool of worker processes.
+
+        The scan continues in this process while the workers verify the
+        candidates it found. All work stops as soon as the earliest successful
+        candidate (in scan order) is verified.
+        """
+        global _WORKER_METHODS, _WORKER_ADDRESS_SPACE  # pylint: disable=global-statement
+
+        _WORKER_METHODS = methods
+        _WORKER_ADDRESS_SPACE = address_space
+        pool = multiprocessing.Pool(processes, initializer=_InitDetectionWorker)
+        pending = collections.deque()
+        try:
+            autodetect_scan_length = self.session.GetParameter(
+                "autodetect_scan_length")
+            for offset, hit in scanner.scan(maxlen=autodetect_scan_length):
+                for method in needle_lookup[hit]:
+                    pending.append((method, hit, offset, pool.apply_async(
+                        _DetectInWorker,
+                        [(methods.index(method), hit, offset)])))
+
+                # Do not let the scan get too far ahead of the workers.
+                if len(pending) > processes * 4:
+                    pending[0][3].wait()
+
+                profile = self._CollectResults(pending, address_space)
+                if profile:
+                    return profile
+
+            return self._CollectResults(pending, address_space, block=True)
+        finally:
+            pool.terminate()
+            _WORKER_METHODS = _WORKER_ADDRESS_SPACE = None
+
+    def _ScanProfiles(self):
         address_space = self.session.physical_address_space
         best_profile = None
         best_match = 0
@@ -444,7 +597,7 @@ class ProfileHook(kb.ParameterHook):
                 needle_lookup.setdefault(keyword, []).append(method)
 
             for offset in method.Offsets():
-                profile = method.DetectFromHit(None, offset, address_space)
+                profile = self._Detect(method, None, offset, address_space)
                 if profile:
                     return profile
 
@@ -454,9 +607,24 @@ class ProfileHook(kb.ParameterHook):
             address_space=address_space, needles=needles,
             session=self.session)
         scanner.progress_message = "Autodetecting profile: %(offset)#08x"
+
+        # Workers inherit the detection methods by forking, so this is not
+        # available on Windows.
+        processes = self.session.GetParameter("autodetect_processes", 0)
+        if processes > 1 and hasattr(os, "fork"):
+            profile = self._ScanProfilesParallel(
+                scanner, methods, needle_lookup, address_space, processes)
+            if profile:
+                return profile
+
+            self.session.logging.error(
+                "No profiles match this image. Try specifying manually.")
+
+            return obj.NoneObject("No profile detected")
+
         for offset, hit in scanner.scan(maxlen=autodetect_scan_length):
             for method in needle_lookup[hit]:
-                profile = method.DetectFromHit(hit, offset, address_space)
+                profile = self._Detect(method, hit, offset, address_space)
                 if profile:
                     self.session.logging.debug(
                       "Detection method %s worked at offset %#x",
@@ -0,0 +1,60 @@
+from rekall import addrspace
+from rekall import obj
+from rekall import session
+from rekall import testlib
+from rekall.plugins import guess_profile
+
+
+class MarkerDetector(guess_profile.DetectionMethod):
+    """Detects a profile when a marker is followed by GOOD."""
+
+    name = "test_marker"
+
+    def Keywords(self):
+        return ["MARKER"]
+
+    def DetectFromHit(self, hit, offset, address_space):
+        if address_space.read(offset + 6, 4) == "GOOD":
+            profile = obj.Profile(session=self.session, name="good")
+            profile.offset = offset
+            return profile
+
+
+class ProfileHookTest(testlib.RekallBaseUnitTestCase):
+    """Test the autodetection of profiles."""
+
+    def setUp(self):
+        self.session = session.Session()
+        data = ["\x00" * 0x100] * 0x40
+        data[0x10] = "MARKERBAD!" + data[0x10][10:]
+        data[0x20] = "MARKERGOOD" + data[0x20][10:]
+        data[0x30] = "MARKERGOOD" + data[0x30][10:]
+
+        self.session.physical_address_space = addrspace.BufferAddressSpace(
+            data="".join(data), session=self.session)
+
+        with self.session:
+            self.session.SetParameter("autodetect", ["test_marker"])
+            self.session.SetParameter("autodetect_scan_length", 2**64)
+
+    def _ScanProfiles(self):
+        hook = guess_profile.ProfileHook(session=self.session)
+        return hook.ScanProfiles()
+
+    def testScanProfiles(self):
+        profile = self._ScanProfiles()
+        self.assertEqual(profile.offset, 0x2000)
+
+        timings = self.session.GetParameter("autodetect_timings")
+        self.assertEqual(timings["test_marker"]["calls"], 2)
+
+    def testParallelScanProfiles(self):
+        with self.session:
+            self.session.SetParameter("autodetect_processes", 2)
+
+        profile = self._ScanProfiles()
+        self.assertEqual(profile.name, "good")
+        self.assertEqual(profile.offset, 0x2000)
+
+        timings = self.session.GetParameter("autodetect_timings")
+        self.assertTrue(timings["test_marker"]["calls"] >= 2)
@@ -23,6 +23,7 @@
 
 import os
 
+from rekall import copier
 from rekall import plugin
 from rekall import testlib
 
@@ -80,25 +81,19 @@ class ImageCopy(plugin.PhysicalASMixin, plugin.Command):
             raise plugin.PluginError("Refusing to overwrite an existing file, "
                                      "please remove it before continuing")
 
-        blocksize = 1024 * 1024 * 5
+        ranges = []
+        for range_offset, _, range_length in (
+                self.address_space.get_available_addresses()):
+            renderer.format("Range {0:#x} - {1:#x}\n",
+                            range_offset, range_length)
+            ranges.append((range_offset, range_offset, range_length))
+
         with renderer.open(filename=self.output_image,
                            mode="wb") as fd:
-            for _ in self.address_space.get_available_addresses():
-                range_offset, _, range_length = _
-                renderer.format("Range {0:#x} - {1:#x}\n",
-                                range_offset, range_length)
-
-                range_end = range_offset + range_length
-
-                for offset in xrange(range_offset, range_end, blocksize):
-                    to_read = min(blocksize, range_end - offset)
-                    data = self.address_space.read(offset, to_read)
-
-                    fd.seek(offset)
-                    fd.write(data)
-
-                    renderer.RenderProgress(
-                        "Writing offset %s" % self.human_readable(offset))
+            copier.CopyRanges(
+                self.address_space, fd, ranges, session=self.session,
+                progress=lambda offset: renderer.RenderProgress(
+                    "Writing offset %s" % self.human_readable(offset)))
 
 
 class TestImageCopy(testlib.HashChecker):
@@ -264,18 +264,14 @@ class Mcat(core.OutputFileMixin, Mfind):
             # Write buffered output as a sparse file.
             with renderer.open(filename=self.out_file,
                                mode="wb") as fd:
-                for range_start, range_end in file_.extents:
+                for range_start, range_end, pages in file_.iter_extents():
                     renderer.table_row(range_start, range_end)
 
                     fd.seek(range_start)
-                    for offset in range(range_start, range_end, page_size):
-                        page_index = offset / page_size
+                    for page_index, page in pages:
+                        offset = page_index * page_size
                         to_write = min(page_size, file_.size - offset)
-                        data = file_.GetPage(page_index)
-                        if data != None:
-                            buffer += data[:to_write]
-                        else:
-                            buffer += "\x00" * to_write
+                        buffer += file_.ReadPage(page)[:to_write]
 
                         # Dump the buffer when it's full.
                         if len(buffer) >= buffer_size:
@@ -23,6 +23,7 @@
 @organization: Digital Forensics Solutions
 """
 
+from rekall import copier
 from rekall import plugin
 from rekall import testlib
 from rekall.plugins import core
@@ -91,10 +92,17 @@ class LinMemDump(core.DirectoryDumperMixin, LinMemMap):
             max_task_size = (1 << 47) - task_as.PAGE_SIZE
         max_memory = task.mm.task_size or max_task_size
 
+        # The ranges are packed into the file.
         result = []
+        ranges = []
+        file_addr = fd.tell()
         for vaddr, paddr, length in task_as.get_address_ranges(end=max_memory):
-            result.append((fd.tell(), length, vaddr))
-            fd.write(self.physical_address_space.read(paddr, length))
+            result.append((file_addr, length, vaddr))
+            ranges.append((paddr, file_addr, length))
+            file_addr += length
+
+        copier.CopyRanges(self.physical_address_space, fd, ranges,
+                          session=self.session)
 
         return result
 
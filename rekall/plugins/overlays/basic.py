@@ -84,8 +84,7 @@ class String(obj.StringProxyMixIn, obj.NativeType):
             length = 0
 
         # TODO: Make this read in chunks to support very large reads.
-        vm = vm or self.obj_vm
-        data = vm.read(self.obj_offset, length)
+        data = self.obj_read(self.obj_offset, length, vm=vm)
         if self.term is not None:
             left, sep, _ = data.partition(self.term)
             data = left + sep
@@ -161,9 +160,7 @@ class UnicodeString(String):
             'default_text_encoding')
 
     def v(self, vm=None):
-        vm = vm or self.obj_vm
-
-        data = vm.read(self.obj_offset, self.length)
+        data = self.obj_read(self.obj_offset, self.length, vm=vm)
 
         # Try to interpret it as a unicode encoded string.
         data = data.decode(self.encoding, "ignore")
@@ -70,34 +70,87 @@ class File(object):
     @property
     def extents(self):
         """Returns a list of ranges for which we have data in memory."""
+        for range_start, range_end, _ in self.iter_extents():
+            yield (range_start, range_end)
+
+    def iter_extents(self):
+        """Groups the cached pages into ranges of the file.
+
+        Yields:
+          (range_start, range_end, pages) tuples, where range_end is inclusive
+          and pages is a list of the (index, page) pairs in the range.
+        """
         page_size = self.session.kernel_address_space.PAGE_SIZE
-        range_start = None
-
-        index = 0
-        while index <= (self.size / page_size):
-            page = self._radix_tree_lookup(index)
-            if page:
-                # Start a new range if previously there was no data.
-                if range_start == None:
-                    range_start = index * page_size
+        pages = []
+        for index, page in self.pages():
+            # Finish the current range if the previous page is missing.
+            if pages and pages[-1][0] + 1 != index:
+                yield self._make_extent(pages, page_size)
+                pages = []
+
+            pages.append((index, page))
+
+        if pages:
+            yield self._make_extent(pages, page_size)
+
+    def _make_extent(self, pages, page_size):
+        range_start = pages[0][0] * page_size
+        range_end = min(self.size, (pages[-1][0] + 1) * page_size - 1)
+
+        return range_start, range_end, pages
+
+    def pages(self):
+        """Yields (index, page) for the pages of the file in the page cache.
+
+        Pages are yielded in index order. Unlike _radix_tree_lookup() this
+        walks the radix tree only once, visiting only populated slots, so the
+        cost is proportional to the number of cached pages rather than the size
+        of the file.
+        """
+        page_size = self.session.kernel_address_space.PAGE_SIZE
+        last_index = self.size / page_size
+
+        root = self.dentry.d_inode.i_mapping.page_tree
+        node = root.rnode
+        if not node:
+            return
+
+        # The root points directly at the page at index 0.
+        if not self._radix_tree_is_indirect_ptr(node):
+            yield 0, node.dereference_as("page")
+            return
+
+        node = self._radix_tree_indirect_to_ptr(node).deref()
+        map_shift = int(math.log(len(node.slots)) / math.log(2))
+
+        for index, page in self._radix_tree_iter_node(
+                node, node.height, 0, map_shift):
+            if index > last_index:
+                break
+
+            yield index, page
+
+    def _radix_tree_iter_node(self, node, height, index, map_shift):
+        """Yields (index, page) for the populated slots below the node."""
+        shift = (height - 1) * map_shift
+        profile = self.dentry.obj_profile
+
+        # Decoding the slots in one go is much faster than creating a Pointer
+        # for each of them.
+        for i, slot in enumerate(node.slots.unpack_all()):
+            if not slot:
+                continue
+
+            slot_index = index | (i << shift)
+            slot &= ~1
+            if height > 1:
+                child = profile.radix_tree_node(offset=slot, vm=node.obj_vm)
+                for result in self._radix_tree_iter_node(
+                        child, height - 1, slot_index, map_shift):
+                    yield result
+
             else:
-                # Finish the current range if previously we had data.
-                if range_start != None:
-                    range_end = (index * page_size) -1
-                    range_end = min(self.size, range_end)
-                    yield (range_start, range_end)
-                    range_start = None
-            index += 1
-
-        # Close the last range, as if there was data in the tail of the file, we
-        # wouldn't have outputted it.
-        # Since we cannot guarantee that there won't be data in the last index+1
-        # of the radix tree we do an explicit check, instead of walking
-        # total_indexes+1 in the algorithm above.
-        if range_start != None:
-            range_end = (index * page_size) - 1
-            range_end = min(self.size, range_end)
-            yield (range_start, range_end)
+                yield slot_index, profile.page(offset=slot, vm=node.obj_vm)
 
     def _radix_tree_is_indirect_ptr(self, ptr):
         """See include/linux/radix-tree.h -> is_indirect_ptr()."""
@@ -169,11 +222,14 @@ class File(object):
         return self._radix_tree_lookup_element(index, 0)
 
     def GetPage(self, page_index):
-        page_size = self.session.kernel_address_space.PAGE_SIZE
         page = self._radix_tree_lookup(page_index)
         if page:
-            page = page.dereference_as("page")
-            return page.read(0, page_size)
+            return self.ReadPage(page.dereference_as("page"))
+
+    def ReadPage(self, page):
+        """Returns the data of a page in the page cache."""
+        page_size = self.session.kernel_address_space.PAGE_SIZE
+        return page.read(0, page_size)
 
     def walk(self, recursive=False, unallocated=False):
         if not self.is_directory():
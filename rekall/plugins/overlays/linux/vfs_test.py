@@ -0,0 +1,108 @@
+import struct
+
+from rekall import addrspace
+from rekall import session
+from rekall import testlib
+from rekall.plugins.overlays import basic
+from rekall.plugins.overlays.linux import vfs
+
+
+class PageCacheTestProfile(basic.ProfileLP64, basic.BasicClasses):
+    """A profile with just enough of the page cache structs."""
+
+    @classmethod
+    def Initialize(cls, profile):
+        super(PageCacheTestProfile, cls).Initialize(profile)
+        profile.add_types({
+            'radix_tree_root': [0x8, {
+                'rnode': [0x0, ['Pointer', dict(target='radix_tree_node')]],
+            }],
+            'radix_tree_node': [0x28, {
+                'height': [0x0, ['unsigned int']],
+                'slots': [0x8, ['Array', dict(
+                    count=4, target='Pointer',
+                    target_args=dict(target='void'))]],
+            }],
+            'address_space': [0x8, {
+                'page_tree': [0x0, ['radix_tree_root']],
+            }],
+            'inode': [0x10, {
+                'i_size': [0x0, ['unsigned long long']],
+                'i_mapping': [0x8, ['Pointer', dict(target='address_space')]],
+            }],
+            'dentry': [0x8, {
+                'd_inode': [0x0, ['Pointer', dict(target='inode')]],
+            }],
+            'page': [0x8, {
+                'index': [0x0, ['unsigned long long']],
+            }],
+        })
+
+
+class FileTest(testlib.RekallBaseUnitTestCase):
+    """Test walking the page cache of a file."""
+
+    def setUp(self):
+        self.data = bytearray(0x4000)
+        self.next_offset = 0x100
+
+        # A three level tree (with 4 slots per node) of pages.
+        self.indexes = [0, 3, 7, 8, 9, 33, 34, 35, 60, 63]
+        root = self._BuildNode(3, 0)
+
+        mapping = self._Allocate(0x8)
+        struct.pack_into("<Q", self.data, mapping, root | 1)
+
+        # The last page is past the end of the file.
+        inode = self._Allocate(0x10)
+        struct.pack_into("<QQ", self.data, inode, 61 * 0x1000 - 0x10, mapping)
+
+        dentry = self._Allocate(0x8)
+        struct.pack_into("<Q", self.data, dentry, inode)
+
+        self.session = session.Session()
+        address_space = addrspace.BufferAddressSpace(
+            data=str(self.data), session=self.session)
+        address_space.PAGE_SIZE = 0x1000
+        self.session.kernel_address_space = address_space
+
+        profile = PageCacheTestProfile(session=self.session)
+        self.file = vfs.File(
+            filename="test", session=self.session,
+            dentry=profile.dentry(offset=dentry, vm=address_space))
+
+    def _Allocate(self, size):
+        offset = self.next_offset
+        self.next_offset += (size + 0xf) & ~0xf
+
+        return offset
+
+    def _BuildNode(self, height, index):
+        offset = self._Allocate(0x28)
+        struct.pack_into("<I", self.data, offset, height)
+
+        span = 4 ** (height - 1)
+        for i in range(4):
+            slot_index = index + i * span
+            if not [x for x in self.indexes
+                    if slot_index <= x < slot_index + span]:
+                continue
+
+            if height > 1:
+                child = self._BuildNode(height - 1, slot_index)
+            else:
+                child = self._Allocate(0x8)
+                struct.pack_into("<Q", self.data, child, slot_index)
+
+            struct.pack_into("<Q", self.data, offset + 0x8 + i * 8, child)
+
+        return offset
+
+    def testPages(self):
+        self.assertEqual(
+            [(index, page.index.v()) for index, page in self.file.pages()],
+            [(x, x) for x in self.indexes if x <= 60])
+
+        self.assertEqual(list(self.file.extents),
+                         [(0, 0xfff), (0x3000, 0x3fff), (0x7000, 0x9fff),
+                          (0x21000, 0x23fff), (0x3c000, 0x3cff0)])
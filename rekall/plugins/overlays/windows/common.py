@@ -983,7 +983,8 @@ class _HANDLE_TABLE(obj.Struct):
         is the _HANDLE_TABLE_ENTRY so that an object can be linked to its
         GrantedAccess.
         """
-        return entry.Object.dereference_as("_OBJECT_HEADER", parent=entry)
+        return entry.Object.dereference_as(
+            "_OBJECT_HEADER", parent=entry).take_snapshot()
 
     def _make_handle_array(self, table_offset, level):
         """ Returns an array of _HANDLE_TABLE_ENTRY rooted at offset,
@@ -1299,7 +1300,7 @@ class VadTraverser(obj.Struct):
 
         # Find out which Vad type we need to be:
         if self.Tag in self.tag_map:
-            yield self.cast(self.tag_map[self.Tag])
+            yield self.cast(self.tag_map[self.Tag], snapshot=True)
 
         # This tag is valid for the Root.
         elif depth and self.Tag.v() != "\x00":
@@ -15,3 +15,8 @@ try:
     from rekall.plugins.renderers import xls
 except ImportError:
     pass
+
+try:
+    from rekall.plugins.renderers import columnar
+except ImportError:
+    pass
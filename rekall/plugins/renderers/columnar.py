@@ -0,0 +1,351 @@
+# Rekall Memory Forensics
+# Copyright 2016 Google Inc. All Rights Reserved.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or (at
+# your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA 02111-1307 USA
+#
+
+"""This file implements a columnar renderer based on the pyarrow project.
+
+The JSON based renderers encode every cell of every row separately, which is
+slow to produce and to parse for bulk analysis of plugin output. This renderer
+stores tables in the Arrow file format instead: addresses, integers and strings
+are stored natively in typed columns, and rows are written in batches.
+
+The output is a directory. Each table is written to its own file, named after
+the plugin and the table number (e.g. pslist-0.arrow).
+"""
+import json
+import os
+import time
+
+import pyarrow
+
+from rekall import config
+from rekall import utils
+from rekall.ui import renderer
+from rekall.ui import text
+
+
+config.DeclareOption(
+    "--columnar_batch_size", default=10000, type="IntParser",
+    group="Interface",
+    help="The number of rows in each batch written by the columnar renderer.")
+
+
+# The Arrow type used for each kind of column. Columns of kind "uint" hold
+# integers which fit both the "int" and "address" kinds.
+COLUMN_TYPES = dict(
+    null=pyarrow.null(),
+    uint=pyarrow.int64(),
+    int=pyarrow.int64(),
+    address=pyarrow.uint64(),
+    float=pyarrow.float64(),
+    bool=pyarrow.bool_(),
+    string=pyarrow.string(),
+)
+
+# The kind of column which can hold values of two different kinds. All other
+# combinations are stored as strings.
+MERGED_KINDS = {
+    frozenset(["uint", "int"]): "int",
+    frozenset(["uint", "address"]): "address",
+    frozenset(["uint", "float"]): "float",
+    frozenset(["int", "float"]): "float",
+}
+
+# Columns with these formatstrings or styles contain addresses.
+ADDRESS_FORMATS = ("[addrpad]", "[addr]")
+
+
+def _GetKind(value):
+    """Returns the narrowest kind of column which can hold a native value."""
+    if isinstance(value, bool):
+        return "bool"
+
+    if isinstance(value, (int, long)):
+        if 0 <= value < 2**63:
+            return "uint"
+
+        if -2**63 <= value < 0:
+            return "int"
+
+        if 2**63 <= value < 2**64:
+            return "address"
+
+        return "string"
+
+    if isinstance(value, float):
+        return "float"
+
+    return "string"
+
+
+def _MergeKinds(kind, other):
+    """Returns the kind of column which can hold values of both kinds."""
+    if kind == other or other == "null":
+        return kind
+
+    if kind == "null":
+        return other
+
+    return MERGED_KINDS.get(frozenset([kind, other]), "string")
+
+
+def _ConvertValue(value, kind):
+    """Converts the value for a column of the kind it was merged into."""
+    if value is None:
+        return None
+
+    if kind == "string":
+        return utils.SmartUnicode(value)
+
+    if kind == "float":
+        return float(value)
+
+    return value
+
+
+class ColumnarObjectRenderer(renderer.ObjectRenderer):
+    """By default values are stored as rendered by the text renderer."""
+    renders_type = "object"
+    renderers = ["ColumnarRenderer"]
+
+    def GetData(self, item, **options):
+        """Returns the value to store for the item.
+
+        This must be a python int, long, float, bool, unicode or None.
+        """
+        # Cells in the columnar output are never wrapped.
+        options.pop("width", None)
+        object_renderer = self.ForTarget(item, "TextRenderer")(
+            session=self.session, renderer=self.renderer.delegate_text_renderer)
+
+        return utils.SmartUnicode(object_renderer.render_row(item, **options))
+
+
+class ColumnarNativeRenderer(ColumnarObjectRenderer):
+    renders_type = ("int", "long", "float", "bool")
+
+    def GetData(self, item, **_):
+        return item
+
+
+class ColumnarPythonStringRenderer(ColumnarObjectRenderer):
+    renders_type = ("str", "unicode")
+
+    def GetData(self, item, **_):
+        return utils.SmartUnicode(item)
+
+
+class ColumnarNoneObjectRenderer(ColumnarObjectRenderer):
+    renders_type = ("NoneObject", "NoneType")
+
+    def GetData(self, item, **_):
+        return None
+
+
+class ColumnarNativeTypeRenderer(ColumnarObjectRenderer):
+    """Stores native types (and pointers) by their value."""
+    renders_type = "NativeType"
+
+    def GetData(self, item, **_):
+        result = item.v()
+        if result != None:
+            return result
+
+
+class ColumnarStringRenderer(ColumnarObjectRenderer):
+    renders_type = "String"
+
+    def GetData(self, item, **_):
+        return utils.SmartUnicode(item)
+
+
+class ColumnarStructRenderer(ColumnarObjectRenderer):
+    """Structs are stored as their address."""
+    renders_type = "Struct"
+
+    def GetData(self, item, **_):
+        return item.obj_offset
+
+
+class ColumnarTable(renderer.BaseTable):
+    """Buffers the rows of a table and writes them in batches."""
+
+    def __init__(self, **options):
+        super(ColumnarTable, self).__init__(**options)
+
+        self.names = []
+        self.kinds = []
+        for i, column_spec in enumerate(self.column_specs):
+            name = column_spec.get("cname") or column_spec.get("name")
+            name = utils.SmartUnicode(name or "column%d" % i)
+            if name in self.names:
+                name = u"%s_%d" % (name, i)
+
+            self.names.append(name)
+
+            # Address columns are known from the spec, other columns are typed
+            # by their values.
+            if (column_spec.get("style") == "address" or
+                    column_spec.get("formatstring") in ADDRESS_FORMATS):
+                self.kinds.append("address")
+            else:
+                self.kinds.append("null")
+
+        self.batch = [[] for _ in self.column_specs]
+        self.batch_size = self.session.GetParameter(
+            "columnar_batch_size", 10000)
+        self.path = self.fd = self.writer = None
+
+    def render_row(self, row=None, **options):
+        for i, column in enumerate(self.batch):
+            item = row[i] if i < len(row) else None
+            column_spec = self.column_specs[i].copy()
+            column_spec.update(options)
+            column_spec.pop("type", None)
+
+            object_renderer = self.renderer.get_object_renderer(
+                item, **column_spec)
+            column.append(object_renderer.GetData(item, **column_spec))
+
+        if len(self.batch[0]) >= self.batch_size:
+            self.write_batch()
+
+    def _GetSchema(self):
+        metadata = dict(
+            plugin_name=utils.SmartStr(self.renderer.plugin_name),
+            column_names=json.dumps([x.get("name") for x in self.column_specs]))
+
+        return pyarrow.schema(
+            [pyarrow.field(name, COLUMN_TYPES[kind])
+             for name, kind in zip(self.names, self.kinds)],
+            metadata=metadata)
+
+    def _OpenWriter(self):
+        self.fd = pyarrow.OSFile(self.path, "wb")
+        self.writer = pyarrow.RecordBatchFileWriter(self.fd, self._GetSchema())
+
+    def _CloseWriter(self):
+        self.writer.close()
+        self.fd.close()
+        self.writer = self.fd = None
+
+    def _WriteColumns(self, columns):
+        arrays = []
+        for values, kind in zip(columns, self.kinds):
+            arrays.append(pyarrow.array(
+                [_ConvertValue(x, kind) for x in values],
+                type=COLUMN_TYPES[kind]))
+
+        self.writer.write_batch(
+            pyarrow.RecordBatch.from_arrays(arrays, self.names))
+
+    def _Rewrite(self, kinds):
+        """Rewrites the batches already written with wider column types.
+
+        The schema of an Arrow file is fixed, so if a batch holds values which
+        do not fit the columns written so far, the file is written again with
+        columns which fit all the values.
+        """
+        self._CloseWriter()
+        old_path = self.path + ".tmp"
+        os.rename(self.path, old_path)
+
+        self.kinds = kinds
+        self._OpenWriter()
+
+        source = pyarrow.OSFile(old_path)
+        try:
+            reader = pyarrow.RecordBatchFileReader(source)
+            for i in xrange(reader.num_record_batches):
+                batch = reader.get_batch(i)
+                self._WriteColumns(
+                    [batch.column(j).to_pylist()
+                     for j in xrange(batch.num_columns)])
+        finally:
+            source.close()
+
+        os.unlink(old_path)
+
+    def write_batch(self):
+        if not self.batch or (self.writer is not None and not self.batch[0]):
+            return
+
+        kinds = list(self.kinds)
+        for i, values in enumerate(self.batch):
+            for value in values:
+                if value is not None:
+                    kinds[i] = _MergeKinds(kinds[i], _GetKind(value))
+
+        if self.writer is None:
+            self.kinds = kinds
+            self.path = self.renderer.GetTablePath()
+            self._OpenWriter()
+
+        elif kinds != self.kinds:
+            self._Rewrite(kinds)
+
+        self._WriteColumns(self.batch)
+        self.batch = [[] for _ in self.column_specs]
+
+    def flush(self):
+        self.write_batch()
+        if self.writer is not None:
+            self._CloseWriter()
+
+
+class ColumnarRenderer(renderer.BaseRenderer):
+    """A renderer which writes tables in the Arrow columnar format."""
+
+    name = "columnar"
+
+    table_class = ColumnarTable
+
+    plugin_name = None
+
+    def __init__(self, output=None, **kwargs):
+        super(ColumnarRenderer, self).__init__(**kwargs)
+
+        # Cells without a native representation are stored as rendered by the
+        # text renderer.
+        self.delegate_text_renderer = text.TextRenderer(session=self.session)
+
+        self.output = output or self.session.GetParameter("output")
+
+        # If no output directory was given, just make a name based on the time
+        # stamp.
+        if self.output == None:
+            self.output = "%s.columnar" % time.ctime()
+
+        self.table_count = 0
+
+    def start(self, plugin_name=None, kwargs=None):
+        super(ColumnarRenderer, self).start(
+            plugin_name=plugin_name, kwargs=kwargs)
+        self.plugin_name = plugin_name or "output"
+
+        return self
+
+    def GetTablePath(self):
+        """Returns the path of the file for a new table."""
+        if not os.path.isdir(self.output):
+            os.makedirs(self.output)
+
+        path = os.path.join(self.output, "%s-%d.arrow" % (
+            self.plugin_name, self.table_count))
+        self.table_count += 1
+
+        return path
@@ -0,0 +1,81 @@
+import os
+import shutil
+import tempfile
+
+from rekall import session
+from rekall import testlib
+
+try:
+    import pyarrow
+    from rekall.plugins.renderers import columnar
+except ImportError:
+    columnar = None
+
+
+if columnar is not None:
+    # testlib's run() does not honour unittest skips.
+    class ColumnarRendererTest(testlib.RekallBaseUnitTestCase):
+
+        def setUp(self):
+            self.session = session.Session(columnar_batch_size=2)
+            self.output = tempfile.mkdtemp()
+
+        def tearDown(self):
+            shutil.rmtree(self.output)
+
+        def testTables(self):
+            renderer = columnar.ColumnarRenderer(
+                session=self.session, output=self.output)
+            with renderer.start(plugin_name="test"):
+                renderer.table_header([
+                    dict(name="Offset", style="address"),
+                    dict(name="PID", cname="pid"),
+                    dict(name="Name", cname="name")])
+                renderer.table_row(0xfffffa8000000000, 4, "System")
+                renderer.table_row(0x1000, 100, u"cmd.exe")
+                renderer.table_row(None, -1, 5)
+
+                renderer.table_header([dict(name="Value")])
+                renderer.table_row(1.5)
+
+            reader = pyarrow.RecordBatchFileReader(
+                pyarrow.OSFile(self.output + "/test-0.arrow"))
+            self.assertEqual(reader.num_record_batches, 2)
+
+            table = reader.read_all()
+            self.assertEqual(table.schema.names, ["Offset", "pid", "name"])
+            self.assertEqual(table.schema.types, [
+                pyarrow.uint64(), pyarrow.int64(), pyarrow.string()])
+            self.assertEqual(table.to_pydict(), {
+                "Offset": [0xfffffa8000000000, 0x1000, None],
+                "pid": [4, 100, -1],
+                "name": [u"System", u"cmd.exe", u"5"]})
+
+            table = pyarrow.RecordBatchFileReader(
+                pyarrow.OSFile(self.output + "/test-1.arrow")).read_all()
+            self.assertEqual(table.to_pydict(), {"Value": [1.5]})
+
+        def testWidenColumns(self):
+            """Values which do not fit the columns written so far are kept."""
+            renderer = columnar.ColumnarRenderer(
+                session=self.session, output=self.output)
+            with renderer.start(plugin_name="test"):
+                renderer.table_header([dict(name="Value"), dict(name="Other")])
+                renderer.table_row(1, None)
+                renderer.table_row(2, None)
+                renderer.table_row(2**63 + 5, 1.5)
+                renderer.table_row(3, 2)
+                renderer.table_row(-1, None)
+
+            self.assertEqual(os.listdir(self.output), ["test-0.arrow"])
+            reader = pyarrow.RecordBatchFileReader(
+                pyarrow.OSFile(self.output + "/test-0.arrow"))
+            self.assertEqual(reader.num_record_batches, 3)
+
+            table = reader.read_all()
+            self.assertEqual(table.schema.types, [
+                pyarrow.string(), pyarrow.float64()])
+            self.assertEqual(table.to_pydict(), {
+                "Value": [u"1", u"2", u"9223372036854775813", u"3", u"-1"],
+                "Other": [None, None, 1.5, 2.0, None]})
+
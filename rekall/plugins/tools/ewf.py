@@ -48,10 +48,15 @@ ELF core dump and stacks the relevant address spaces.
 
 __author__ = "Michael Cohen <scudette@google.com>"
 import array
+import collections
+import multiprocessing
 import os
 import struct
 import zlib
 
+from multiprocessing import pool
+
+from rekall import config
 from rekall import obj
 from rekall import plugin
 from rekall import testlib
@@ -61,6 +66,18 @@ from rekall.plugins.addrspaces import standard
 from rekall.plugins.overlays import basic
 
 
+config.DeclareOption(
+    "--ewf_compression_threads", default=0, type="IntParser",
+    help="Number of threads used to compress or decompress the chunks of EWF "
+    "files. 0 uses one thread per CPU.")
+
+
+config.DeclareOption(
+    "--ewf_readahead", default=16, type="IntParser",
+    help="Number of chunks to read ahead when EWF files are read "
+    "sequentially. 0 disables read ahead.")
+
+
 EWF_TYPES = dict(
     ewf_file_header_v1=[0x0d, {
         'EVF_sig': [0, ['Signature', dict(value="EVF\x09\x0d\x0a\xff\x00")]],
@@ -200,7 +217,11 @@ class EWFProfile(basic.ProfileLLP64, basic.BasicClasses):
 
 
 class EWFFile(object):
-    """A helper for parsing an EWF file."""
+    """A helper for parsing an EWF file.
+
+    When chunks are read sequentially, the following chunks are read ahead
+    with a single read and inflated by a pool of threads.
+    """
 
     def __init__(self, session=None, address_space=None):
         self.session = session
@@ -211,8 +232,20 @@ class EWFFile(object):
         self._chunk_offset = 0
         self.chunk_size = 32 * 1024
 
+        # The number of chunks to read ahead.
+        self.readahead = self.session.GetParameter("ewf_readahead", 16)
+        self.threads = GetThreadCount(self.session)
+        self.pool = None
+
+        # Chunks which were read ahead but not used yet. Either tuples of
+        # (data, compressed) or pending results of the thread pool.
+        self.prefetched = {}
+        self._last_chunk_id = None
+        self._readahead_end = 0
+
         # 32kb * 100 = 3.2mb cache size.
-        self.chunk_cache = utils.FastStore(max_size=100)
+        self.chunk_cache = utils.FastStore(
+            max_size=max(100, 2 * self.readahead))
 
         self.address_space = address_space
         self.profile = EWFProfile(session=session)
@@ -303,33 +336,118 @@ class EWFFile(object):
         # The next table starts at this chunk.
         self._chunk_offset += number_of_entries
 
+    def reopen(self):
+        """Drop the thread pool and read ahead chunks.
+
+        This is called in worker processes forked from the main process, which
+        do not inherit the threads of the pool.
+        """
+        self.pool = None
+        self.prefetched.clear()
+        self._last_chunk_id = None
+
+    def _GetChunkLocation(self, chunk_id):
+        """Returns (file offset, length, compressed) for the chunk (or None)."""
+        start_chunk, table_header, table = self.tables.find_le(chunk_id)
+
+        # This should be a ewf_table_entry object but the below is faster.
+        try:
+            table_entry = table[chunk_id - start_chunk]
+
+            offset = table_entry & 0x7fffffff
+            next_offset = table[chunk_id - start_chunk + 1] & 0x7fffffff
+        except IndexError:
+            return None
+
+        return (offset + table_header.base_offset, next_offset - offset,
+                bool(table_entry & 0x80000000))
+
+    def _CheckSequential(self, chunk_id):
+        """Reads ahead when chunks are read sequentially."""
+        if self._last_chunk_id is None or chunk_id != self._last_chunk_id + 1:
+            # Random access: Drop chunks read ahead for an earlier sequence.
+            if chunk_id not in self.prefetched:
+                self.prefetched.clear()
+                self._readahead_end = chunk_id + 1
+
+        # Keep at least half a window of chunks in flight.
+        elif chunk_id + self.readahead / 2 >= self._readahead_end:
+            self.ReadAhead(max(chunk_id, self._readahead_end),
+                           chunk_id + 1 + self.readahead)
+
+        self._last_chunk_id = chunk_id
+
+    def ReadAhead(self, start, end):
+        """Starts reading the chunks from start to end (exclusive)."""
+        self._readahead_end = max(self._readahead_end, end)
+
+        # Chunks are normally stored contiguously in the file so we coalesce
+        # them into as few reads as possible.
+        run = []
+        for chunk_id in xrange(start, end):
+            if chunk_id in self.prefetched or chunk_id in self.chunk_cache:
+                continue
+
+            location = self._GetChunkLocation(chunk_id)
+            if location is None:
+                break
+
+            if run and run[-1][1] + run[-1][2] != location[0]:
+                self._ReadRun(run)
+                run = []
+
+            run.append((chunk_id, ) + location)
+
+        if run:
+            self._ReadRun(run)
+
+    def _ReadRun(self, run):
+        """Read chunks which are contiguous in the file with a single read."""
+        start = run[0][1]
+        _, last_offset, last_length, _ = run[-1]
+        data = self.address_space.read(start, last_offset + last_length - start)
+
+        if self.pool is None and self.threads > 1:
+            self.pool = pool.ThreadPool(self.threads)
+
+        for chunk_id, offset, length, compressed in run:
+            chunk_data = data[offset - start:offset - start + length]
+            if compressed and self.pool is not None:
+                self.prefetched[chunk_id] = self.pool.apply_async(
+                    zlib.decompress, (chunk_data, ))
+            else:
+                self.prefetched[chunk_id] = (chunk_data, compressed)
+
     def read_chunk(self, chunk_id):
         """Read a single chunk from the file."""
         try:
             return self.chunk_cache.Get(chunk_id)
         except KeyError:
-            start_chunk, table_header, table = self.tables.find_le(chunk_id)
+            pass
 
-            # This should be a ewf_table_entry object but the below is faster.
-            try:
-                table_entry = table[chunk_id - start_chunk]
+        if self.readahead:
+            self._CheckSequential(chunk_id)
 
-                offset = table_entry & 0x7fffffff
-                next_offset = table[chunk_id - start_chunk + 1] & 0x7fffffff
-                compressed_chunk_size = next_offset - offset
-            except IndexError:
+        chunk = self.prefetched.pop(chunk_id, None)
+        if chunk is None:
+            location = self._GetChunkLocation(chunk_id)
+            if location is None:
                 return ""
 
-            data = self.address_space.read(
-                offset + table_header.base_offset, compressed_chunk_size)
+            offset, length, compressed = location
+            chunk = (self.address_space.read(offset, length), compressed)
 
-            if table_entry & 0x80000000:
+        if isinstance(chunk, pool.ApplyResult):
+            data = chunk.get()
+        else:
+            data, compressed = chunk
+            if compressed:
                 data = zlib.decompress(data)
 
-            # Cache the chunk for later.
-            self.chunk_cache.Put(chunk_id, data)
+        # Cache the chunk for later.
+        self.chunk_cache.Put(chunk_id, data)
 
-            return data
+        return data
 
     def read_partial(self, offset, length):
         """Read as much as possible from the current offset."""
@@ -347,6 +465,9 @@ class EWFFile(object):
         # Most read operations are very short and will not need to merge chunks
         # at all. In that case concatenating strings is much faster than storing
         # partial reads into a list and join()ing them.
+        if length > self.chunk_size:
+            return self._read_bulk(offset, length)
+
         result = ''
         available_length = length
 
@@ -361,6 +482,55 @@ class EWFFile(object):
 
         return result
 
+    def _read_bulk(self, offset, length):
+        """Read a range spanning many chunks.
+
+        All the chunks are read at once and inflated in parallel.
+        """
+        if self.readahead:
+            self.ReadAhead(offset // self.chunk_size,
+                           (offset + length - 1) // self.chunk_size + 1)
+
+        result = []
+        available_length = length
+        while available_length > 0:
+            buf = self.read_partial(offset, available_length)
+            if not buf:
+                break
+
+            result.append(buf)
+            offset += len(buf)
+            available_length -= len(buf)
+
+        return "".join(result)
+
+
+def GetThreadCount(session, threads=None):
+    """Returns the number of threads to use for (de)compressing chunks."""
+    if threads is None:
+        threads = session.GetParameter("ewf_compression_threads", 0)
+
+    if threads <= 0:
+        try:
+            threads = multiprocessing.cpu_count()
+        except NotImplementedError:
+            threads = 1
+
+    return threads
+
+
+def CompressChunk(data):
+    """Compress a chunk for storing in an EWF file.
+
+    Returns:
+      A tuple of (data to store, True if the data is compressed).
+    """
+    cdata = zlib.compress(data)
+    if len(cdata) > len(data):
+        return data, False
+
+    return cdata, True
+
 
 class EWFFileWriter(object):
     """A writer for EWF files.
@@ -369,9 +539,16 @@ class EWFFileWriter(object):
     Encase/FTK. We produce EWFv1 files which are unable to store sparse
     images. We place an ELF file inside the EWF container to ensure we can
     efficiently store sparse memory ranges.
+
+    Chunks are compressed by a pool of threads (zlib releases the GIL while
+    compressing) and written in order by the calling thread.
     """
 
-    def __init__(self, out_as, session):
+    # The number of chunks per thread which may be waiting to be written. This
+    # bounds the memory used for chunks which are compressed ahead of time.
+    CHUNKS_IN_FLIGHT = 16
+
+    def __init__(self, out_as, session, threads=None):
         self.out_as = out_as
         self.session = session
         self.profile = EWFProfile(session=self.session)
@@ -379,6 +556,21 @@ class EWFFileWriter(object):
         self.current_offset = 0
         self.chunk_id = 0
 
+        # Memory images contain many empty pages, so we only compress an empty
+        # chunk once.
+        self.zero_chunk = "\x00" * self.chunk_size
+        self.compressed_zero_chunk = CompressChunk(self.zero_chunk)
+
+        threads = GetThreadCount(self.session, threads)
+
+        # Chunks which are not written yet. Either tuples returned by
+        # CompressChunk() or pending results of the thread pool.
+        self.pending = collections.deque()
+        self.max_pending = self.CHUNKS_IN_FLIGHT * threads
+        self.pool = None
+        if threads > 1:
+            self.pool = pool.ThreadPool(threads)
+
         self.last_section = None
 
         # Start off by writing the file header.
@@ -430,31 +622,54 @@ class EWFFileWriter(object):
         buffer_offset = 0
         while len(self.buffer) - buffer_offset >= self.chunk_size:
             data = self.buffer[buffer_offset:buffer_offset+self.chunk_size]
-            cdata = zlib.compress(data)
-            chunk_offset = self.current_offset - self.base_offset
+            buffer_offset += self.chunk_size
 
-            if len(cdata) > len(data):
-                self.table.append(chunk_offset)
-                cdata = data
+            if data == self.zero_chunk:
+                self.pending.append(self.compressed_zero_chunk)
+            elif self.pool is None:
+                self.pending.append(CompressChunk(data))
             else:
-                self.table.append(0x80000000 | chunk_offset)
+                self.pending.append(
+                    self.pool.apply_async(CompressChunk, (data,)))
 
-            self.out_as.write(self.current_offset, cdata)
-            self.current_offset += len(cdata)
-            buffer_offset += self.chunk_size
-            self.chunk_id += 1
-
-            # Flush the table when it gets too large. Tables can only store 31
-            # bit offset and so can only address roughly 2gb. We choose to stay
-            # under 1gb: 30000 * 32kb = 0.91gb.
-            if len(self.table) > 30000:
-                self.session.report_progress(
-                    "Flushing EWF Table %s.", self.table_count)
-                self.FlushTable()
-                self.StartNewTable()
+            # Only wait for the oldest chunk when the window is full so the
+            # pool is kept busy.
+            if len(self.pending) > self.max_pending:
+                self.WriteChunk(self.pending.popleft())
 
         self.buffer = self.buffer[buffer_offset:]
 
+    def WriteChunk(self, chunk):
+        """Writes a compressed chunk and adds it to the table."""
+        if isinstance(chunk, pool.ApplyResult):
+            chunk = chunk.get()
+
+        cdata, compressed = chunk
+        chunk_offset = self.current_offset - self.base_offset
+
+        if compressed:
+            self.table.append(0x80000000 | chunk_offset)
+        else:
+            self.table.append(chunk_offset)
+
+        self.out_as.write(self.current_offset, cdata)
+        self.current_offset += len(cdata)
+        self.chunk_id += 1
+
+        # Flush the table when it gets too large. Tables can only store 31
+        # bit offset and so can only address roughly 2gb. We choose to stay
+        # under 1gb: 30000 * 32kb = 0.91gb.
+        if len(self.table) > 30000:
+            self.session.report_progress(
+                "Flushing EWF Table %s.", self.table_count)
+            self.FlushTable()
+            self.StartNewTable()
+
+    def WritePending(self):
+        """Waits for all the pending chunks and writes them."""
+        while self.pending:
+            self.WriteChunk(self.pending.popleft())
+
     def FlushTable(self):
         """Flush the current table."""
         table_section = self.profile.ewf_section_descriptor_v1(
@@ -476,11 +691,19 @@ class EWFFileWriter(object):
 
         self.current_offset = (table_header.entries.obj_offset +
                                4 * len(self.table))
+
     def Close(self):
-        # If there is some data left over, pad it to the length of the chunk so
-        # we get to write it.
-        if len(self.buffer):
-            self.write("\x00" * (self.chunk_size - len(self.buffer)))
+        try:
+            # If there is some data left over, pad it to the length of the
+            # chunk so we get to write it.
+            if len(self.buffer):
+                self.write("\x00" * (self.chunk_size - len(self.buffer)))
+
+            self.WritePending()
+        finally:
+            if self.pool is not None:
+                self.pool.terminate()
+                self.pool = None
 
         self.FlushTable()
 
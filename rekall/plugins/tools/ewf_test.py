@@ -0,0 +1,72 @@
+import StringIO
+
+from rekall import session
+from rekall import testlib
+from rekall.plugins.addrspaces import standard
+from rekall.plugins.tools import ewf
+
+
+class EWFFileWriterTest(testlib.RekallBaseUnitTestCase):
+    """Test writing EWF files."""
+
+    def setUp(self):
+        self.session = session.Session()
+
+        # Compressible, incompressible and empty chunks, with a partial chunk
+        # at the end.
+        self.data = "".join(
+            ["rekall" * 0x3000, "\x00" * 0x18000] +
+            [chr((i * 7919) % 251) * 3 + chr(i % 256)
+             for i in range(0x4000)] +
+            ["\x00" * 0x9000, "end"])
+
+    def _Write(self, threads):
+        fd = StringIO.StringIO()
+        out_as = standard.WritableFDAddressSpace(
+            fhandle=fd, session=self.session)
+
+        with ewf.EWFFileWriter(
+            out_as, session=self.session, threads=threads) as writer:
+            # Write in pieces which do not align with the chunks.
+            for i in range(0, len(self.data), 0x7001):
+                writer.write(self.data[i:i+0x7001])
+
+        return fd.getvalue()
+
+    def testWriter(self):
+        serial = self._Write(threads=1)
+
+        # Compressing in the thread pool must produce the same file.
+        self.assertEqual(self._Write(threads=3), serial)
+
+        ewf_file = ewf.EWFFile(
+            session=self.session,
+            address_space=standard.FDAddressSpace(
+                fhandle=StringIO.StringIO(serial), session=self.session))
+
+        self.assertEqual(ewf_file.read(0, len(self.data)), self.data)
+        self.assertEqual(ewf_file.read(len(self.data), 0x100), "\x00" * 0x100)
+
+    def testReadAhead(self):
+        image = self._Write(threads=1)
+        with self.session:
+            self.session.SetParameter("ewf_readahead", 4)
+            self.session.SetParameter("ewf_compression_threads", 3)
+
+        ewf_file = ewf.EWFFile(
+            session=self.session,
+            address_space=standard.FDAddressSpace(
+                fhandle=StringIO.StringIO(image), session=self.session))
+
+        # Sequential reads are served from the chunks read ahead.
+        result = "".join(ewf_file.read(offset, 0x1000)
+                         for offset in range(0, len(self.data), 0x1000))
+        self.assertEqual(result[:len(self.data)], self.data)
+        self.assertTrue(ewf_file.pool is not None)
+
+        # Nothing is read ahead past the end of the file.
+        self.assertEqual(ewf_file.prefetched, {})
+
+        # Bulk reads.
+        self.assertEqual(ewf_file.read(0x7ff0, 0x30000),
+                         self.data[0x7ff0:0x37ff0])
@@ -24,10 +24,14 @@
 
 # pylint: disable=protected-access
 
+import bisect
 import collections
+import heapq
 import re
+import struct
 
 from rekall import addrspace
+from rekall import config
 from rekall import scan
 from rekall import obj
 from rekall import kb
@@ -36,6 +40,19 @@ from rekall import utils
 
 from rekall.plugins import core
 
+config.DeclareOption(
+    "--pool_scanners", type="ArrayStringParser", default=[],
+    help="Pool scanner plugins (e.g. psscan filescan) which are run together "
+    "in a single pass over the image when any of them is run. The listed "
+    "plugins scan the image instead of using the pool tag index.")
+
+config.DeclareOption(
+    "--pool_tag_index", default=True, type="Boolean",
+    help="Index the offsets of all known pool tags in a single pass over "
+    "the image, so pool scanners only need to check these offsets. Plugins "
+    "listed in --pool_scanners do not use the index.")
+
+
 # Windows kernel pdb filenames.
 KERNEL_NAMES = set(
     ["ntkrnlmp.pdb", "ntkrnlpa.pdb", "ntoskrnl.pdb",
@@ -206,6 +223,7 @@ class PoolTagCheck(scan.StringCheck):
     """
     def __init__(self, tag=None, **kwargs):
         super(PoolTagCheck, self).__init__(needle=tag, **kwargs)
+        self.tags = [tag]
 
         # The offset from the start of _POOL_HEADER to the tag.
         self.tag_offset = self.profile.get_obj_offset(
@@ -227,6 +245,7 @@ class MultiPoolTagCheck(scan.MultiStringFinderCheck):
     """
     def __init__(self, tags=None, **kwargs):
         super(MultiPoolTagCheck, self).__init__(needles=tags, **kwargs)
+        self.tags = tags
 
         # The offset from the start of _POOL_HEADER to the tag.
         self.tag_offset = self.profile.get_obj_offset(
@@ -291,15 +310,167 @@ class CheckPoolIndex(scan.ScannerCheck):
         return pool_hdr.PoolIndex == self.value
 
 
+class PoolTagIndex(object):
+    """An index of the _POOL_HEADER offsets of pool tags in an address space.
+
+    Pool tags are found in a single pass over the address space for all known
+    tags. The offsets for each tag are kept as a sorted array in the session's
+    image_cache (and can therefore be persisted for later sessions).
+    """
+
+    def __init__(self, address_space=None, profile=None, session=None):
+        self.address_space = address_space
+        self.profile = profile
+        self.session = session
+
+        # The offset from the start of _POOL_HEADER to the tag.
+        self.tag_offset = self.profile.get_obj_offset(
+            "_POOL_HEADER", "PoolTag")
+
+        # The index is only valid for address spaces we can identify.
+        self.cache_key = None
+        if (not self.session.volatile and
+                self.session.GetParameter("pool_tag_index", True)):
+            self.cache_key = address_space.address_range_cache_key()
+
+    def _cache_name(self, tag):
+        return "pool_tag_index/%s%s" % (self.cache_key, tag.encode("hex"))
+
+    @staticmethod
+    def _Serialize(offsets):
+        return struct.pack("<%dQ" % len(offsets), *offsets)
+
+    @staticmethod
+    def _Unserialize(data):
+        if len(data) % 8:
+            raise ValueError("Pool tag index has an invalid length.")
+
+        return utils.Uint64Array(
+            struct.unpack("<%dQ" % (len(data) / 8), data))
+
+    def known_tags(self):
+        """All the pool tags we know about."""
+        tags = set(value for name, value in self.profile.constants.iteritems()
+                   if name.endswith("_POOLTAG"))
+
+        # Add the tags of scanners with static checks.
+        for cls in scan.BaseScanner.classes.values():
+            if issubclass(cls, PoolScanner):
+                for check, args in cls.checks:
+                    if check == "PoolTagCheck":
+                        tags.add(args["tag"])
+                    elif check == "MultiPoolTagCheck":
+                        tags.update(args["tags"])
+
+        return tags
+
+    def get_offsets(self, tag):
+        """Returns a sorted array of _POOL_HEADER offsets for this tag.
+
+        Returns None if the address space can not be indexed.
+        """
+        if self.cache_key is None:
+            return
+
+        result = self.session.image_cache.Get(
+            self._cache_name(tag), decoder=self._Unserialize)
+        if result is None:
+            self.build_index(self.known_tags() | set([tag]))
+            result = self.session.image_cache.Get(self._cache_name(tag))
+
+        return result
+
+    def build_index(self, tags):
+        """Find all the tags which are not already indexed in one pass."""
+        tags = [tag for tag in tags if self.session.image_cache.Get(
+            self._cache_name(tag), decoder=self._Unserialize) is None]
+        if not tags:
+            return
+
+        self.session.logging.debug("Building pool tag index for %d tags.",
+                                   len(tags))
+
+        offsets = dict((tag, utils.Uint64Array()) for tag in tags)
+        scanner = scan.MultiStringScanner(
+            needles=tags, profile=self.profile, session=self.session,
+            address_space=self.address_space)
+
+        for offset, tag in scanner.scan():
+            if offset >= self.tag_offset:
+                offsets[tag].append(offset - self.tag_offset)
+
+        for tag, tag_offsets in offsets.iteritems():
+            self.session.image_cache.Put(
+                self._cache_name(tag), tag_offsets, encoder=self._Serialize)
+
+
 class PoolScanner(scan.BaseScanner):
     """A scanner for pool allocations."""
 
+    # The number of candidates read from the image at once.
+    candidate_batch_size = 1024
+
     def scan(self, offset=0, maxlen=None):
         """Yields instances of _POOL_HEADER which potentially match."""
 
         maxlen = maxlen or self.profile.get_constant("MaxPointer")
-        for hit in super(PoolScanner, self).scan(offset=offset, maxlen=maxlen):
-            yield self.profile._POOL_HEADER(vm=self.address_space, offset=hit)
+        candidates = self.get_candidates(offset, offset + maxlen)
+        if candidates is None:
+            return super(PoolScanner, self).scan(offset=offset, maxlen=maxlen)
+
+        return self.scan_candidates(candidates)
+
+    def get_candidates(self, offset, end):
+        """Find candidate offsets for our pool tags from the PoolTagIndex.
+
+        Returns:
+          A sorted list of offsets between offset and end, or None if the index
+          can not be used.
+        """
+        if self.constraints is None:
+            self.build_constraints()
+
+        # The index can only be used if we are looking for pool tags.
+        if (not self.constraints or
+                not isinstance(self.constraints[0],
+                               (PoolTagCheck, MultiPoolTagCheck))):
+            return
+
+        index = PoolTagIndex(address_space=self.address_space,
+                             profile=self.profile, session=self.session)
+
+        results = []
+        for tag in self.constraints[0].tags:
+            tag_offsets = index.get_offsets(tag)
+            if tag_offsets is None:
+                return
+
+            results.append(tag_offsets[
+                bisect.bisect_left(tag_offsets, offset):
+                bisect.bisect_left(tag_offsets, end)])
+
+        return list(heapq.merge(*results))
+
+    def scan_candidates(self, candidates):
+        """Runs all the checks on the candidate offsets only."""
+        self.start_scan()
+        buffer_as = addrspace.BufferAddressSpace(session=self.session)
+
+        for i in xrange(0, len(candidates), self.candidate_batch_size):
+            batch = candidates[i:i + self.candidate_batch_size]
+
+            # Checks may look up to self.overlap bytes past the offset.
+            for candidate, data in zip(batch, self.address_space.read_many(
+                    batch, self.overlap)):
+                buffer_as.assign_buffer(data, base_offset=candidate)
+                hit = self.check_addr(candidate, buffer_as=buffer_as)
+                if hit is not None:
+                    result = self.process_hit(hit)
+                    if result is not None:
+                        yield result
+
+    def process_hit(self, hit):
+        return self.profile._POOL_HEADER(vm=self.address_space, offset=hit)
 
 
 class PoolScannerPlugin(plugin.KernelASMixin, AbstractWindowsCommandPlugin):
@@ -329,6 +500,62 @@ class PoolScannerPlugin(plugin.KernelASMixin, AbstractWindowsCommandPlugin):
         else:
             self.address_space = address_space or self.physical_address_space
 
+    # The PoolScanner class used by this plugin. Plugins which set this can be
+    # run together with other pool scanner plugins in a single pass over the
+    # image (See the --pool_scanners option).
+    scanner_cls = None
+
+    def scan_pools(self):
+        """Yields the hits from this plugin's scanner_cls.
+
+        If this plugin is listed in the pool_scanners parameter, the scanners
+        of all the listed plugins are run together in a single pass, and the
+        hits for the other plugins are kept in the session cache until they are
+        run. An explicit pool_scanners list takes precedence over the pool tag
+        index.
+        """
+        scanner_names = self.session.GetParameter("pool_scanners") or []
+        if self.name not in scanner_names:
+            return self.scanner_cls(
+                profile=self.profile, session=self.session,
+                address_space=self.address_space).scan()
+
+        results = self.session.GetParameter("pool_scanner_hits") or {}
+        address_space, hits = results.pop(self.name, (None, None))
+        if hits is None or address_space is not self.address_space:
+            results = self._scan_pools_together(scanner_names)
+            _, hits = results.pop(self.name)
+
+        self.session.SetCache("pool_scanner_hits", results)
+
+        return iter(hits)
+
+    def _scan_pools_together(self, scanner_names):
+        scanners = {}
+        for name in scanner_names:
+            plugin_cls = plugin.Command.ImplementationByName(name)
+            if (plugin_cls is None or
+                    not issubclass(plugin_cls, PoolScannerPlugin) or
+                    plugin_cls.scanner_cls is None):
+                self.session.logging.warn(
+                    "%s is not a pool scanner plugin.", name)
+                continue
+
+            scanners[name] = plugin_cls.scanner_cls(
+                profile=self.profile, session=self.session,
+                address_space=self.address_space)
+
+        group = scan.ScannerGroup(
+            scanners=scanners, profile=self.profile, session=self.session,
+            address_space=self.address_space)
+
+        hits = dict((name, []) for name in scanners)
+        for name, hit in group.scan():
+            hits[name].append(hit)
+
+        return dict((name, (self.address_space, name_hits))
+                    for name, name_hits in hits.iteritems())
+
 
 class KDBGHook(kb.ParameterHook):
     """A Hook to calculate the KDBG when needed."""
@@ -524,7 +751,8 @@ class WinProcessFilter(WindowsCommandPlugin):
     def list_from_eprocess(self):
         for eprocess_offset in self.eprocess:
             eprocess = self.profile._EPROCESS(
-                offset=eprocess_offset, vm=self.kernel_address_space)
+                offset=eprocess_offset, vm=self.kernel_address_space,
+                snapshot=True)
 
             yield eprocess
 
@@ -619,8 +847,9 @@ class WinProcessFilter(WindowsCommandPlugin):
                     len(self.cache[k]), k)
                 seen.update(self.cache[k])
 
-        # Sort by pid so that the output ordering remains stable.
-        return sorted([self.profile._EPROCESS(x) for x in seen],
+        # Sort by pid so that the output ordering remains stable. Most of the
+        # fields of each process will be used, so read each one in one go.
+        return sorted([self.profile._EPROCESS(x, snapshot=True) for x in seen],
                       key=lambda x: x.pid)
 
     # Maintain the order of methods.
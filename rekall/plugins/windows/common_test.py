@@ -0,0 +1,142 @@
+from rekall import addrspace_test
+from rekall import constants
+from rekall import scan
+from rekall import session
+from rekall import testlib
+from rekall.plugins.overlays import basic
+from rekall.plugins.windows import common
+
+
+class PoolTestProfile(basic.ProfileLLP64, basic.BasicClasses):
+    """A profile with just enough of the pool header."""
+
+    @classmethod
+    def Initialize(cls, profile):
+        super(PoolTestProfile, cls).Initialize(profile)
+        profile.add_types({
+            '_POOL_HEADER': [0x10, {
+                'BlockSize': [0x2, ['unsigned char']],
+                'PoolTag': [0x4, ['String', dict(length=4)]],
+            }],
+        })
+
+
+class CheckTestBlockSize(scan.ScannerCheck):
+    """Only accepts pool headers with a BlockSize of 0x42."""
+
+    def check(self, buffer_as, offset):
+        pool_hdr = self.profile._POOL_HEADER(vm=buffer_as, offset=offset)
+        return pool_hdr.BlockSize == 0x42
+
+
+class TestPoolScanner(common.PoolScanner):
+    checks = [("PoolTagCheck", dict(tag="Tst1")),
+              ("CheckTestBlockSize", {})]
+
+
+class TestPoolScanner2(common.PoolScanner):
+    checks = [("PoolTagCheck", dict(tag="Tst2"))]
+
+
+class TestPoolScan(common.PoolScannerPlugin):
+    name = "test_poolscan"
+    scanner_cls = TestPoolScanner
+
+
+class TestPoolScan2(common.PoolScannerPlugin):
+    name = "test_poolscan2"
+    scanner_cls = TestPoolScanner2
+
+
+class PoolScannerTest(testlib.RekallBaseUnitTestCase):
+    """Test the pool scanners with and without the pool tag index."""
+
+    def setUp(self):
+        self.session = session.Session()
+        self.block_size = constants.SCAN_BLOCKSIZE
+        # Blocks must be larger than the scanners' overlap.
+        constants.SCAN_BLOCKSIZE = 0x1000
+
+        data = ["-"] * 0x3000
+
+        def _Pool(offset, tag, block_size=0x42):
+            data[offset + 2] = chr(block_size)
+            data[offset + 4:offset + 8] = tag
+
+        # The tag straddles a block boundary.
+        _Pool(0xffa, "Tst1")
+        # A tag with the wrong BlockSize.
+        _Pool(0x1400, "Tst1", block_size=0x10)
+        # The tag straddles the boundary between the first two runs.
+        _Pool(0x1ffb, "Tst1")
+        _Pool(0x2200, "Tst2")
+        # The header is within the overlap of the end of a run which is not
+        # virtually contiguous with the next one.
+        _Pool(0x2ff0, "Tst1")
+
+        # The second run is virtually but not physically contiguous with the
+        # first. The third run is not virtually contiguous with the second.
+        self.address_space = addrspace_test.CustomRunsAddressSpace(
+            session=self.session,
+            data="".join(data[:0x2000] + ["\x00"] * 0x8000 + data[0x2000:]),
+            runs=[(0x10000, 0, 0x2000), (0x12000, 0xa000, 0x1000),
+                  (0x14000, 0xb000, 0x1000)])
+        self.address_space.phys_base = self.address_space.base
+
+        self.profile = PoolTestProfile(session=self.session)
+        self.session.profile = self.profile
+        self.session.physical_address_space = self.address_space
+        self.session.kernel_address_space = self.address_space
+
+    def tearDown(self):
+        constants.SCAN_BLOCKSIZE = self.block_size
+
+    def _Scan(self, scanner_cls=TestPoolScanner):
+        scanner = scanner_cls(
+            profile=self.profile, session=self.session,
+            address_space=self.address_space)
+
+        return [x.obj_offset for x in scanner.scan()]
+
+    def testPoolTagIndex(self):
+        expected = [0x10ffa, 0x11ffb, 0x12ff0]
+
+        with self.session:
+            self.session.SetParameter("pool_tag_index", False)
+
+        self.assertEqual(self._Scan(), expected)
+        self.assertEqual(self._Scan(TestPoolScanner2), [0x12200])
+
+        with self.session:
+            self.session.SetParameter("pool_tag_index", True)
+
+        index = common.PoolTagIndex(
+            address_space=self.address_space, profile=self.profile,
+            session=self.session)
+        self.assertEqual(list(index.get_offsets("Tst1")),
+                         [0x10ffa, 0x11400, 0x11ffb, 0x12ff0])
+
+        # All the candidates are read in a single read_many() call.
+        batches = []
+        read_many = self.address_space.read_many
+        self.address_space.read_many = lambda addresses, length: (
+            batches.append(list(addresses)) or read_many(addresses, length))
+
+        self.assertEqual(self._Scan(), expected)
+        self.assertEqual(batches, [[0x10ffa, 0x11400, 0x11ffb, 0x12ff0]])
+        self.assertEqual(self._Scan(TestPoolScanner2), [0x12200])
+
+    def testPoolScannersTakePrecedence(self):
+        with self.session:
+            self.session.SetParameter("pool_tag_index", True)
+            self.session.SetParameter(
+                "pool_scanners", ["test_poolscan", "test_poolscan2"])
+
+        plugin = TestPoolScan(session=self.session, profile=self.profile)
+        self.assertEqual([x.obj_offset for x in plugin.scan_pools()],
+                         [0x10ffa, 0x11ffb, 0x12ff0])
+
+        # The hits of the other scanner were found in the same pass.
+        _, hits = self.session.GetParameter("pool_scanner_hits")[
+            "test_poolscan2"]
+        self.assertEqual([x.obj_offset for x in hits], [0x12200])
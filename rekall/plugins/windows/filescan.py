@@ -54,12 +54,11 @@ class FileScan(common.PoolScannerPlugin):
     """
     __name = "filescan"
 
+    scanner_cls = PoolScanFile
+
     def generate_hits(self):
         """Generate possible hits."""
-        scanner = PoolScanFile(profile=self.profile, session=self.session,
-                               address_space=self.address_space)
-
-        for pool_obj in scanner.scan():
+        for pool_obj in self.scan_pools():
             object_obj = pool_obj.GetObject("File")
 
             if object_obj == None:
@@ -127,13 +126,11 @@ class DriverScan(FileScan):
 
     __name = "driverscan"
 
+    scanner_cls = PoolScanDriver
+
     def generate_hits(self):
         """Generate possible hits."""
-        scanner = PoolScanDriver(session=self.session,
-                                 profile=self.profile,
-                                 address_space=self.address_space)
-
-        for pool_obj in scanner.scan():
+        for pool_obj in self.scan_pools():
             object_obj = pool_obj.GetObject("Driver")
             if not object_obj:
                 continue
@@ -198,11 +195,11 @@ class SymLinkScan(FileScan):
 
     __name = "symlinkscan"
 
+    scanner_cls = PoolScanSymlink
+
     def generate_hits(self):
         """Generate possible hits."""
-        scanner = PoolScanSymlink(profile=self.profile, session=self.session,
-                                  address_space=self.address_space)
-        for pool_obj in scanner.scan():
+        for pool_obj in self.scan_pools():
             object_obj = pool_obj.GetObject("SymbolicLink")
             if not object_obj:
                 continue
@@ -261,11 +258,10 @@ class MutantScan(plugin.VerbosityMixIn, FileScan):
 
     __name = "mutantscan"
 
-    def generate_hits(self):
-        scanner = PoolScanMutant(profile=self.profile, session=self.session,
-                                 address_space=self.address_space)
+    scanner_cls = PoolScanMutant
 
-        for pool_obj in scanner.scan():
+    def generate_hits(self):
+        for pool_obj in self.scan_pools():
             object_obj = pool_obj.GetObject("Mutant")
             if not object_obj:
                 continue
@@ -345,30 +341,31 @@ class PoolScanProcess(common.PoolScanner):
             ('CheckPoolIndex', dict(value=0)),
             ]
 
-    def scan(self, **kwargs):
-        for pool_obj in super(PoolScanProcess, self).scan(**kwargs):
-            # Also fetch freed objects.
-            object_header = pool_obj.GetObject(type="Process", freed=True)
-            if not object_header:
-                continue
+    def process_hit(self, hit):
+        pool_obj = super(PoolScanProcess, self).process_hit(hit)
 
-            eprocess = object_header.Body.cast("_EPROCESS")
+        # Also fetch freed objects.
+        object_header = pool_obj.GetObject(type="Process", freed=True)
+        if not object_header:
+            return
 
-            if eprocess.Pcb.DirectoryTableBase == 0:
-                continue
+        eprocess = object_header.Body.cast("_EPROCESS")
 
-            # The DTB is page aligned on AMD64 and I386 but aligned to 0x20
-            # on PAE kernels.
-            if eprocess.Pcb.DirectoryTableBase % 0x20 != 0:
-                continue
+        if eprocess.Pcb.DirectoryTableBase == 0:
+            return
 
-            # Pointers must point to the kernel part of the address space.
-            list_head = eprocess.ActiveProcessLinks
-            if (list_head.Flink < self.kernel or
-                    list_head.Blink < self.kernel):
-                continue
+        # The DTB is page aligned on AMD64 and I386 but aligned to 0x20
+        # on PAE kernels.
+        if eprocess.Pcb.DirectoryTableBase % 0x20 != 0:
+            return
 
-            yield pool_obj, eprocess
+        # Pointers must point to the kernel part of the address space.
+        list_head = eprocess.ActiveProcessLinks
+        if (list_head.Flink < self.kernel or
+                list_head.Blink < self.kernel):
+            return
+
+        return pool_obj, eprocess
 
 
 class PSScan(common.PoolScannerPlugin):
@@ -381,14 +378,11 @@ class PSScan(common.PoolScannerPlugin):
 
     __name = "psscan"
 
+    scanner_cls = PoolScanProcess
+
     def scan_processes(self):
         """Generate possible hits."""
-        # Just grab the AS and scan it using our scanner
-        scanner = PoolScanProcess(session=self.session,
-                                  profile=self.profile,
-                                  address_space=self.address_space)
-
-        return scanner.scan()
+        return self.scan_pools()
 
     def render(self, renderer):
         """Render results in a table."""
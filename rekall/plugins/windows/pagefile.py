@@ -30,7 +30,6 @@ metadata.
 """
 
 __author__ = "Michael Cohen <scudette@google.com>"
-import struct
 
 from rekall.plugins.addrspaces import amd64
 from rekall.plugins.addrspaces import intel
@@ -190,16 +189,26 @@ class WindowsPagedMemoryMixin(object):
                     start=start):
             yield ranges
 
+    def address_range_cache_key(self):
+        key = super(WindowsPagedMemoryMixin, self).address_range_cache_key()
+
+        # In a process context the available ranges also depend on the VADs.
+        process_context = self.session.GetParameter("process_context")
+        if key and process_context:
+            key = "%svad@%#x/" % (key, process_context.obj_offset)
+
+        return key
+
     def _get_available_PDEs(self, vaddr, pdpte_value, start):
         tmp2 = vaddr
-        for pde in range(0, 0x200):
+        pde_table = self.table_values(self.get_pde_table(pdpte_value))
+        for pde, pde_value in enumerate(pde_table):
             vaddr = tmp2 | (pde << 21)
 
             next_vaddr = tmp2 | ((pde + 1) << 21)
             if start >= next_vaddr:
                 continue
 
-            pde_value = self.get_pde(vaddr, pdpte_value)
             if not pde_value & self.valid_mask:
                 # An invalid PDE means we read the vad, i.e. it is the same as
                 # an array of zero PTEs.
@@ -215,16 +224,7 @@ class WindowsPagedMemoryMixin(object):
                        0x200000)
                 continue
 
-            # This reads the entire PTE table at once - On
-            # windows where IO is extremely expensive, its
-            # about 10 times more efficient than reading it
-            # one value at the time - and this loop is HOT!
-            pte_table_addr = ((pde_value & 0xffffffffff000) |
-                              ((vaddr & 0x1ff000) >> 9))
-
-            data = self.base.read(pte_table_addr, 8 * 0x200)
-            pte_table = struct.unpack("<" + "Q" * 0x200, data)
-
+            pte_table = self.table_values(self.get_pte_table(pde_value))
             for x in self._get_available_PTEs(
                     pte_table, vaddr, start=start):
                 yield x
@@ -26,6 +26,11 @@
 
 # pylint: disable=protected-access
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 from rekall import testlib
 from rekall import obj
 from rekall import plugin
@@ -243,6 +248,156 @@ class PFNInfo(common.WindowsCommandPlugin):
                         long_flags_string)
 
 
+class PFNDatabaseIndex(object):
+    """A copy of the PFN database, held in NumPy arrays.
+
+    This allows many physical addresses to be converted to virtual addresses
+    at once, without instantiating any _MMPFN structs.
+    """
+
+    # The PageLocation of ActiveAndValid pages.
+    ACTIVE_AND_VALID = 6
+
+    def __init__(self, page_location=None, pte_frame=None, pte_address=None,
+                 levels=None, owner_dtb=None):
+        """Creates the index.
+
+        Args:
+          page_location, pte_frame, pte_address: Arrays holding these fields
+            of each _MMPFN record.
+
+          levels: A list of (shift, mask) tuples for each paging structure
+            level, starting with the PTE. See PtoV.LEVELS.
+
+          owner_dtb: An array holding the DTB which maps each page (0 if the
+            page is not mapped). Computed from the other columns if not given.
+        """
+        self.page_location = page_location
+        self.pte_frame = pte_frame
+        self.pte_address = pte_address
+        self.levels = levels
+
+        if owner_dtb is None:
+            owner_dtb = self._chase_dtb(
+                numpy.arange(len(pte_frame), dtype=numpy.uint64))
+
+        self.owner_dtb = owner_dtb
+
+    def _chase(self, pages):
+        """Follows the PteFrame links from pages up to the DTB.
+
+        Returns:
+          A tuple of arrays (virtual address bits, dtb page, valid).
+        """
+        count = len(self.pte_frame)
+        result = numpy.zeros(len(pages), dtype=numpy.uint64)
+        valid = pages < count
+
+        for shift, mask in self.levels:
+            indexes = numpy.where(
+                valid, pages, numpy.uint64(0)).astype(numpy.int64)
+            valid &= self.page_location[indexes] == self.ACTIVE_AND_VALID
+
+            containing_page = self.pte_frame[indexes]
+            entry_address = ((containing_page << numpy.uint64(12)) |
+                             (self.pte_address[indexes] & numpy.uint64(0xFFF)))
+
+            result |= ((entry_address << numpy.uint64(shift)) &
+                       numpy.uint64(mask))
+
+            pages = containing_page
+            valid &= pages < count
+
+        return result, pages, valid
+
+    def _chase_dtb(self, pages):
+        """Returns an array of the DTB which maps each page (or 0)."""
+        _, dtb_pages, valid = self._chase(pages)
+        indexes = numpy.where(
+            valid, dtb_pages, numpy.uint64(0)).astype(numpy.int64)
+
+        return numpy.where(
+            valid, self.pte_frame[indexes] << numpy.uint64(12),
+            numpy.uint64(0))
+
+    def ptov(self, physical_addresses):
+        """Converts many physical addresses to virtual addresses.
+
+        Returns:
+          A tuple of arrays (virtual address, dtb, valid). Virtual addresses
+          and DTBs are only meaningful where valid is True.
+        """
+        physical_addresses = numpy.asarray(physical_addresses,
+                                           dtype=numpy.uint64)
+        pages = physical_addresses >> numpy.uint64(12)
+        result, _, valid = self._chase(pages)
+
+        indexes = numpy.where(
+            valid, pages, numpy.uint64(0)).astype(numpy.int64)
+        dtb = self.owner_dtb[indexes]
+
+        result |= physical_addresses & numpy.uint64(0xFFF)
+        return result, dtb, valid
+
+    # The _MMPFN fields we need.
+    FIELDS = ["u3.e1.PageLocation", "u4.PteFrame", "PteAddress"]
+
+    @classmethod
+    def FromPFNDatabase(cls, pfn_database, count, levels, session=None):
+        """Reads count _MMPFN records from the PFN database array."""
+        profile = pfn_database.obj_profile
+        record_size = profile.get_obj_size("_MMPFN")
+
+        columns = [numpy.zeros(count, dtype=numpy.uint64) for _ in cls.FIELDS]
+
+        records_per_read = max(
+            1, session.GetParameter("buffer_size") / record_size)
+
+        for i in xrange(0, count, records_per_read):
+            session.report_progress(
+                "Reading PFN database: %d/%d records", i, count)
+
+            records_to_read = min(records_per_read, count - i)
+            records = profile.Array(
+                offset=pfn_database.obj_offset + i * record_size,
+                vm=pfn_database.obj_vm, target="_MMPFN",
+                count=records_to_read, max_count=records_to_read).to_numpy(
+                    fields=cls.FIELDS)
+
+            for column, field in zip(columns, cls.FIELDS):
+                column[i:i + records_to_read] = records[field]
+
+        session.report_progress("Computing the owner DTB of each page.")
+        return cls(*columns, levels=levels)
+
+
+class PFNDatabaseIndexHook(common.AbstractWindowsParameterHook):
+    """Loads the PFN database into a PFNDatabaseIndex."""
+
+    name = "pfn_index"
+
+    @classmethod
+    def is_active(cls, session):
+        return (super(PFNDatabaseIndexHook, cls).is_active(session) and
+                numpy is not None)
+
+    def calculate(self):
+        # The PFN database changes on a live system.
+        if self.session.volatile:
+            return obj.NoneObject("PFN database index requires an image.")
+
+        levels = PtoV.LEVELS.get(PtoV.GetPagingMode(self.session.profile))
+        if levels is None:
+            return obj.NoneObject("Memory model not supported.")
+
+        pfn_database = self.session.plugins.pfn().pfn_database.deref()
+        count = (self.session.physical_address_space.end() /
+                 PFNInfo.PAGE_SIZE)
+
+        return PFNDatabaseIndex.FromPFNDatabase(
+            pfn_database, count, levels, session=self.session)
+
+
 class PTE(common.WindowsCommandPlugin):
     """Prints information about a PTE.
 
@@ -468,6 +623,14 @@ class PtoV(common.WinProcessFilter):
     PAGE_SIZE = 0x1000
     PAGE_BITS = 12
 
+    # For each paging structure level (starting with the PTE), the shift and
+    # mask used to derive virtual address bits from the address of the entry.
+    LEVELS = dict(
+        x86=((10, 0x3FF000), (20, 0xffc00000)),
+        x86_pae=((9, 0x1FF000), (18, 0x3fe00000), (27, 0x7FC0000000)),
+        x64=((9, 0x1FF000), (18, 0x3fe00000), (27, 0x7FC0000000),
+             (36, 0xff8000000000)))
+
     @classmethod
     def args(cls, parser):
         super(PtoV, cls).args(parser)
@@ -636,22 +799,59 @@ class PtoV(common.WinProcessFilter):
                         ("PDE", pde_address),
                         ("PTE", pte_address))
 
+    @staticmethod
+    def GetPagingMode(profile):
+        """Returns the key into LEVELS for the profile's memory model."""
+        if profile.metadata("arch") == "I386":
+            if profile.metadata("pae"):
+                return "x86_pae"
+            return "x86"
+
+        elif profile.metadata("arch") == "AMD64":
+            return "x64"
+
     def ptov(self, physical_address):
         """Convert the physical address to a virtual address.
 
         Returns:
           a tuple (_EPROCESS of owning process, virtual address in process AS).
         """
-        if self.profile.metadata("arch") == "I386":
-            if self.profile.metadata("pae"):
-                return self._ptov_x86_pae(physical_address)
-            else:
-                return self._ptov_x86(physical_address)
-        elif self.profile.metadata("arch") == "AMD64":
+        mode = self.GetPagingMode(self.profile)
+        if mode == "x86_pae":
+            return self._ptov_x86_pae(physical_address)
+        elif mode == "x86":
+            return self._ptov_x86(physical_address)
+        elif mode == "x64":
             return self._ptov_x64(physical_address)
 
         return obj.NoneObject("Memory model not supported."), []
 
+    def ptov_many(self, physical_addresses):
+        """Convert many physical addresses to virtual addresses.
+
+        If NumPy is available, the entire PFN database is loaded once (See
+        PFNDatabaseIndex), after which each conversion is a table lookup.
+
+        Returns:
+          A list of (virtual address, dtb) tuples. If the address can not be
+          converted, the virtual address is a NoneObject and the dtb is None.
+        """
+        index = self.session.GetParameter("pfn_index")
+        if not index:
+            result = []
+            for physical_address in physical_addresses:
+                virtual_address, structures = self.ptov(physical_address)
+                result.append((virtual_address,
+                               dict(structures).get("DTB")))
+
+            return result
+
+        virtual_addresses, dtbs, valid = index.ptov(physical_addresses)
+        return [(int(virtual_address), int(dtb)) if is_valid else
+                (obj.NoneObject("Address invalid."), None)
+                for virtual_address, dtb, is_valid in zip(
+                    virtual_addresses, dtbs, valid)]
+
     def render(self, renderer):
         if self.physical_address is None:
             return
@@ -682,10 +882,8 @@ class DTBScan2(common.WindowsCommandPlugin):
     name = "dtbscan2"
 
     def TestVAddr(self, test_as, vaddr, symbol_checks):
-        for vaddr, paddr in symbol_checks:
-            if test_as.vtop(vaddr) != paddr:
-                return False
-        return True
+        vaddrs = [x for x, _ in symbol_checks]
+        return test_as.vtop_many(vaddrs) == [x for _, x in symbol_checks]
 
     def render(self, renderer):
         dtb_map = {}
@@ -703,11 +901,11 @@ class DTBScan2(common.WindowsCommandPlugin):
             dtb_step = 0x20
             symbols.append(0xFFDF0000)
 
-        symbol_checks = []
-        for symbol in symbols:
-            vaddr = self.session.address_resolver.get_address_by_name(symbol)
-            paddr = self.session.kernel_address_space.vtop(vaddr)
-            symbol_checks.append((vaddr, paddr))
+        vaddrs = [self.session.address_resolver.get_address_by_name(symbol)
+                  for symbol in symbols]
+        symbol_checks = zip(
+            vaddrs, self.session.kernel_address_space.vtop_many(vaddrs))
+        vaddr = vaddrs[-1]
 
         renderer.table_header([("DTB", "dtb", "[addrpad]"),
                                dict(name="Process", type="_EPROCESS"),
@@ -745,6 +943,9 @@ class DTBScan(common.WinProcessFilter):
 
     __name = "dtbscan"
 
+    # The amount of physical memory converted with each call to ptov_many().
+    BATCH_SIZE = 0x1000000
+
     @classmethod
     def args(cls, parser):
         super(DTBScan, cls).args(parser)
@@ -775,18 +976,21 @@ class DTBScan(common.WinProcessFilter):
         # Now scan all the physical address space for DTBs.
         for _ in self.physical_address_space.get_available_addresses():
             start, _, length = _
-            for page in range(start, start + length, 0x1000):
+            for batch in range(start, start + length, self.BATCH_SIZE):
                 self.session.report_progress("Scanning 0x%08X (%smb)" % (
-                    page, page/1024/1024))
+                    batch, batch/1024/1024))
+
+                pages = range(batch, min(batch + self.BATCH_SIZE,
+                                         start + length), 0x1000)
 
                 # Quit early if requested to.
-                if self.limit and page > self.limit:
-                    return
+                if self.limit and pages[-1] > self.limit:
+                    pages = [page for page in pages if page <= self.limit]
+                    if not pages:
+                        return
 
-                virtual_address, results = ptov.ptov(page)
-                if virtual_address:
-                    dtb = results[0][1]
-                    if dtb not in seen_dtbs:
+                for virtual_address, dtb in ptov.ptov_many(pages):
+                    if virtual_address and dtb not in seen_dtbs:
                         seen_dtbs.add(dtb)
 
                         # The _EPROCESS address is stored as the
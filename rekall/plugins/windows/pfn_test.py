@@ -22,6 +22,7 @@
 
 """Tests for the pfn plugins."""
 from rekall import testlib
+from rekall.plugins.windows import pfn
 
 class TestVtoP(testlib.SimpleTestCase):
     # Create a test case by running the vadmap plugin and selecting at least one
@@ -47,3 +48,83 @@ class TestPFN(testlib.SimpleTestCase):
         commandline="pfn %(pfn)s",
         pfn=0
     )
+
+
+class PFNDatabaseIndexTest(testlib.RekallBaseUnitTestCase):
+    """Test PFNDatabaseIndex against a small synthetic PFN database."""
+
+    def setUp(self):
+        if pfn.numpy is None:
+            return
+
+        numpy = pfn.numpy
+
+        # Page 1 is the DTB (its PteFrame points to itself), pages 2-4 are the
+        # PDPT, PD and PT, and pages 5 and 6 are mapped by the PT. Page 7 is
+        # not ActiveAndValid.
+        records = {
+            # page: (PageLocation, PteFrame, PteAddress)
+            1: (6, 1, 0),
+            2: (6, 1, 0x8 * 1),
+            3: (6, 2, 0x8 * 2),
+            4: (6, 3, 0x8 * 3),
+            5: (6, 4, 0x8 * 4),
+            6: (6, 4, 0x8 * 0x1FF),
+            7: (2, 4, 0x8 * 5),
+        }
+
+        columns = [numpy.zeros(8, dtype=numpy.uint64) for _ in range(3)]
+        for page, values in records.items():
+            for column, value in zip(columns, values):
+                column[page] = value
+
+        self.index = pfn.PFNDatabaseIndex(
+            *columns, levels=pfn.PtoV.LEVELS["x64"])
+
+    def testPtov(self):
+        if pfn.numpy is None:
+            return
+
+        virtual_addresses, dtbs, valid = self.index.ptov(
+            [0x5123, 0x6fff, 0x7000, 0x100000])
+
+        self.assertEqual(list(valid), [True, True, False, False])
+        self.assertEqual(
+            [int(x) for x in virtual_addresses[:2]],
+            [(1 << 39) | (2 << 30) | (3 << 21) | (4 << 12) | 0x123,
+             (1 << 39) | (2 << 30) | (3 << 21) | (0x1FF << 12) | 0xfff])
+        self.assertEqual([int(x) for x in dtbs[:2]], [0x1000, 0x1000])
+
+    def testChase(self):
+        if pfn.numpy is None:
+            return
+
+        numpy = pfn.numpy
+        result, dtb_pages, valid = self.index._chase(
+            numpy.array([5, 7, 8], dtype=numpy.uint64))
+
+        self.assertEqual(list(valid), [True, False, False])
+        self.assertEqual(int(result[0]),
+                         (1 << 39) | (2 << 30) | (3 << 21) | (4 << 12))
+        self.assertEqual(int(dtb_pages[0]), 1)
+
+    def testOwnerDtb(self):
+        if pfn.numpy is None:
+            return
+
+        # The paging structures are themselves mapped through the self
+        # referencing DTB. Pages 0 and 7 are not ActiveAndValid.
+        self.assertEqual([int(x) for x in self.index.owner_dtb],
+                         [0] + [0x1000] * 6 + [0])
+
+        # The column is used as given.
+        owner_dtb = self.index.owner_dtb.copy()
+        owner_dtb[5] = 0x2000
+        index = pfn.PFNDatabaseIndex(
+            self.index.page_location, self.index.pte_frame,
+            self.index.pte_address, levels=self.index.levels,
+            owner_dtb=owner_dtb)
+
+        _, dtbs, valid = index.ptov([0x5123, 0x6fff])
+        self.assertEqual(list(valid), [True, True])
+        self.assertEqual([int(x) for x in dtbs], [0x2000, 0x1000])
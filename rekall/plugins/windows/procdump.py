@@ -28,6 +28,7 @@ import re
 
 from rekall.plugins.windows import common
 from rekall.plugins import core
+from rekall import copier
 from rekall import utils
 
 
@@ -99,16 +100,17 @@ class PEDump(common.WindowsCommandPlugin):
         fd.seek(0)
         fd.write(data)
 
+        ranges = []
         for section in nt_header.Sections:
             # Force some sensible maximum values here.
-            size_of_section = min(10e6, section.SizeOfRawData)
-            physical_offset = min(100e6, int(section.PointerToRawData))
+            size_of_section = int(min(10e6, section.SizeOfRawData))
+            physical_offset = int(min(100e6, int(section.PointerToRawData)))
 
-            data = section.obj_vm.read(
-                section.VirtualAddress + image_base, size_of_section)
+            ranges.append((section.VirtualAddress + image_base,
+                           physical_offset, size_of_section))
 
-            fd.seek(physical_offset, 0)
-            fd.write(data)
+        copier.CopyRanges(dos_header.obj_vm, fd, ranges,
+                          session=self.session)
 
     def render(self, renderer):
         if self.out_file:
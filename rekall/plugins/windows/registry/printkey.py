@@ -25,6 +25,8 @@
 @contact:      awalters@volatilesystems.com,bdolangavitt@wesleyan.edu
 @organization: Volatile Systems
 """
+import multiprocessing
+import os
 import re
 
 from rekall import addrspace
@@ -34,6 +36,27 @@ from rekall.plugins.windows.registry import registry
 from rekall.plugins.overlays import basic
 
 
+# The plugin and renderer used by the worker processes of regdump. Workers are
+# forked from the parent and inherit these without having to pickle them.
+_DUMP_PLUGIN = None
+_DUMP_RENDERER = None
+
+
+def _InitDumpWorker():
+    """Prepares a freshly forked worker process for dumping hives."""
+    # The worker must not report progress to the parent's renderer.
+    _DUMP_PLUGIN.session.progress.callbacks.clear()
+
+    # File handles inherited from the parent share their file position with
+    # it, so they must not be used concurrently.
+    _DUMP_PLUGIN.kernel_address_space.reopen()
+
+
+def _DumpHiveInWorker(index):
+    return _DUMP_PLUGIN.dump_hive_file(
+        _DUMP_RENDERER, _DUMP_PLUGIN.hive_offsets[index])
+
+
 class PrintKey(registry.RegistryPlugin):
     """Print a registry key, and its subkeys and values"""
     __name = "printkey"
@@ -141,6 +164,19 @@ class RegDump(core.DirectoryDumperMixin, registry.RegistryPlugin):
 
     __name = 'regdump'
 
+    @classmethod
+    def args(cls, parser):
+        super(RegDump, cls).args(parser)
+
+        parser.add_argument(
+            "--processes", default=0, type="IntParser",
+            help="Number of worker processes used to dump hives "
+            "concurrently. 0 or 1 dumps the hives in this process.")
+
+    def __init__(self, processes=0, **kwargs):
+        super(RegDump, self).__init__(**kwargs)
+        self.processes = processes
+
     def dump_hive(self, hive_offset=None, reg=None, fd=None):
         """Write the hive into the fd.
 
@@ -163,30 +199,64 @@ class RegDump(core.DirectoryDumperMixin, registry.RegistryPlugin):
             self.session.report_progress(
                 "Dumping {0}Mb".format(count/1024/1024))
 
-    def render(self, renderer):
-        # Get all the offsets if needed.
-        for hive_offset in self.hive_offsets:
-            reg = registry.RegistryHive(
-                profile=self.profile, session=self.session,
-                kernel_address_space=self.kernel_address_space,
-                hive_offset=hive_offset)
+    def dump_hive_file(self, renderer, hive_offset):
+        """Dumps the hive into a file in the dump directory.
 
-            # Make up a filename for it, should be similar to the hive name.
-            filename = reg.Name.rsplit("\\", 1).pop()
+        Returns:
+          A tuple of (hive name, filename, bytes written).
+        """
+        reg = registry.RegistryHive(
+            profile=self.profile, session=self.session,
+            kernel_address_space=self.kernel_address_space,
+            hive_offset=hive_offset)
 
-            # Sanitize it.
-            filename = re.sub(r"[^a-zA-Z0-9_\-@ ]", "_", filename)
+        # Make up a filename for it, should be similar to the hive name.
+        filename = reg.Name.rsplit("\\", 1).pop()
 
-            # Make up the path.
-            renderer.section()
-            renderer.format("Dumping {0} into \"{1}\"\n", reg.Name, filename)
+        # Sanitize it.
+        filename = re.sub(r"[^a-zA-Z0-9_\-@ ]", "_", filename)
+
+        with renderer.open(directory=self.dump_dir,
+                           filename=filename,
+                           mode="wb") as fd:
+            self.dump_hive(reg=reg, fd=fd)
+            return reg.Name, filename, fd.tell()
 
-            with renderer.open(directory=self.dump_dir,
-                               filename=filename,
-                               mode="wb") as fd:
-                self.dump_hive(reg=reg, fd=fd)
-                renderer.format("Dumped {0} bytes\n", fd.tell())
+    def dump_hives_parallel(self, renderer):
+        """Dumps the hives in a pool of worker processes.
 
+        Yields the same tuples as dump_hive_file(), in the order of
+        self.hive_offsets.
+        """
+        global _DUMP_PLUGIN, _DUMP_RENDERER  # pylint: disable=global-statement
+
+        _DUMP_PLUGIN = self
+        _DUMP_RENDERER = renderer
+        pool = multiprocessing.Pool(self.processes, initializer=_InitDumpWorker)
+        try:
+            for result in pool.imap(_DumpHiveInWorker,
+                                    range(len(self.hive_offsets))):
+                yield result
+
+            pool.close()
+        finally:
+            pool.terminate()
+            _DUMP_PLUGIN = _DUMP_RENDERER = None
+
+    def render(self, renderer):
+        # Workers inherit the plugin by forking, so this is not available on
+        # Windows.
+        if (self.processes > 1 and hasattr(os, "fork") and
+                len(self.hive_offsets) > 1):
+            results = self.dump_hives_parallel(renderer)
+        else:
+            results = (self.dump_hive_file(renderer, hive_offset)
+                       for hive_offset in self.hive_offsets)
+
+        for name, filename, size in results:
+            renderer.section()
+            renderer.format("Dumping {0} into \"{1}\"\n", name, filename)
+            renderer.format("Dumped {0} bytes\n", size)
 
 
 class HiveDump(registry.RegistryPlugin):
@@ -169,6 +169,9 @@ class HiveAddressSpace(HiveBaseAddressSpace):
     CI_OFF_MASK = 0x0FFF
     CI_OFF_SHIFT = 0x0
 
+    # The largest read issued when reading runs of blocks.
+    SAVE_CHUNK_SIZE = 0x100000
+
     def __init__(self, hive_addr=None, profile=None, **kwargs):
         """Translate between hive addresses and virtual memory addresses.
 
@@ -189,8 +192,9 @@ class HiveAddressSpace(HiveBaseAddressSpace):
         self.flat = self.hive.Hive.Flat.v() > 0
         self.storage = self.hive.Hive.Storage
 
-        # This is a quick lookup for blocks.
-        self.block_cache = utils.FastStore(max_size=1000)
+        # Maps the blocks of each storage type to their virtual addresses.
+        # These are built on first use.
+        self.cell_maps = {}
 
         self.logging = self.session.logging.getChild("addrspace.hive")
 
@@ -207,16 +211,112 @@ class HiveAddressSpace(HiveBaseAddressSpace):
         ci_block = (vaddr & self.CI_BLOCK_MASK) >> self.CI_BLOCK_SHIFT
         ci_off = (vaddr & self.CI_OFF_MASK) >> self.CI_OFF_SHIFT
 
-        try:
-            block = self.block_cache.Get((ci_type, ci_table, ci_block))
-        except KeyError:
+        cell_map = self._get_cell_map(ci_type)
+        index = (ci_table << 9) | ci_block
+        if index < len(cell_map):
+            block = cell_map[index]
+        else:
+            # Outside the length of the storage.
             block = self.storage[ci_type].Map.Directory[ci_table].Table[
                 ci_block].BlockAddress
 
-            self.block_cache.Put((ci_type, ci_table, ci_block), block)
+        # The block is not mapped.
+        if not block:
+            return None
 
         return block + ci_off + 4
 
+    def _get_cell_map(self, ci_type):
+        cell_map = self.cell_maps.get(ci_type)
+        if cell_map is None:
+            cell_map = self.cell_maps[ci_type] = self._build_cell_map(ci_type)
+
+        return cell_map
+
+    def _build_cell_map(self, ci_type):
+        """Reads the block addresses of all the blocks in the storage.
+
+        Each table in the map directory holds the _HMAP_ENTRY of 512 blocks.
+        These are decoded a whole table at a time.
+
+        Returns:
+          An array of the virtual address of each block (0 if not mapped),
+          indexed by (table << 9 | block).
+        """
+        storage = self.storage[ci_type]
+        blocks = storage.Length.v() // self.BLOCK_SIZE
+        cell_map = utils.Uint64Array()
+
+        decoder = self.profile.get_struct_decoder("_HMAP_ENTRY")
+        if "BlockAddress" in decoder.names:
+            field = decoder.names.index("BlockAddress")
+            mask = 0xffffffffffffffff
+        else:
+            # Windows 10 (See _HMAP_ENTRY.BlockAddress).
+            field = decoder.names.index("PermanentBinAddress")
+            mask = 0xfffffffffff0
+
+        directory = storage.Map.Directory
+        for ci_table in xrange((blocks + 0x1ff) >> 9):
+            entries = directory[ci_table].Table.unpack_all() or []
+            for entry in entries[:blocks - len(cell_map)]:
+                cell_map.append(entry[field] & mask)
+
+            # The table is not readable.
+            while len(cell_map) < min(blocks, (ci_table + 1) << 9):
+                cell_map.append(0)
+
+        return cell_map
+
+    def get_block_runs(self, ci_type=0):
+        """Groups the blocks of the storage into runs of contiguous blocks.
+
+        Yields:
+          (hive offset, virtual address, length) tuples for each run, in hive
+          order. The virtual address is 0 for runs of blocks which are not
+          mapped.
+        """
+        length = self.hive.Hive.Storage[ci_type].Length.v()
+        if self.flat:
+            yield 0, self.baseblock + self.BLOCK_SIZE, length
+            return
+
+        run_start = run_address = run_length = 0
+        for index, address in enumerate(self._get_cell_map(ci_type)):
+            if (run_length and (address == 0) == (run_address == 0) and
+                    (address == 0 or address == run_address + run_length)):
+                run_length += self.BLOCK_SIZE
+                continue
+
+            if run_length:
+                yield run_start, run_address, run_length
+
+            run_start = index * self.BLOCK_SIZE
+            run_address = address
+            run_length = self.BLOCK_SIZE
+
+        if run_length:
+            yield run_start, run_address, run_length
+
+    def read_runs(self, ci_type=0):
+        """Reads the blocks of the storage, a run of blocks at a time.
+
+        Yields:
+          (hive offset, data, length) tuples. The data is None for blocks
+          which are not mapped or not readable.
+        """
+        for offset, address, length in self.get_block_runs(ci_type):
+            for i in xrange(0, length, self.SAVE_CHUNK_SIZE):
+                to_read = min(length - i, self.SAVE_CHUNK_SIZE)
+                data = None
+                if address:
+                    data = self.base.read(address + i, to_read)
+
+                if data:
+                    data = data.ljust(to_read, "\0")
+
+                yield offset + i, data or None, to_read
+
     def save(self):
         """A generator of registry data in linear form.
 
@@ -231,48 +331,32 @@ class HiveAddressSpace(HiveBaseAddressSpace):
         else:
             yield "\0" * self.BLOCK_SIZE
 
-        length = self.hive.Hive.Storage[0].Length.v()
-        for i in xrange(0, length, self.BLOCK_SIZE):
-            paddr = self.vtop(i)
-            if not paddr:
-                self.logging.warn("No mapping found for index {0:x}, "
-                             "filling with NULLs".format(i))
-                data = '\0' * self.BLOCK_SIZE
-            else:
-                paddr = paddr - 4
-                data = self.base.read(paddr, self.BLOCK_SIZE)
-                if not data:
-                    self.logging.warn("Physical layer returned None for index "
-                                 "{0:x}, filling with NULL".format(i))
-                    data = '\0' * self.BLOCK_SIZE
+        for offset, data, length in self.read_runs():
+            if data is None:
+                self.logging.warn("No data found for index {0:x} - {1:x}, "
+                                  "filling with NULLs".format(
+                                      offset, offset + length))
+                data = "\0" * length
 
             yield data
 
     def stats(self, stable=True):
-        if stable:
-            stor = 0
-            ci = lambda x: x
-        else:
-            stor = 1
-            ci = lambda x: x | 0x80000000
+        stor = 0 if stable else 1
 
         length = self.hive.Hive.Storage[stor].Length.v()
         total_blocks = length / self.BLOCK_SIZE
         bad_blocks_reg = 0
         bad_blocks_mem = 0
-        for i in xrange(0, length, self.BLOCK_SIZE):
-            i = ci(i)
-            data = None
-            paddr = self.vtop(i) - 4
-
-            if paddr:
-                data = self.base.read(paddr, self.BLOCK_SIZE)
-            else:
-                bad_blocks_reg += 1
-                continue
+        for _, address, run_length in self.get_block_runs(stor):
+            if not address:
+                bad_blocks_reg += run_length / self.BLOCK_SIZE
+
+        for _, data, run_length in self.read_runs(stor):
+            if data is None:
+                bad_blocks_mem += run_length / self.BLOCK_SIZE
 
-            if not data:
-                bad_blocks_mem += 1
+        # Blocks which are not mapped are not read either.
+        bad_blocks_mem -= bad_blocks_reg
 
         print "{0} bytes in hive.".format(length)
         print ("{0} blocks not loaded by CM, {1} blocks "
@@ -311,9 +395,15 @@ class _CM_KEY_NODE(obj.Struct):
 
     def open_subkey(self, subkey_name):
         """Opens our direct child."""
-        for subkey in self.subkeys():
-            if unicode(subkey.Name).lower() == subkey_name.lower():
-                return subkey
+        sk_lists = self.SubKeyLists
+        for list_index, count in enumerate(self.SubKeyCounts):
+            if count > 0:
+                subkey = self.obj_profile._CM_KEY_INDEX(
+                    offset=sk_lists[list_index], vm=self.obj_vm,
+                    parent=self).find(subkey_name)
+
+                if subkey != None:
+                    return subkey
 
         return obj.NoneObject("Couldn't find subkey {0} of {1}",
                               subkey_name, self.Name)
@@ -383,6 +473,31 @@ class _CM_KEY_NODE(obj.Struct):
 
 
 
+def GetNameHint(signature, name):
+    """Calculate the hint stored with the key name in an lf or lh list.
+
+    lf lists store the first 4 characters of the name, while lh lists store a
+    hash of the upper cased name. We only calculate these for ascii names,
+    since Windows upper cases non ascii characters differently.
+
+    Returns:
+      The hint as an integer or None.
+    """
+    try:
+        name = utils.SmartUnicode(name).encode("ascii").upper()
+    except UnicodeError:
+        return None
+
+    if signature == _CM_KEY_INDEX.LF_SIG:
+        return struct.unpack("<I", name[:4].ljust(4, "\x00"))[0]
+
+    result = 0
+    for c in name:
+        result = (result * 37 + ord(c)) & 0xFFFFFFFF
+
+    return result
+
+
 class _CM_KEY_INDEX(obj.Struct):
     """This is a list of pointers to key nodes.
 
@@ -394,6 +509,61 @@ class _CM_KEY_INDEX(obj.Struct):
     LI_SIG = "li"
     NK_SIG = "nk"
 
+    def find(self, name):
+        """Find the key with this name (case insensitive) in the index.
+
+        lf and lh lists store a hint of the name with each pointer, so only
+        keys with a matching hint need to be read.
+        """
+        signature = self.Signature
+        if signature == self.RI_SIG:
+            for i in xrange(self.Count):
+                # This is a pointer to another _CM_KEY_INDEX
+                result = self.obj_profile._CM_KEY_INDEX(
+                    offset=self.List[i].v(), vm=self.obj_vm,
+                    parent=self.obj_parent).find(name)
+
+                if result != None:
+                    return result
+
+        elif signature == self.LH_SIG or signature == self.LF_SIG:
+            hint = GetNameHint(signature, name)
+            if hint is None:
+                return self._find_in_keys(self, name)
+
+            # The List contains alternating pointers/hash elements here.
+            count = self.Count.v()
+            key_list = self.List
+            data = self.obj_vm.read(key_list.obj_offset, count * 8)
+            hints = struct.unpack(
+                "<%dI" % (count * 2), data.ljust(count * 8, "\x00"))[1::2]
+
+            if signature == self.LF_SIG:
+                # Compare the names case insensitively.
+                hints = [GetNameHint(signature, struct.pack("<I", x))
+                         for x in hints]
+
+            for i, key_hint in enumerate(hints):
+                if key_hint != hint:
+                    continue
+
+                nk = key_list[i * 2]
+                if (nk.Signature == self.NK_SIG and
+                        unicode(nk.Name).lower() == name.lower()):
+                    return nk
+
+        else:
+            return self._find_in_keys(self, name)
+
+        return obj.NoneObject("Key %s not found", name)
+
+    def _find_in_keys(self, keys, name):
+        for nk in keys:
+            if unicode(nk.Name).lower() == name.lower():
+                return nk
+
+        return obj.NoneObject("Key %s not found", name)
+
     def __iter__(self):
         """Iterate over all the keys in the index.
 
@@ -411,10 +581,9 @@ class _CM_KEY_INDEX(obj.Struct):
         elif self.Signature == self.RI_SIG:
             for i in xrange(self.Count):
                 # This is a pointer to another _CM_KEY_INDEX
-                for subkey in self.obj_profile.Object(
-                        "Pointer32", offset=self.List[i].v(),
-                        vm=self.obj_vm, parent=self.obj_parent,
-                        target="_CM_KEY_INDEX"):
+                for subkey in self.obj_profile._CM_KEY_INDEX(
+                        offset=self.List[i].v(), vm=self.obj_vm,
+                        parent=self.obj_parent):
                     if subkey.Signature == self.NK_SIG:
                         yield subkey
 
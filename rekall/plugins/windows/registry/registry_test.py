@@ -0,0 +1,233 @@
+import struct
+
+from rekall import addrspace
+from rekall import session
+from rekall import testlib
+from rekall.plugins.overlays import basic
+from rekall.plugins.windows.registry import registry
+
+
+class RegistryTestProfile(basic.ProfileLLP64, basic.BasicClasses):
+    """A profile with just enough of the registry structs."""
+
+    @classmethod
+    def Initialize(cls, profile):
+        super(RegistryTestProfile, cls).Initialize(profile)
+        profile.add_types({
+            '_CM_KEY_NODE': [0x50, {
+                'Signature': [0x0, ['unsigned short']],
+                'Flags': [0x2, ['unsigned short']],
+                'LastWriteTime': [0x4, ['unsigned long long']],
+                'Parent': [0x10, ['unsigned long']],
+                'SubKeyCounts': [0x14, ['Array', dict(
+                    count=2, target='unsigned long')]],
+                'SubKeyLists': [0x1c, ['Array', dict(
+                    count=2, target='unsigned long')]],
+                'ValueList': [0x24, ['_CHILD_LIST']],
+                'NameLength': [0x48, ['unsigned short']],
+                'Name': [0x4c, ['unsigned short']],
+            }],
+            '_CHILD_LIST': [0x8, {
+                'Count': [0x0, ['unsigned long']],
+                'List': [0x4, ['unsigned long']],
+            }],
+            '_CM_KEY_INDEX': [0x8, {
+                'Signature': [0x0, ['unsigned short']],
+                'Count': [0x2, ['unsigned short']],
+                'List': [0x4, ['unsigned long']],
+            }],
+            '_CMHIVE': [0x30, {
+                'Hive': [0x0, ['_HHIVE']],
+            }],
+            '_HHIVE': [0x30, {
+                'BaseBlock': [0x0, ['Pointer', dict(target='Void')]],
+                'Flat': [0x8, ['unsigned char']],
+                'Storage': [0x10, ['Array', dict(count=2, target='_DUAL')]],
+            }],
+            '_DUAL': [0x10, {
+                'Length': [0x0, ['unsigned long']],
+                'Map': [0x8, ['Pointer', dict(target='_HMAP_DIRECTORY')]],
+            }],
+            '_HMAP_DIRECTORY': [0x2000, {
+                'Directory': [0x0, ['Array', dict(
+                    count=0x400, target='Pointer',
+                    target_args=dict(target='_HMAP_TABLE'))]],
+            }],
+            '_HMAP_TABLE': [0x1000, {
+                'Table': [0x0, ['Array', dict(
+                    count=0x200, target='_HMAP_ENTRY')]],
+            }],
+            '_HMAP_ENTRY': [0x8, {
+                'BlockAddress': [0x0, ['unsigned long long']],
+            }],
+        })
+
+
+class HiveBuilder(object):
+    """Builds the cells of a hive."""
+
+    def __init__(self):
+        self.data = bytearray(0x2000)
+        self.next_cell = 0x100
+
+    def _Allocate(self, size):
+        offset = self.next_cell
+        self.next_cell += (size + 0xf) & ~0xf
+
+        return offset
+
+    def Key(self, name, subkey_list=0, subkey_count=0, offset=None):
+        if isinstance(name, unicode):
+            name, flags = name.encode("utf-16-le"), 0
+        else:
+            flags = 0x20
+
+        if offset is None:
+            offset = self._Allocate(0x50 + len(name))
+
+        struct.pack_into("<2sH", self.data, offset, "nk", flags)
+        struct.pack_into("<II", self.data, offset + 0x14, subkey_count, 0)
+        struct.pack_into("<II", self.data, offset + 0x1c, subkey_list, 0)
+        struct.pack_into("<H", self.data, offset + 0x48, len(name))
+        self.data[offset + 0x4c:offset + 0x4c + len(name)] = name
+
+        return offset
+
+    def Index(self, signature, entries, count=None):
+        offset = self._Allocate(4 + 4 * len(entries))
+        struct.pack_into("<2sH", self.data, offset, signature,
+                         len(entries) if count is None else count)
+        for i, entry in enumerate(entries):
+            struct.pack_into("<I", self.data, offset + 4 + i * 4, entry)
+
+        return offset
+
+    def HashIndex(self, signature, keys):
+        entries = []
+        for name, key in keys:
+            entries.append(key)
+            entries.append(registry.GetNameHint(signature, name) or 0)
+
+        # Hashed lists alternate key pointers and hints.
+        return self.Index(signature, entries, count=len(keys))
+
+
+class RegistryTest(testlib.RekallBaseUnitTestCase):
+
+    def setUp(self):
+        self.session = session.Session()
+        builder = HiveBuilder()
+
+        # The Software key has an ri list pointing at an lf list and an li
+        # list.
+        classes = builder.Key("Classes")
+        microsoft = builder.Key("Microsoft")
+        zeta = builder.Key("Zeta")
+        software = builder.Key("Software", subkey_count=3, subkey_list=(
+            builder.Index("ri", [
+                builder.HashIndex(registry._CM_KEY_INDEX.LF_SIG, [
+                    ("Classes", classes), ("Microsoft", microsoft)]),
+                builder.Index("li", [zeta])])))
+
+        keys = [("Select", builder.Key("Select")),
+                ("Software", software),
+                ("System", builder.Key("System")),
+                (u"Caf\xe9", builder.Key(u"Caf\xe9"))]
+
+        builder.Key("ROOT", offset=registry.Registry.ROOT_INDEX,
+                    subkey_count=len(keys),
+                    subkey_list=builder.HashIndex(
+                        registry._CM_KEY_INDEX.LH_SIG, keys))
+
+        base = addrspace.BufferAddressSpace(
+            data="regf".ljust(0x1004, "\x00") + str(builder.data),
+            session=self.session)
+        self.registry = registry.Registry(
+            session=self.session,
+            profile=RegistryTestProfile(session=self.session),
+            address_space=registry.HiveFileAddressSpace(
+                base=base, session=self.session))
+
+    def testNameHint(self):
+        self.assertEqual(registry.GetNameHint("lh", "ab"), 65 * 37 + 66)
+        self.assertEqual(registry.GetNameHint("lf", "Software"),
+                         struct.unpack("<I", "SOFT")[0])
+        self.assertEqual(registry.GetNameHint("lf", "ab"), 0x4241)
+        self.assertEqual(registry.GetNameHint("lh", u"caf\xe9"), None)
+
+    def testOpenKey(self):
+        for path in ["Select", "SOFTWARE", "system", u"caf\xe9",
+                     "Software/Classes", "software\\microsoft",
+                     "Software/ZETA"]:
+            key = self.registry.open_key(path)
+            self.assertEqual(unicode(key.Name).lower(),
+                             path.replace("\\", "/").split("/")[-1].lower())
+
+        for path in ["Missing", "Sys", "Software/Select", "Software/Zeta/X"]:
+            self.assertEqual(self.registry.open_key(path), None)
+
+        self.assertEqual(
+            sorted(unicode(x.Name) for x in self.registry.root.subkeys()),
+            [u"Caf\xe9", u"Select", u"Software", u"System"])
+        self.assertEqual(
+            [unicode(x.Name)
+             for x in self.registry.open_key("Software").subkeys()],
+            [u"Classes", u"Microsoft", u"Zeta"])
+
+
+class HiveAddressSpaceTest(testlib.RekallBaseUnitTestCase):
+    """Test reading a hive from memory through its cell map."""
+
+    # The virtual address of each block of the stable storage (0 if the block
+    # is not mapped). Blocks 0-2 are contiguous, blocks 3-4 are not mapped and
+    # blocks 5-6 are mapped but not contiguous with each other.
+    BLOCKS = [0x10000, 0x11000, 0x12000, 0, 0, 0x14000, 0x16000]
+
+    def setUp(self):
+        self.session = session.Session()
+        data = bytearray(0x20000)
+
+        # The _CMHIVE at 0x100, the base block at 0x1000, the map directory at
+        # 0x2000 and its first table at 0x4000.
+        struct.pack_into("<QB", data, 0x100, 0x1000, 0)
+        struct.pack_into("<IIQ", data, 0x110, len(self.BLOCKS) * 0x1000, 0,
+                         0x2000)
+        struct.pack_into("<Q", data, 0x2000, 0x4000)
+        for i, address in enumerate(self.BLOCKS):
+            struct.pack_into("<Q", data, 0x4000 + i * 8, address)
+
+        # Fill each page from the base block on with its page number.
+        for page in range(1, 0x20):
+            if page not in (2, 3, 4):
+                data[page * 0x1000:(page + 1) * 0x1000] = chr(page) * 0x1000
+
+        base = addrspace.BufferAddressSpace(
+            data=str(data), session=self.session)
+        self.hive_as = registry.HiveAddressSpace(
+            hive_addr=0x100, base=base, session=self.session,
+            profile=RegistryTestProfile(session=self.session))
+
+        # Split runs into chunks smaller than a run.
+        self.hive_as.SAVE_CHUNK_SIZE = 0x2000
+
+    def testBlockRuns(self):
+        self.assertEqual(list(self.hive_as.get_block_runs()),
+                         [(0, 0x10000, 0x3000),
+                          (0x3000, 0, 0x2000),
+                          (0x5000, 0x14000, 0x1000),
+                          (0x6000, 0x16000, 0x1000)])
+
+        self.assertEqual(
+            [(offset, data and data[0], length)
+             for offset, data, length in self.hive_as.read_runs()],
+            [(0, "\x10", 0x2000), (0x2000, "\x12", 0x1000),
+             (0x3000, None, 0x2000), (0x5000, "\x14", 0x1000),
+             (0x6000, "\x16", 0x1000)])
+
+    def testSave(self):
+        expected = "".join(
+            chr(address >> 12) * 0x1000 if address else "\0" * 0x1000
+            for address in [0x1000] + self.BLOCKS)
+
+        self.assertEqual("".join(self.hive_as.save()), expected)
+        self.assertEqual(self.hive_as.stats(), (2, 0, len(self.BLOCKS)))
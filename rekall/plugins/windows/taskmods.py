@@ -23,6 +23,7 @@
 
 # pylint: disable=protected-access
 
+from rekall import copier
 from rekall import testlib
 
 from rekall.plugins import core
@@ -144,15 +145,20 @@ class WinMemDump(core.DirectoryDumperMixin, WinMemMap):
                 ("Length", "length", "[addrpad]"),
                 ("Virtual Addr", "virtual", "[addrpad]")])
 
+            # The ranges are packed into the file.
+            ranges = []
+            file_address = fd.tell()
             for _ in task_as.get_available_addresses():
                 virt_address, phys_address, length = _
                 if not self.all and virt_address > highest_address:
                     break
 
-                data = self.physical_address_space.read(phys_address, length)
+                temp_renderer.table_row(file_address, length, virt_address)
+                ranges.append((phys_address, file_address, length))
+                file_address += length
 
-                temp_renderer.table_row(fd.tell(), length, virt_address)
-                fd.write(data)
+        copier.CopyRanges(self.physical_address_space, fd, ranges,
+                          session=self.session)
 
     def render(self, renderer):
         if self.dump_dir is None:
@@ -21,13 +21,56 @@
 __author__ = "Michael Cohen <scudette@gmail.com>"
 
 import acora
+import multiprocessing
+import os
 import re
 
 from rekall import addrspace
+from rekall import config
 from rekall import constants
 from rekall import registry
 
 
+config.DeclareOption(
+    "--scan_processes", default=0, type="IntParser",
+    help="Number of worker processes used to scan large address spaces. "
+    "0 or 1 scans in this process.")
+
+
+# The scanner currently run by the worker processes. Workers are forked from
+# the parent and therefore inherit the scanner (and its address space, profile
+# and checks) without having to pickle it.
+_PARALLEL_SCANNER = None
+
+
+def _InitScanWorker():
+    """Prepares a freshly forked worker process for scanning."""
+    scanner = _PARALLEL_SCANNER
+
+    # The worker must not report progress to the parent's renderer.
+    scanner.session.progress.callbacks.clear()
+
+    # File handles inherited from the parent share their file position with
+    # it, so they must not be used concurrently.
+    scanner.address_space.reopen()
+
+
+def _ScanShard(shard):
+    """Scans a single shard in a worker process.
+
+    Args:
+      shard: A tuple of (start, end, scan_end). Hits are reported for offsets
+        in [start, end), but data is scanned up to scan_end so that hits near
+        the end of the shard can still be matched.
+
+    Returns:
+      A list of (offset, hit) tuples.
+    """
+    start, end, scan_end = shard
+    return [(offset, hit) for offset, hit in _PARALLEL_SCANNER.scan_hits(
+        start, scan_end) if offset < end]
+
+
 class ScannerCheck(object):
     """ A scanner check is a special class which is invoked on an AS to check
     for a specific condition.
@@ -327,6 +370,14 @@ class BaseScanner(object):
 
     overlap = 1024
 
+    # Scanners which keep state between hits (e.g. the position within a
+    # signature) must scan the address space in order and therefore can not be
+    # run in parallel.
+    allow_parallel = True
+
+    # The amount of data each worker process scans at once.
+    shard_size = constants.SCAN_BLOCKSIZE * 10
+
     def scan(self, offset=0, maxlen=None):
         """Scan the region from offset for maxlen.
 
@@ -341,17 +392,165 @@ class BaseScanner(object):
         """
         maxlen = maxlen or 2**64
         end = offset + maxlen
-        overlap = ""
 
-        # Record the last reported hit to prevent multiple reporting of the same
-        # hits when using an overlap.
-        last_reported_hit = -1
+        # Workers inherit the scanner by forking, so this is not available on
+        # Windows.
+        processes = self.session.GetParameter("scan_processes")
+        if self.allow_parallel and processes > 1 and hasattr(os, "fork"):
+            hits = self.scan_hits_parallel(offset, end, processes)
+        else:
+            hits = self.scan_hits(offset, end)
+
+        for _, hit in hits:
+            result = self.process_hit(hit)
+            if result is not None:
+                yield result
+
+    def get_shards(self, offset, end):
+        """Partitions the address ranges between offset and end into shards.
+
+        Yields:
+          (start, end, scan_end) tuples as expected by _ScanShard(). Shards
+          cover up to self.shard_size bytes of mapped data. Each shard is
+          scanned self.overlap bytes past its end, so hits which straddle the
+          boundary between shards are not lost.
+        """
+        shard_start = None
+        shard_length = 0
+        for run_start, _, length in self.address_space.get_address_ranges(
+                start=offset, end=end):
+            run_start = max(run_start, offset)
+            run_end = min(run_start + length, end)
+            if shard_start is None:
+                shard_start = run_start
+
+            while run_start < run_end:
+                to_take = min(self.shard_size - shard_length,
+                              run_end - run_start)
+                run_start += to_take
+                shard_length += to_take
+
+                if shard_length >= self.shard_size:
+                    yield (shard_start, run_start,
+                           min(run_start + self.overlap, end))
+                    shard_start = run_start
+                    shard_length = 0
+
+        if shard_length:
+            yield shard_start, end, end
+
+    def scan_hits_parallel(self, offset, end, processes):
+        """Scans the region in a pool of worker processes.
+
+        Yields the same (offset, hit) tuples as scan_hits(), in offset order.
+        Each offset belongs to exactly one shard, so hits found in the overlap
+        between shards are only reported once.
+        """
+        global _PARALLEL_SCANNER  # pylint: disable=global-statement
+
+        shards = list(self.get_shards(offset, end))
+        if len(shards) < 2:
+            for hit in self.scan_hits(offset, end):
+                yield hit
+
+            return
+
+        _PARALLEL_SCANNER = self
+        pool = multiprocessing.Pool(processes, initializer=_InitScanWorker)
+        try:
+            for shard, hits in zip(shards, pool.imap(_ScanShard, shards)):
+                self.session.report_progress(
+                    self.progress_message % dict(
+                        offset=shard[0], name=self.__class__.__name__))
+
+                for hit in hits:
+                    yield hit
+
+            pool.close()
+        finally:
+            pool.terminate()
+            _PARALLEL_SCANNER = None
+
+    def scan_hits(self, offset, end):
+        """Scan the region between offset and end.
+
+        Yields:
+          (offset, hit) tuples, where hit is the result of check_addr().
+        """
+        self.start_scan()
+        for buffer_as in self.generate_buffers(offset, end):
+            for hit in self.scan_buffer(buffer_as):
+                yield hit
+
+    def process_hit(self, hit):
+        """Converts a hit from check_addr() into the result of scan().
 
+        Override this to post-process or filter hits. Returns None to drop the
+        hit.
+        """
+        return hit
+
+    def start_scan(self):
+        """Prepares the scanner for scanning a new sequence of buffers."""
         # Delay building the constraints so they can be added after scanner
         # construction.
         if self.constraints is None:
             self.build_constraints()
 
+        # Where to resume scanning, if we skipped past the end of the last
+        # buffer.
+        self.next_offset = None
+
+        # Record the last reported hit to prevent multiple reporting of the same
+        # hits when using an overlap.
+        self.last_reported_hit = -1
+
+    def scan_buffer(self, buffer_as):
+        """Runs the checks and skippers over the buffer.
+
+        Buffers passed in consecutive calls must be in increasing order, and
+        may overlap. Call start_scan() before the first buffer.
+
+        Yields:
+          (offset, hit) tuples, where hit is the result of check_addr().
+        """
+        scan_offset = buffer_as.base_offset
+        if self.next_offset is not None:
+            scan_offset = max(scan_offset, self.next_offset)
+
+        while scan_offset < buffer_as.end():
+            # Check the current offset for a match.
+            res = self.check_addr(scan_offset, buffer_as=buffer_as)
+
+            # Remove multiple matches in the overlap region which we have
+            # previously reported.
+            if res is not None and scan_offset > self.last_reported_hit:
+                self.last_reported_hit = scan_offset
+                yield scan_offset, res
+
+            # Skip as much data as the skippers tell us to, up to the end of
+            # the buffer.
+            scan_offset += min(len(buffer_as),
+                               self.skip(buffer_as, scan_offset))
+
+        # If we skipped past the end of this buffer, there is no need to check
+        # the overlap at the start of the next one.
+        self.next_offset = None
+        if scan_offset > buffer_as.end():
+            self.next_offset = scan_offset
+
+    def generate_buffers(self, offset, end):
+        """Reads the region between offset and end in blocks.
+
+        Yields:
+          A BufferAddressSpace which is reassigned with each block. If the data
+          is virtually contiguous, each block starts with the last self.overlap
+          bytes of the previous block.
+        """
+        # The number of bytes at the end of the previous buffer which must be
+        # scanned again at the start of the next buffer.
+        overlap_length = 0
+
         # We try to optimize the scanning by first merging contiguous ranges
         # and then passing up to constants.SCAN_BLOCKSIZE bytes to the checkers
         # and skippers.
@@ -363,6 +562,11 @@ class BaseScanner(object):
         # it's fully consumed. Overlap is applied only in this case, starting
         # from the second chunk.
         chunk_end = 0
+        phys_base = self.address_space.phys_base
+
+        # All checks receive offsets into this single buffer, which is
+        # reassigned for each block.
+        buffer_as = addrspace.BufferAddressSpace(session=self.session)
 
         for run in self.address_space.get_address_ranges(start=offset, end=end):
             range_start, phys_start, length = run
@@ -378,15 +582,10 @@ class BaseScanner(object):
 
             # Calculate where in the range we'll be reading data from.
             # Covers the case where offset falls within a range.
-            start = max(range_start, offset)
-
-            # Store where this chunk will start. Absolute offset.
-            chunk_offset = start
-
-            buffer_as = addrspace.BufferAddressSpace(session=self.session)
+            chunk_offset = max(range_start, offset)
 
-            # Keep scanning this range as long as the current chunk isn't
-            # past the end of the range or the end of the scanner.
+            # Keep reading this range as long as the current chunk isn't past
+            # the end of the range or the end of the scanner.
             while chunk_offset < end and chunk_offset < range_end:
                 if self.session:
                     self.session.report_progress(
@@ -398,9 +597,7 @@ class BaseScanner(object):
                 # means there is a gap in the virtual address space and
                 # therefore we should not use any overlap.
                 if chunk_offset != chunk_end:
-                    overlap = ""
-
-                chunk_offset = max(start, chunk_offset)
+                    overlap_length = 0
 
                 # Our chunk is SCAN_BLOCKSIZE long or as much data there's
                 # left in the range.
@@ -415,32 +612,28 @@ class BaseScanner(object):
 
                 phys_chunk_offset = phys_start + (chunk_offset - range_start)
 
+                if chunk_offset - overlap_length >= range_start:
+                    # The overlap comes from this run, so we just read it
+                    # again as part of the block. This is much cheaper than
+                    # copying the entire block to prepend the overlap to it.
+                    data = phys_base.read(phys_chunk_offset - overlap_length,
+                                          chunk_size + overlap_length)
+                else:
+                    # The previous run ended exactly where this one starts
+                    # but the data is not physically contiguous.
+                    data = (buffer_as.data[len(buffer_as) - overlap_length:] +
+                            phys_base.read(phys_chunk_offset, chunk_size))
+
                 # Consume the next block in this range.
                 buffer_as.assign_buffer(
-                    overlap + self.address_space.phys_base.read(
-                        phys_chunk_offset, chunk_size),
-                    base_offset=chunk_offset - len(overlap))
-
-                if self.overlap > 0:
-                    overlap = buffer_as.data[-self.overlap:]
+                    data, base_offset=chunk_offset - overlap_length)
 
-                scan_offset = buffer_as.base_offset
-                while scan_offset < buffer_as.end():
-                    # Check the current offset for a match.
-                    res = self.check_addr(scan_offset, buffer_as=buffer_as)
+                yield buffer_as
 
-                    # Remove multiple matches in the overlap region which we
-                    # have previously reported.
-                    if res is not None and scan_offset > last_reported_hit:
-                        last_reported_hit = scan_offset
-                        yield res
-
-                    # Skip as much data as the skippers tell us to, up to the
-                    # end of the buffer.
-                    scan_offset += min(len(buffer_as),
-                                       self.skip(buffer_as, scan_offset))
+                if self.overlap > 0:
+                    overlap_length = min(self.overlap, len(data))
 
-                chunk_offset = scan_offset
+                chunk_offset = chunk_end
 
 
 class MultiStringScanner(BaseScanner):
@@ -473,6 +666,9 @@ class MultiStringScanner(BaseScanner):
 class SignatureScanner(MultiStringScanner):
     checker_cls = SignatureScannerCheck
 
+    # The signature parts must be found in order.
+    allow_parallel = False
+
 
 class PointerScanner(BaseScanner):
     """Scan for a bunch of pointers at the same time.
@@ -509,7 +705,11 @@ class PointerScanner(BaseScanner):
 
 
 class ScannerGroup(BaseScanner):
-    """Runs a bunch of scanners in one pass over the image."""
+    """Runs a bunch of scanners in one pass over the image.
+
+    Each block of data is only read once, and every scanner runs its checks and
+    skippers over the same buffer.
+    """
 
     def __init__(self, scanners=None, **kwargs):
         """Create a new scanner group.
@@ -523,38 +723,31 @@ class ScannerGroup(BaseScanner):
         for scanner in scanners.values():
             scanner.address_space = self.address_space
 
-        # A dict to hold all hits for each scanner.
-        self.result = {}
+        # The blocks must overlap enough for all the scanners.
+        self.overlap = max([0] + [s.overlap for s in scanners.values()])
 
     def scan(self, offset=0, maxlen=None):
-        available_length = maxlen or self.profile.get_constant("MaxPointer")
-
-        while available_length > 0:
-            to_read = min(constants.SCAN_BLOCKSIZE + self.overlap,
-                          available_length)
-
-            # Now feed all the scanners from the same address space.
-            for name, scanner in self.scanners.items():
-                for hit in scanner.scan(offset=offset, maxlen=to_read):
-                    # Yield the result as well as cache it.
-                    yield name, hit
+        """Yields (name, hit) tuples for the hits of all scanners."""
+        maxlen = maxlen or self.profile.get_constant("MaxPointer")
+        scanners = sorted(self.scanners.items())
+        for _, scanner in scanners:
+            scanner.start_scan()
 
-            # Move to the next scan block.
-            offset += constants.SCAN_BLOCKSIZE
-            available_length -= constants.SCAN_BLOCKSIZE
+        for buffer_as in self.generate_buffers(offset, offset + maxlen):
+            # Now feed all the scanners from the same buffer.
+            for name, scanner in scanners:
+                for _, hit in scanner.scan_buffer(buffer_as):
+                    result = scanner.process_hit(hit)
+                    if result is not None:
+                        yield name, result
 
 
 class DiscontigScannerGroup(ScannerGroup):
-    """A scanner group which works over a virtual address space."""
+    """A scanner group which works over a virtual address space.
 
-    def scan(self, offset=0, maxlen=None):
-        maxlen = maxlen or self.profile.get_constant("MaxPointer")
-
-        for (start, _, length) in self.address_space.get_address_ranges(
-                offset, offset + maxlen):
-            for match in super(DiscontigScannerGroup, self).scan(
-                    start, maxlen=length):
-                yield match
+    ScannerGroup only reads the mapped address ranges, so this is the same as a
+    ScannerGroup.
+    """
 
 
 class DebugChecker(ScannerCheck):
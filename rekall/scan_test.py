@@ -0,0 +1,96 @@
+from rekall import addrspace_test
+from rekall import constants
+from rekall import scan
+from rekall import session
+from rekall import testlib
+
+
+class BaseScannerTest(testlib.RekallBaseUnitTestCase):
+    """Test the scanner's handling of blocks and overlaps."""
+
+    def setUp(self):
+        self.session = session.Session()
+        self.block_size = constants.SCAN_BLOCKSIZE
+        constants.SCAN_BLOCKSIZE = 0x100
+
+        data = ["-"] * 0x400
+        # Straddles a block boundary within a run.
+        data[0xfd:0x103] = "needle"
+        # Straddles the boundary between the two runs.
+        data[0x1fe:0x204] = "needle"
+        # Straddles the boundary to the last run which is not virtually
+        # contiguous.
+        data[0x2fe:0x304] = "needle"
+
+        # The second run is virtually contiguous but not physically
+        # contiguous with the first run. The third run is not virtually
+        # contiguous with the second.
+        self.address_space = addrspace_test.CustomRunsAddressSpace(
+            session=self.session,
+            data="".join(data[:0x200] + ["\x00"] * 0x800 + data[0x200:]),
+            runs=[(0x1000, 0, 0x200), (0x1200, 0xa00, 0x100),
+                  (0x1400, 0xb00, 0x100)])
+        self.address_space.phys_base = self.address_space.base
+
+    def tearDown(self):
+        constants.SCAN_BLOCKSIZE = self.block_size
+
+    def _Scan(self, **kwargs):
+        scanner = scan.BaseScanner(
+            address_space=self.address_space, session=self.session,
+            profile=object(),
+            checks=[("StringCheck", dict(needle="needle"))])
+        scanner.overlap = 0x10
+
+        return list(scanner.scan(**kwargs))
+
+    def testOverlap(self):
+        self.assertEqual(self._Scan(), [0x10fd, 0x11fe])
+        self.assertEqual(self._Scan(offset=0x1100), [0x11fe])
+        self.assertEqual(self._Scan(offset=0x1000, maxlen=0x100), [])
+
+    def testParallelScan(self):
+        expected = self._Scan()
+        with self.session:
+            self.session.SetParameter("scan_processes", 2)
+
+        scanner = scan.BaseScanner(
+            address_space=self.address_space, session=self.session,
+            profile=object(),
+            checks=[("StringCheck", dict(needle="needle"))])
+        scanner.overlap = 0x10
+
+        # Shard boundaries fall in the middle of both the hits.
+        scanner.shard_size = 0xff
+        self.assertEqual(list(scanner.get_shards(0, 2**64)),
+                         [(0x1000, 0x10ff, 0x110f), (0x10ff, 0x11fe, 0x120e),
+                          (0x11fe, 0x12fd, 0x130d), (0x12fd, 0x14fc, 0x150c),
+                          (0x14fc, 2**64, 2**64)])
+        self.assertEqual(list(scanner.scan()), expected)
+
+    def testScannerGroup(self):
+        scanners = {}
+        for needle in ["needle", "---ne"]:
+            scanners[needle] = scan.BaseScanner(
+                address_space=self.address_space, session=self.session,
+                profile=object(),
+                checks=[("StringCheck", dict(needle=needle))])
+
+        expected = sorted(
+            (name, hit) for name, scanner in scanners.items()
+            for hit in scanner.scan())
+
+        # Count the reads from the image.
+        reads = []
+        phys_base = self.address_space.phys_base
+        original_read = phys_base.read
+        phys_base.read = lambda addr, length: (
+            reads.append(addr) or original_read(addr, length))
+
+        group = scan.ScannerGroup(
+            scanners=scanners, address_space=self.address_space,
+            session=self.session, profile=object())
+
+        self.assertEqual(sorted(group.scan(maxlen=2**64)), expected)
+        # Each of the four blocks is only read once.
+        self.assertEqual(len(reads), 4)
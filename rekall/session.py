@@ -34,6 +34,8 @@ import sys
 import time
 import traceback
 
+from rekall import addrspace
+from rekall import cache
 from rekall import config
 from rekall import io_manager
 from rekall import kb
@@ -443,6 +445,14 @@ class Session(object):
         self.context_cache = {}
         self._repository_managers = []
 
+        # Data derived from the image (e.g. address range maps). This is
+        # optionally persisted between sessions.
+        self.image_cache = cache.ImageCache(session=self)
+        self.profile_data_cache = cache.ProfileCache(session=self)
+
+        # Hit/miss counters of the address translation caches.
+        self.translation_stats = addrspace.TranslationStatistics()
+
         # Store user configurable attributes here. These will be read/written to
         # the configuration file.
         self.state = Configuration(session=self)
@@ -496,6 +506,7 @@ class Session(object):
     def Reset(self):
         self.context_cache = {}
         self.profile_cache = {}
+        self.image_cache.Reset()
         self.physical_address_space = None
         self.kernel_address_space = None
         self.state.cache.clear()
@@ -768,7 +779,8 @@ class Session(object):
                                                       version=None,
                                                       session=self)
             result = obj.Profile.LoadProfileFromData(
-                container.GetData(os.path.basename(name)),
+                self.profile_data_cache.GetData(
+                    container.location, container, os.path.basename(name)),
                 self, name=name)
         except IOError:
             pass
@@ -787,7 +799,8 @@ class Session(object):
                         continue
 
                     result = obj.Profile.LoadProfileFromData(
-                        manager.GetData(name), self, name=name)
+                        self.profile_data_cache.GetData(path, manager, name),
+                        self, name=name)
                     if result:
                         self.logging.info(
                             "Loaded profile %s from %s", name, manager)
@@ -28,6 +28,8 @@ try:
 except Exception:  # curses sometimes raises weird exceptions.
     curses = None
 
+import heapq
+import marshal
 import re
 import os
 import subprocess
@@ -56,6 +58,12 @@ config.DeclareOption(
     group="Interface", help="Color control. If set to auto only output "
     "colors when connected to a terminal.")
 
+config.DeclareOption(
+    "--sort_buffer_rows", default=100000, type="IntParser", group="Interface",
+    help="The number of rows of a sorted table which are kept in memory. "
+    "Beyond this, sorted runs of rows are written to temporary files and "
+    "merged when the table is complete. 0 keeps all rows in memory.")
+
 
 HIGHLIGHT_SCHEME = dict(
     important=(u"WHITE", u"RED"),
@@ -1059,6 +1067,41 @@ class TextColumn(object):
         return self.options.get("name") or self.options.get("cname", "")
 
 
+def _SortKey(value):
+    """Converts a cell value into a primitive value to sort on.
+
+    Primitive keys can be compared without calling into the objects, and can
+    be written to disk with the rendered row.
+    """
+    if value is None or isinstance(value, (int, long, float, basestring)):
+        return value
+
+    if isinstance(value, (list, tuple)):
+        return tuple(_SortKey(x) for x in value)
+
+    # Rekall objects sort by their value.
+    v = getattr(value, "v", None)
+    if callable(v):
+        result = v()
+        if isinstance(result, (int, long, float, basestring)):
+            return result
+
+        if result == None:
+            return None
+
+    return utils.SmartUnicode(value)
+
+
+def _ReadSortedRun(fd):
+    """Yields the rows written to a sorted run file."""
+    fd.seek(0)
+    while True:
+        try:
+            yield marshal.load(fd)
+        except EOFError:
+            return
+
+
 class TextTable(renderer_module.BaseTable):
     """A table is a collection of columns.
 
@@ -1067,6 +1110,7 @@ class TextTable(renderer_module.BaseTable):
 
     column_class = TextColumn
     deferred_rows = None
+    sorted_runs = ()
 
     def __init__(self, **options):
         super(TextTable, self).__init__(**options)
@@ -1085,8 +1129,15 @@ class TextTable(renderer_module.BaseTable):
         self.sort_key_func = self._build_sort_key_function(options.get("sort"))
 
         if self.sort_key_func:
+            # A list of (key, sequence, row, options) for rows not yet sorted.
             self.deferred_rows = []
 
+            # Temporary files containing sorted runs of rendered rows.
+            self.sorted_runs = []
+            self.row_count = 0
+            self.sort_buffer_rows = self.session.GetParameter(
+                "sort_buffer_rows", 100000)
+
     def _build_sort_key_function(self, sort_cnames):
         """Builds a function that takes a row and returns keys to sort on."""
         if not sort_cnames:
@@ -1099,7 +1150,8 @@ class TextTable(renderer_module.BaseTable):
         sort_indices = [cnames_to_indices[x] for x in sort_cnames]
 
         # Row is a tuple of (values, kwargs) - hence row[0][index].
-        return lambda row: [row[0][index] for index in sort_indices]
+        return lambda row: tuple(_SortKey(row[0][index])
+                                 for index in sort_indices)
 
     def write_row(self, *cells, **kwargs):
         """Writes a row of the table.
@@ -1108,12 +1160,16 @@ class TextTable(renderer_module.BaseTable):
           cells: A list of cell contents. Each cell content is a list of lines
             in the cell.
         """
-        highlight = kwargs.pop("highlight", None)
+        self.write_lines(
+            JoinedCell(tablesep=self.options.get("tablesep"), *cells),
+            highlight=kwargs.pop("highlight", None))
+
+    def write_lines(self, lines, highlight=None):
+        """Writes the lines of an already rendered row."""
         foreground, background = HIGHLIGHT_SCHEME.get(
             highlight, (None, None))
 
-        # Iterate over all lines in the row and write it out.
-        for line in JoinedCell(tablesep=self.options.get("tablesep"), *cells):
+        for line in lines:
             self.renderer.write(
                 self.renderer.colorizer.Render(
                     line, foreground=foreground, background=background) + "\n")
@@ -1146,15 +1202,53 @@ class TextTable(renderer_module.BaseTable):
             return self.write_row(self.get_row(*row, **options),
                                   highlight=highlight)
         else:
-            self.deferred_rows.append((row, options))
+            # Extract the sort key only once. The sequence number keeps the
+            # sort stable, and ensures rows are never compared.
+            self.deferred_rows.append(
+                (self.sort_key_func((row, options)), self.row_count, row,
+                 options))
+            self.row_count += 1
+
+            if 0 < self.sort_buffer_rows <= len(self.deferred_rows):
+                self._spill_sorted_run()
+
+    def _render_lines(self, row, options):
+        return list(JoinedCell(self.get_row(*row, **options),
+                               tablesep=self.options.get("tablesep")))
+
+    def _iterate_sorted_rows(self):
+        """Sorts the deferred rows and yields (key, sequence, lines)."""
+        self.session.report_progress("TextRenderer: sorting %(spinner)s")
+        self.deferred_rows.sort()
+        for key, sequence, row, options in self.deferred_rows:
+            yield key, sequence, self._render_lines(row, options)
+
+        self.deferred_rows = []
+
+    def _spill_sorted_run(self):
+        """Writes the deferred rows to a temporary file as a sorted run.
+
+        Rows are rendered before writing, so they do not need to be formatted
+        again when merging.
+        """
+        fd = tempfile.TemporaryFile()
+        for entry in self._iterate_sorted_rows():
+            marshal.dump(entry, fd)
+
+        self.sorted_runs.append(fd)
 
     def flush(self):
-        if self.deferred_rows:
-            self.session.report_progress("TextRenderer: sorting %(spinner)s")
-            self.deferred_rows.sort(key=self.sort_key_func)
+        if self.deferred_rows or self.sorted_runs:
+            runs = [_ReadSortedRun(fd) for fd in self.sorted_runs]
+            runs.append(self._iterate_sorted_rows())
+
+            for _, _, lines in heapq.merge(*runs):
+                self.write_lines(lines)
+
+            for fd in self.sorted_runs:
+                fd.close()
 
-            for row, options in self.deferred_rows:
-                self.write_row(self.get_row(*row, **options))
+            self.sorted_runs = []
 
 
 class UnicodeWrapper(object):
@@ -1,3 +1,6 @@
+import StringIO
+
+from rekall import session
 from rekall import testlib
 
 from rekall.ui import text
@@ -39,3 +42,39 @@ class CellTest(testlib.RekallBaseUnitTestCase):
     def testPreserveNewLines(self):
         c1 = text.Cell(value="Hello,\n world!")
         self.assertEqual(c1.lines[0], "Hello, ")
+
+
+class TextTableTest(testlib.RekallBaseUnitTestCase):
+
+    def _Render(self, rows, sort_buffer_rows, sort=("key",)):
+        s = session.Session()
+        with s:
+            s.SetParameter("sort_buffer_rows", sort_buffer_rows)
+
+        fd = StringIO.StringIO()
+        renderer = text.TextRenderer(session=s, fd=fd)
+        renderer.start()
+        renderer.table_header([dict(name="Key", cname="key", width=4),
+                               dict(name="Value", cname="value", width=6)],
+                              sort=sort)
+        for row in rows:
+            renderer.table_row(*row)
+
+        renderer.end()
+
+        return fd.getvalue().splitlines()[2:]
+
+    def testSortedRuns(self):
+        rows = [(i * 7 % 5, "row%d" % i) for i in range(20)]
+        expected = self._Render(rows, 0)
+        self.assertEqual(expected[:2], ["0    row0  ", "0    row5  "])
+        self.assertEqual(len(expected), 20)
+
+        # Spilling sorted runs to disk gives the same (stable) output.
+        self.assertEqual(self._Render(rows, 3), expected)
+
+    def testUnsorted(self):
+        rows = [(i * 7 % 5, "row%d" % i) for i in range(4)]
+        self.assertEqual(self._Render(rows, 0, sort=None),
+                         ["0    row0  ", "2    row1  ", "4    row2  ",
+                          "1    row3  "])
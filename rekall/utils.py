@@ -22,6 +22,7 @@
 
 """These are various utilities for rekall."""
 import __builtin__
+import array
 import bisect
 import importlib
 import itertools
@@ -620,6 +621,18 @@ def EnumerationFromDefines(text):
     return result
 
 
+def Uint64Array(initializer=()):
+    """Returns a compact sequence of unsigned 64 bit integers.
+
+    Python 2's array module has no "Q" typecode. On LP64 platforms "L" is 64
+    bits wide, otherwise we fall back to a plain list.
+    """
+    if array.array("L").itemsize == 8:
+        return array.array("L", initializer)
+
+    return list(initializer)
+
+
 # The following is from
 # http://code.activestate.com/recipes/577197-sortedcollection/
 # Created by Raymond Hettinger on Fri, 16 Apr 2010 (MIT)
@@ -877,21 +890,20 @@ def CopyFDs(in_fd, out_fd, length=2**64):
 
 def CopyAStoFD(in_as, out_fd, start=0, length=2**64, cb=lambda x: None):
     """Copy an address space into a file-like object."""
-    blocksize = 1024 * 1024
-
-    for range_offset, _, range_length in in_as.get_available_addresses(
-            start=start):
-        range_end = range_offset + range_length
+    # Imported here so this module does not depend on the copier's options.
+    from rekall import copier
 
-        for offset in xrange(range_offset, range_end, blocksize):
-            to_read = min(blocksize, range_end - offset, length)
-            data = in_as.read(offset, to_read)
+    def _Ranges(length):
+        for range_offset, _, range_length in in_as.get_available_addresses(
+                start=start):
+            if length <= 0:
+                break
 
-            out_fd.seek(offset)
-            out_fd.write(data)
-            length -= len(data)
+            range_length = min(range_length, length)
+            yield range_offset, range_offset, range_length
+            length -= range_length
 
-            cb(offset)
+    copier.CopyRanges(in_as, out_fd, _Ranges(length), progress=cb)
 
 
 def issubclass(obj, cls):    # pylint: disable=redefined-builtin